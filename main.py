@@ -1,13 +1,40 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup,
+                      InlineQueryResultArticle, InputTextMessageContent, Bot)
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (Updater, CommandHandler, CallbackQueryHandler,
-                          MessageHandler, Filters, CallbackContext, ConversationHandler)
+                          MessageHandler, Filters, CallbackContext, ConversationHandler,
+                          InlineQueryHandler, Dispatcher, JobQueue, BasePersistence)
+from telegram.utils.request import Request
 import mysql.connector
 from mysql.connector import Error
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from data import token, adminId, bd_password
 from dotenv import load_dotenv
 import os
+import sys
+import re
+import io
+import csv
+import json
+import hashlib
+import tempfile
+import threading
+import time
+import bisect
+import random
+import functools
+import hmac
+import secrets
+import signal
+from queue import Queue, Full
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import multiprocessing
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 load_dotenv()  # Загружает переменные из .env
 # Настройки базы данных
@@ -18,6 +45,43 @@ DB_CONFIG = {
     'database': 'freelance_bot'
 }
 
+# Необязательная реплика для чтения: просмотр заказов, истории и профилей уходит на нее
+REPLICA_DB_CONFIG = {
+    'host': os.getenv('DB_REPLICA_HOST'),
+    'port': int(os.getenv('DB_REPLICA_PORT', 3306)),
+    'user': os.getenv('DB_REPLICA_USER', DB_CONFIG['user']),
+    'password': os.getenv('DB_REPLICA_PASSWORD', bd_password),
+    'database': DB_CONFIG['database']
+} if os.getenv('DB_REPLICA_HOST') else None
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 5))  # Сколько читать с основной после записи
+REPLICA_MAX_LAG_SECONDS = int(os.getenv('REPLICA_MAX_LAG_SECONDS', 3))  # При большем отставании читаем с основной
+REPLICA_LAG_CHECK_INTERVAL = 5  # Как часто проверять отставание реплики, в секундах
+
+# Повтор транзакций при временных ошибках: взаимоблокировка и ожидание блокировки повторяются всегда
+# (транзакция еще не зафиксирована), потеря соединения — только для идемпотентных помощников,
+# иначе после обрыва на COMMIT изменение можно применить дважды
+DB_RETRY_ATTEMPTS = int(os.getenv('DB_RETRY_ATTEMPTS', 4))  # Всего попыток, включая первую
+DB_RETRY_BASE_DELAY = float(os.getenv('DB_RETRY_BASE_DELAY', 0.05))  # В секундах, удваивается с каждой попыткой
+DB_RETRY_MAX_DELAY = 1.0
+DB_RETRYABLE_ERRORS = {1213: 'deadlock', 1205: 'lock_wait'}
+DB_CONNECTION_LOST_ERRORS = {2006, 2013, 2055}  # MySQL server has gone away, Lost connection
+
+# Автомат отключения: после DB_BREAKER_THRESHOLD неудачных подключений подряд бот не подключается к базе
+# DB_BREAKER_COOLDOWN секунд, затем пробует одним соединением. Пока база недоступна, экраны показываются
+# из последних прочитанных данных, а операции с деньгами отклоняются
+DB_BREAKER_THRESHOLD = int(os.getenv('DB_BREAKER_THRESHOLD', 5))
+DB_BREAKER_COOLDOWN = int(os.getenv('DB_BREAKER_COOLDOWN', 15))  # В секундах
+LAST_KNOWN_CACHE_SIZE = 10000  # Последних результатов на каждый помощник чтения
+READ_ONLY_BANNER = "⚠️ Сервис временно работает только на чтение, данные могут быть неактуальны.\n\n"
+READ_ONLY_MONEY_TEXT = "⛔ База данных временно недоступна, операции с балансом приостановлены. Попробуйте позже."
+READ_ONLY_WRITE_TEXT = "⛔ База данных временно недоступна, действие не выполнено. Попробуйте позже."
+# Кнопки, которые начинают или проводят операции с деньгами
+MONEY_CALLBACKS = ('withdraw', 'deposit', 'confirm_deposit_', 'notify_user_', 'payout_paid_', 'create_order',
+                   'confirm_order', 'bulk_orders', 'bulk_confirm', 'client_approve_', 'admin_final_approve_',
+                   'admin_reject_')
+# Кнопки, которые проверяют статус пользователя перед записью: без базы бан нельзя проверить
+STATUS_CHECKED_CALLBACKS = ('accept_', 'submit_')
+
 ADMIN_ID = adminId
 
 # Настройка логирования
@@ -32,16 +96,548 @@ logging.getLogger('mysql.connector').setLevel(logging.WARNING)
 ENTER_AMOUNT, SELECT_METHOD, ENTER_DETAILS = range(3)
 DEPOSIT_FIO, DEPOSIT_PHONE, DEPOSIT_BANK, DEPOSIT_AMOUNT = range(4, 8)
 
+# Поиск по бирже заказов
+SEARCH_MIN_WORD_LENGTH = 3  # Совпадает с innodb_ft_min_token_size по умолчанию
+SEARCH_PER_PAGE = 5
+
+# Лента заказов
+MAX_ACTIVE_ASSIGNMENTS = 5  # Сколько заказов исполнитель может выполнять одновременно
+FEED_CACHE_TTL = 30  # Время жизни кэша исключений исполнителя, в секундах
+FEED_RECONCILE_INTERVAL = int(os.getenv('FEED_RECONCILE_INTERVAL', 300))  # Сверка ленты с базой, в секундах
+ORDER_CACHE_SIZE = int(os.getenv('ORDER_CACHE_SIZE', 1000))  # Сколько заказов держать в LRU-кэше
+ORDER_CACHE_TTL = 60  # Страховка от устаревших строк, прочитанных с реплики или измененных другим процессом
+
+# Способ получения обновлений: 'polling' (getUpdates) или 'webhook' (встроенный HTTP-сервер)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес, который регистрируется в Telegram
+# Сверяется с заголовком X-Telegram-Bot-Api-Secret-Token. Если не задан, генерируется при запуске:
+# без секрета любой, кто знает адрес, мог бы прислать поддельное обновление от имени модератора
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))  # При заполнении отвечаем 503, Telegram повторит
+WEBHOOK_MAX_BODY = 1024 * 1024
+# Метрики отдаются отдельным сервером, по умолчанию только на локальном интерфейсе. 0 — не запускать
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
+DISPATCHER_WORKERS = 4
+# Параллельная обработка: обновления одного пользователя всегда попадают в один поток и идут по порядку.
+# 0 — стандартный последовательный диспетчер
+DISPATCH_SHARDS = int(os.getenv('DISPATCH_SHARDS', 0))
+DISPATCH_SHARD_QUEUE_SIZE = int(os.getenv('DISPATCH_SHARD_QUEUE_SIZE', 100))
+# Несколько процессов за одним вебхуком: обновления пользователя всегда попадают в процесс user_id % BOT_PROCESSES
+BOT_PROCESSES = int(os.getenv('BOT_PROCESSES', 1))
+CACHE_SYNC_INTERVAL = int(os.getenv('CACHE_SYNC_INTERVAL', 2))  # Как часто процессы сверяют версии кэшей, в секундах
+FEED_CHANGES_BATCH = 500  # Больше изменений ленты за одну сверку — процесс перезагружает ленту целиком
+FEED_CHANGES_RETENTION = 3600  # Сколько хранить журнал изменений ленты, в секундах
+
+# Инлайн-поиск заказов (@бот запрос)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 30))  # Сколько секунд Telegram кэширует ответ
+INLINE_RESULTS_LIMIT = 50  # Максимум результатов в одном ответе Telegram
+INLINE_QUERY_CACHE_SIZE = 256  # Сколько последних запросов хранить с готовыми результатами
+
+# Очередь модерации
+MODERATOR_IDS = {ADMIN_ID} | {int(x) for x in os.getenv('MODERATOR_IDS', '').split(',') if x.strip()}
+MODERATION_LEASE_SECONDS = int(os.getenv('MODERATION_LEASE_SECONDS', 600))  # Время закрепления элемента
+QUEUE_PER_PAGE = 5
+
+# Массовые рассылки
+BULK_SEND_RATE = 25  # Сообщений в секунду (лимит Telegram — около 30)
+
+# Сверка банковской выписки
+STATEMENT_COLUMNS = {
+    'amount': ('сумма', 'amount', 'сумма операции', 'сумма зачисления'),
+    'phone': ('телефон', 'phone', 'номер телефона'),
+    'fio': ('фио', 'fio', 'плательщик', 'отправитель', 'payer')
+}
+STATEMENT_REPORT_LIMIT = 10  # Сколько несовпавших строк показывать в отчете
+
+# Ограничения заказа: одни и те же при создании по одному и из CSV
+MAX_ACTIVE_ORDERS = 10  # Сколько активных заказов может быть у заказчика одновременно
+ORDER_MAX_QUANTITY = 1000  # Исполнителей на один заказ
+ORDER_MAX_DEADLINE = 24 * 30  # Срок выполнения, в часах
+
+# Массовое создание заказов из CSV
+BULK_ORDER_COLUMNS = {
+    'title': ('название', 'title'),
+    'price': ('цена', 'price'),
+    'quantity': ('количество', 'quantity'),
+    'deadline': ('срок', 'deadline'),
+    'description': ('описание', 'description')
+}
+BULK_ORDERS_MAX_ROWS = MAX_ACTIVE_ORDERS  # Строк в одном файле: больше все равно не уложится в лимит активных заказов
+BULK_ORDERS_ERRORS_LIMIT = 10  # Сколько ошибок показывать в отчете
+
+# Пакеты выплат
+PAYOUT_BATCH_LIMIT = int(os.getenv('PAYOUT_BATCH_LIMIT', 1000))  # Максимум платежей в одном пакете
+PAYOUT_NOTIFICATION = ("✅ Средства были переведены на ваши реквизиты. Если вы не получили деньги, "
+                       "пожалуйста, обратитесь в поддержку бота - @kirillrakitin")
+
+HISTORY_PER_PAGE = 10
+DEADLINE_CHECK_INTERVAL = 60  # Как часто отменять просроченные заказы, в секундах
+
+
+# Напоминания о сроке: когда осталась доля времени на заказ или фиксированное время, например '25%,1h,30m'
+DEADLINE_REMINDERS = os.getenv('DEADLINE_REMINDERS', '25%,1h')
+REMINDER_CHECK_INTERVAL = int(os.getenv('REMINDER_CHECK_INTERVAL', 300))  # В секундах
+
+# Работы, которые заказчик не проверил за REVIEW_SLA_HOURS, принимаются автоматически ('approve')
+# или передаются администратору ('escalate')
+REVIEW_SLA_HOURS = int(os.getenv('REVIEW_SLA_HOURS', 48))
+REVIEW_SLA_ACTION = os.getenv('REVIEW_SLA_ACTION', 'escalate')
+REVIEW_SWEEP_INTERVAL = int(os.getenv('REVIEW_SWEEP_INTERVAL', 600))  # В секундах
+REVIEW_SWEEP_BATCH = 200  # Сколько работ обрабатывать за один проход
+
+# Какие счетчики репутации исполнителя увеличивает переход принятого заказа в статус
+WORKER_STATUS_COUNTERS = {
+    'completed': 'completed_count',
+    'under_review': 'disputed_count',
+    'canceled': 'cancelled_count'
+}
+
+# Какое решение по сданной работе означает переход принятого заказа в статус
+SUBMISSION_DECISIONS = {
+    'completed': 'approved',
+    'under_review': 'disputed'
+}
+
+# Сводка /stats: период по умолчанию и наибольший допустимый, в днях
+STATS_DEFAULT_DAYS = 7
+STATS_MAX_DAYS = 90
+
+# Фильтр Блума перед индексом хэшей ссылок: 2^20 бит (128 КБ) и 7 хэш-функций
+# дают около 1% ложных срабатываний на 100 тыс. ссылок
+LINK_BLOOM_BITS = 1 << 20
+LINK_BLOOM_HASHES = 7
+DUPLICATES_REPORT_LIMIT = 20
+
+# Потоковая оценка исполнителей: скользящее окно событий и пороги, после которых
+# исполнитель автоматически помечается как подозрительный
+FRAUD_WINDOW_SECONDS = int(os.getenv('FRAUD_WINDOW_SECONDS', 3600))
+FRAUD_MAX_ACCEPTS = int(os.getenv('FRAUD_MAX_ACCEPTS', 10))  # Принятых заказов за окно
+FRAUD_CANCEL_RATIO = float(os.getenv('FRAUD_CANCEL_RATIO', 0.6))  # Доля отмен от принятых
+FRAUD_MIN_ACCEPTS_FOR_RATIO = 5  # Минимум принятых заказов, чтобы считать долю отмен
+FRAUD_FAST_SUBMIT_SECONDS = int(os.getenv('FRAUD_FAST_SUBMIT_SECONDS', 120))  # "Слишком быстрая" сдача
+FRAUD_MAX_FAST_SUBMITS = 3
+FRAUD_MAX_TRACKED_WORKERS = 10000  # Дольше всех неактивные исполнители вытесняются
+FRAUD_MAX_EVENTS_PER_WORKER = 200
+
+# Потоки для асинхронных подписчиков событий. Один поток сохраняет порядок уведомлений
+# и общий предел BULK_SEND_RATE для рассылок из подписчиков
+EVENT_WORKERS = int(os.getenv('EVENT_WORKERS', 1))
+
+# Транспорт Bot API. Общий пул соединений рассчитан на все потоки, которые обращаются к Telegram:
+# обработчики, очереди параллельного диспетчера, подписчики событий, JobQueue и служебные потоки.
+# getUpdates идет через отдельное соединение и не занимает пул на время длинного опроса
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', DISPATCHER_WORKERS + DISPATCH_SHARDS + EVENT_WORKERS + 4))
+BOT_API_CONNECT_TIMEOUT = float(os.getenv('BOT_API_CONNECT_TIMEOUT', 5))  # В секундах
+BOT_API_READ_TIMEOUT = float(os.getenv('BOT_API_READ_TIMEOUT', 10))  # В секундах
+BOT_API_POLL_TIMEOUT = int(os.getenv('BOT_API_POLL_TIMEOUT', 10))  # Длинный опрос getUpdates, в секундах
+
+
+# ========== СОБЫТИЯ ==========
+
+# События публикуются после фиксации транзакции. Синхронные подписчики (кэши, счетчики, проверки)
+# выполняются сразу в потоке публикации, асинхронные (уведомления) — в пуле потоков
+@dataclass(frozen=True)
+class OrderCreated:
+    order_id: int
+    user_id: int
+
+
+# Заказы из файла публикуются одним событием, чтобы лента и версия кэша обновлялись один раз на пакет
+@dataclass(frozen=True)
+class OrdersCreated:
+    order_ids: tuple
+    user_id: int
+
+
+@dataclass(frozen=True)
+class OrderApproved:
+    order_id: int
+
+
+@dataclass(frozen=True)
+class AssignmentAccepted:
+    order_id: int
+    worker_id: int
+
+
+@dataclass(frozen=True)
+class WorkSubmitted:
+    order_id: int
+    worker_id: int
+    link: str
+    link_hash: str
+    previous_uses: int  # Сколько раз ссылка сдавалась до этой отправки
+    previous_workers: int
+
+
+@dataclass(frozen=True)
+class WorkApproved:
+    order_id: int
+    worker_id: int
+    client_id: int
+    title: str
+    price: Decimal
+    quantity: int
+    decided_by: str  # 'client', 'admin' или 'timeout'
+
+
+@dataclass(frozen=True)
+class WorkRejected:
+    order_id: int
+    worker_id: int
+    client_id: int
+    title: str
+
+
+@dataclass(frozen=True)
+class DepositConfirmed:
+    deposit_id: int
+    user_id: int
+    amount: Decimal
+
+
+@dataclass(frozen=True)
+class WithdrawalRequested:
+    payment_id: int
+    user_id: int
+    user_name: str
+    amount: Decimal
+    method: str
+    details: str
+
+
+_subscribers = defaultdict(list)  # тип события -> [(обработчик, асинхронный), ...]
+_event_executor = ThreadPoolExecutor(max_workers=EVENT_WORKERS, thread_name_prefix='events')
+_event_context = {'bot': None}  # Бот для подписчиков-уведомлений, задается в setup_dispatcher
+
+
+def subscribe(event_type, run_async=False):
+    """Декоратор: подписывает функцию на событие. Подписчики вызываются в порядке подписки"""
+    def decorator(handler):
+        _subscribers[event_type].append((handler, run_async))
+        return handler
+    return decorator
+
+
+def _run_subscriber(handler, event):
+    """Вызывает подписчика; его ошибка не должна мешать остальным и публикующему коду"""
+    try:
+        handler(event)
+    except Exception as e:
+        logger.error(f"Ошибка подписчика {handler.__name__} на {type(event).__name__}: {e}")
+
+
+def publish(event):
+    """Публикует событие: сначала все синхронные подписчики, затем асинхронные"""
+    subscribers = _subscribers.get(type(event), [])
+    # Событие публикуется после фиксации транзакции, часто изнутри помощника с @db_retry. Его политика
+    # повторов к подписчикам не относится: их помощники БД должны повторять свои транзакции сами
+    outer_policy = getattr(_db_retry_local, 'policy', None)
+    _db_retry_local.policy = None
+    try:
+        for handler, run_async in subscribers:
+            if not run_async:
+                _run_subscriber(handler, event)
+    finally:
+        _db_retry_local.policy = outer_policy
+    for handler, run_async in subscribers:
+        if run_async:
+            _event_executor.submit(_run_subscriber, handler, event)
+
 
 # ========== ФУНКЦИИ РАБОТЫ С БАЗОЙ ДАННЫХ ==========
 
+_db_breaker = {'state': 'closed', 'failures': 0, 'opened_at': 0.0}  # 'closed', 'open' или 'half_open'
+_db_breaker_lock = threading.Lock()
+_db_call_state = threading.local()  # failed — текущий вызов помощника не смог обратиться к базе
+
+
+def _breaker_allows_connect():
+    """Разрешает подключение: всегда при замкнутом автомате, после паузы — одной пробной попытке"""
+    with _db_breaker_lock:
+        if _db_breaker['state'] == 'closed':
+            return True
+        if _db_breaker['state'] == 'open' and time.monotonic() - _db_breaker['opened_at'] >= DB_BREAKER_COOLDOWN:
+            _db_breaker['state'] = 'half_open'
+            return True
+        return False
+
+
+def record_db_failure():
+    """Учитывает недоступность базы: подряд идущие сбои размыкают автомат, неудачная проба — снова"""
+    _db_call_state.failed = True
+    with _db_breaker_lock:
+        _db_breaker['failures'] += 1
+        if _db_breaker['state'] == 'half_open' or (
+                _db_breaker['state'] == 'closed' and _db_breaker['failures'] >= DB_BREAKER_THRESHOLD):
+            if _db_breaker['state'] == 'closed':
+                logger.error(f"База недоступна ({_db_breaker['failures']} сбоев подряд), бот переходит в режим чтения")
+            _db_breaker.update(state='open', opened_at=time.monotonic())
+
+
+def _record_db_success():
+    """Замыкает автомат после успешного подключения"""
+    with _db_breaker_lock:
+        if _db_breaker['state'] != 'closed':
+            logger.warning("Соединение с базой восстановлено, режим чтения снят")
+        _db_breaker.update(state='closed', failures=0)
+
+
+def is_read_only():
+    """Возвращает True, пока база недоступна и бот работает только на чтение"""
+    return _db_breaker['state'] != 'closed'
+
+
 def create_connection():
-    """Создает соединение с базой данных"""
+    """Создает соединение с базой данных; при разомкнутом автомате сразу возвращает None"""
+    if not _breaker_allows_connect():
+        _db_call_state.failed = True
+        return None
     try:
-        return mysql.connector.connect(**DB_CONFIG)
+        connection = mysql.connector.connect(**DB_CONFIG)
     except Error as e:
         logger.error(f"Ошибка подключения к БД: {e}")
+        record_db_failure()
         return None
+    _record_db_success()
+    return connection
+
+
+def call_db(func, *args, **kwargs):
+    """Вызывает помощника БД и возвращает (результат, удалось ли обратиться к базе)"""
+    outer = getattr(_db_call_state, 'failed', False)
+    _db_call_state.failed = False
+    try:
+        result = func(*args, **kwargs)
+        return result, not _db_call_state.failed
+    finally:
+        _db_call_state.failed = outer or _db_call_state.failed
+
+
+_last_known_lock = threading.Lock()
+
+
+def serve_last_known(func):
+    """Декоратор помощника чтения: запоминает последний результат и отдает его, если база недоступна"""
+    cache = OrderedDict()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        result, ok = call_db(func, *args, **kwargs)
+        with _last_known_lock:
+            if not ok:
+                return cache.get(key, result)
+            cache[key] = result
+            cache.move_to_end(key)
+            if len(cache) > LAST_KNOWN_CACHE_SIZE:
+                cache.popitem(last=False)
+        return result
+    return wrapper
+
+
+def read_only_banner():
+    """Возвращает предупреждение для экранов, показанных из последних прочитанных данных"""
+    return READ_ONLY_BANNER if is_read_only() else ""
+
+
+def reject_if_read_only(reply, text=READ_ONLY_MONEY_TEXT):
+    """Отклоняет операцию, пока база недоступна. reply — функция ответа пользователю"""
+    if not is_read_only():
+        return False
+    reply(text)
+    return True
+
+
+# ========== ПОВТОР ТРАНЗАКЦИЙ ==========
+
+_db_retry_local = threading.local()  # Политика текущего вызова помощника с @db_retry
+_db_retry_stats = defaultdict(int)  # (счетчик, помощник, причина) -> значение
+_db_retry_lock = threading.Lock()
+
+
+def _retry_reason(error, idempotent):
+    """Возвращает причину повтора ('deadlock', 'lock_wait', 'connection_lost') или None для постоянной ошибки"""
+    errno = getattr(error, 'errno', None)
+    if errno in DB_RETRYABLE_ERRORS:
+        return DB_RETRYABLE_ERRORS[errno]
+    if idempotent and errno in DB_CONNECTION_LOST_ERRORS:
+        return 'connection_lost'
+    return None
+
+
+def _count_retry(counter, helper, reason):
+    """Увеличивает счетчик повторов"""
+    with _db_retry_lock:
+        _db_retry_stats[(counter, helper, reason)] += 1
+
+
+def raise_if_retryable(error):
+    """Вызывается первым в except помощника с @db_retry: пробрасывает ошибку, если транзакцию повторят.
+    На последней попытке не пробрасывает, и помощник возвращает свое значение по умолчанию"""
+    if getattr(error, 'errno', None) in DB_CONNECTION_LOST_ERRORS:
+        record_db_failure()
+    policy = getattr(_db_retry_local, 'policy', None)
+    if policy is None:
+        return
+    reason = _retry_reason(error, policy['idempotent'])
+    if reason is None:
+        return
+    if policy['attempts_left']:
+        raise error
+    policy['exhausted'] = True
+    _count_retry('exhausted', policy['helper'], reason)
+
+
+def db_retry(idempotent=False):
+    """Декоратор помощника БД: повторяет всю транзакцию при временных ошибках с экспоненциальной
+    задержкой и случайным разбросом. idempotent — повтор безопасен и после потери соединения.
+    Вложенный вызов внутри другого помощника не повторяется сам, а передает ошибку внешнему"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_db_retry_local, 'policy', None)
+            if outer is not None:
+                # Внешняя транзакция держит блокировки: ждать и повторять здесь нельзя, повторит внешний помощник
+                return func(*args, **kwargs)
+
+            policy = {'helper': func.__name__, 'idempotent': idempotent,
+                      'attempts_left': DB_RETRY_ATTEMPTS - 1, 'exhausted': False}
+            try:
+                attempt = 0
+                while True:
+                    _db_retry_local.policy = policy
+                    try:
+                        result = func(*args, **kwargs)
+                    except Error as e:
+                        reason = _retry_reason(e, idempotent)
+                        if reason is None or not policy['attempts_left']:
+                            raise
+                        policy['attempts_left'] -= 1
+                        attempt += 1
+                        _count_retry('retries', func.__name__, reason)
+                        delay = random.uniform(0, min(DB_RETRY_MAX_DELAY, DB_RETRY_BASE_DELAY * 2 ** attempt))
+                        logger.warning(f"{func.__name__}: {reason} ({e.errno}), "
+                                       f"повтор {attempt} из {DB_RETRY_ATTEMPTS - 1} через {delay:.2f} с")
+                        time.sleep(delay)
+                        continue
+                    if attempt and not policy['exhausted']:
+                        _count_retry('recovered', func.__name__, 'any')
+                    return result
+            finally:
+                _db_retry_local.policy = outer
+        return wrapper
+    return decorator
+
+
+def get_db_retry_stats():
+    """Возвращает копию счетчиков повторов {(счетчик, помощник, причина): значение}"""
+    with _db_retry_lock:
+        return dict(_db_retry_stats)
+
+
+_recent_writes = {}  # ('user' | 'order', id) -> время последней записи
+_replica_state = {'checked_at': None, 'lagging': False}
+_replica_lock = threading.Lock()
+
+
+def note_write(user_id=None, order_id=None):
+    """Запоминает запись, чтобы ближайшие чтения этого пользователя или заказа шли с основной базы"""
+    if not REPLICA_DB_CONFIG:
+        return
+
+    now = time.monotonic()
+    with _replica_lock:
+        if user_id is not None:
+            _recent_writes[('user', user_id)] = now
+        if order_id is not None:
+            _recent_writes[('order', order_id)] = now
+        # Периодически выбрасываем устаревшие отметки
+        if len(_recent_writes) > 10000:
+            for key in [key for key, written in _recent_writes.items() if now - written >= READ_YOUR_WRITES_SECONDS]:
+                del _recent_writes[key]
+
+
+def _replica_lag(connection):
+    """Возвращает отставание реплики в секундах или None, если репликация остановлена"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except Error:
+        # MySQL до 8.0.22
+        cursor.execute("SHOW SLAVE STATUS")
+    status = cursor.fetchone() or {}
+    return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+
+
+def create_read_connection(user_id=None, order_id=None):
+    """Создает соединение для чтения: с репликой, если она настроена, не отстает и пользователь или заказ
+    не менялись последние READ_YOUR_WRITES_SECONDS; иначе с основной базой"""
+    if not REPLICA_DB_CONFIG:
+        return create_connection()
+
+    now = time.monotonic()
+    with _replica_lock:
+        sticky = any(now - _recent_writes.get(key, float('-inf')) < READ_YOUR_WRITES_SECONDS
+                     for key in (('user', user_id), ('order', order_id)))
+        check_due = _replica_state['checked_at'] is None or now - _replica_state['checked_at'] >= REPLICA_LAG_CHECK_INTERVAL
+        if sticky or (_replica_state['lagging'] and not check_due):
+            return create_connection()
+
+    try:
+        connection = mysql.connector.connect(**REPLICA_DB_CONFIG)
+    except Error as e:
+        logger.error(f"Ошибка подключения к реплике: {e}")
+        with _replica_lock:
+            _replica_state.update(checked_at=now, lagging=True)
+        return create_connection()
+
+    if not check_due:
+        return connection
+
+    try:
+        lag = _replica_lag(connection)
+    except Error as e:
+        logger.error(f"Ошибка проверки отставания реплики: {e}")
+        connection.close()
+        with _replica_lock:
+            _replica_state.update(checked_at=now, lagging=True)
+        return create_connection()
+    lagging = lag is None or lag > REPLICA_MAX_LAG_SECONDS
+    with _replica_lock:
+        if lagging and not _replica_state['lagging']:
+            logger.warning(f"Реплика отстает ({lag} сек.), чтение переключено на основную базу")
+        _replica_state.update(checked_at=now, lagging=lagging)
+    if lagging:
+        connection.close()
+        return create_connection()
+    return connection
+
+
+def _ensure_index(cursor, table, index_name, definition):
+    """Добавляет индекс в таблицу, если его еще нет"""
+    cursor.execute("""
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    LIMIT 1
+    """, (table, index_name))
+    if not cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+
+def _ensure_column(cursor, table, column, definition):
+    """Добавляет колонку в таблицу, если ее еще нет"""
+    cursor.execute("""
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    LIMIT 1
+    """, (table, column))
+    if not cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
 
 
 def init_db():
@@ -122,6 +718,197 @@ def init_db():
         )
         """)
 
+        # Ежедневная сводка, обновляется инкрементально операциями с деньгами
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            stat_date DATE PRIMARY KEY,
+            orders_created INT DEFAULT 0,
+            gmv DECIMAL(14, 2) DEFAULT 0 COMMENT 'Списано с заказчиков за заказы, включая комиссию',
+            commission DECIMAL(14, 2) DEFAULT 0,
+            refunds DECIMAL(14, 2) DEFAULT 0 COMMENT 'Возвращено заказчикам за отклоненные заказы',
+            worker_payouts DECIMAL(14, 2) DEFAULT 0 COMMENT 'Начислено исполнителям',
+            withdrawals_requested DECIMAL(14, 2) DEFAULT 0,
+            withdrawals_paid DECIMAL(14, 2) DEFAULT 0,
+            deposits_count INT DEFAULT 0,
+            deposits_amount DECIMAL(14, 2) DEFAULT 0
+        )
+        """)
+
+        # Счетчики репутации исполнителей, обновляются при каждой смене статуса принятого заказа
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS worker_stats (
+            worker_id BIGINT PRIMARY KEY,
+            accepted_count INT DEFAULT 0,
+            completed_count INT DEFAULT 0,
+            cancelled_count INT DEFAULT 0,
+            expired_count INT DEFAULT 0,
+            disputed_count INT DEFAULT 0,
+            rejected_count INT DEFAULT 0 COMMENT 'Работа отклонена администратором',
+            earned DECIMAL(12, 2) DEFAULT 0,
+            FOREIGN KEY (worker_id) REFERENCES users(user_id)
+        )
+        """)
+        cursor.execute("SELECT 1 FROM worker_stats LIMIT 1")
+        if not cursor.fetchone():
+            # Первичное заполнение по уже существующим принятым заказам
+            cursor.execute("""
+            INSERT INTO worker_stats (worker_id, accepted_count, completed_count, cancelled_count, disputed_count, earned)
+            SELECT ao.worker_id, COUNT(*),
+                   SUM(ao.status = 'completed'), SUM(ao.status = 'canceled'), SUM(ao.status = 'under_review'),
+                   COALESCE(SUM(IF(ao.status = 'completed', o.price, 0)), 0)
+            FROM accepted_orders ao
+            JOIN orders o ON ao.order_id = o.order_id
+            GROUP BY ao.worker_id
+            """)
+
+        # Срок сдачи принятого заказа хранится, чтобы искать просроченные по индексу
+        _ensure_column(cursor, 'accepted_orders', 'due_at', 'due_at DATETIME NULL')
+        _ensure_column(cursor, 'accepted_orders', 'paused_seconds_left',
+                       "paused_seconds_left INT NULL COMMENT 'Остаток времени, пока работа на проверке'")
+        cursor.execute("""
+        UPDATE accepted_orders ao
+        JOIN orders o ON ao.order_id = o.order_id
+        SET ao.due_at = ao.started_at + INTERVAL o.deadline HOUR
+        WHERE ao.status = 'in_progress' AND ao.due_at IS NULL
+        """)
+
+        # Время отправки работы на проверку заказчику, для автоматической эскалации
+        _ensure_column(cursor, 'accepted_orders', 'review_started_at', 'review_started_at DATETIME NULL')
+        cursor.execute("""
+        UPDATE accepted_orders
+        SET review_started_at = NOW()
+        WHERE status = 'waiting_review' AND review_started_at IS NULL
+        """)
+
+        # Сданные работы: ссылка и решение по ней хранятся в базе, а не только в чате
+        # (без внешнего ключа — история остается после удаления отклоненного задания)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS submissions (
+            submission_id INT AUTO_INCREMENT PRIMARY KEY,
+            assignment_id INT NOT NULL,
+            link TEXT NOT NULL,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            decision ENUM('pending', 'approved', 'disputed', 'rejected') DEFAULT 'pending',
+            reason TEXT,
+            decided_at DATETIME NULL,
+            INDEX idx_submissions_assignment (assignment_id)
+        )
+        """)
+
+        # Хэш нормализованной ссылки для поиска повторно отправленных работ
+        _ensure_column(cursor, 'submissions', 'worker_id', 'worker_id BIGINT NULL AFTER assignment_id')
+        _ensure_column(cursor, 'submissions', 'link_hash', 'link_hash CHAR(64) NULL AFTER link')
+        _ensure_index(cursor, 'submissions', 'idx_submissions_link_hash',
+                      'INDEX idx_submissions_link_hash (link_hash)')
+        cursor.execute("""
+        UPDATE submissions s
+        JOIN accepted_orders ao ON s.assignment_id = ao.id
+        SET s.worker_id = ao.worker_id
+        WHERE s.worker_id IS NULL
+        """)
+        cursor.execute("SELECT submission_id, link FROM submissions WHERE link_hash IS NULL")
+        cursor.executemany(
+            "UPDATE submissions SET link_hash = %s WHERE submission_id = %s",
+            [(hash_link(link), submission_id) for submission_id, link in cursor.fetchall()]
+        )
+
+        # Отправленные напоминания о сроке, чтобы не повторять их
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS deadline_reminders (
+            assignment_id INT,
+            reminder_kind VARCHAR(16),
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (assignment_id, reminder_kind),
+            FOREIGN KEY (assignment_id) REFERENCES accepted_orders(id) ON DELETE CASCADE
+        )
+        """)
+
+        # Состояние диалогов для нескольких процессов бота (см. MySQLPersistence)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_user_data (
+            user_id BIGINT PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_conversations (
+            name VARCHAR(32),
+            conv_key VARCHAR(64),
+            user_id BIGINT NOT NULL,
+            state VARCHAR(64) NOT NULL,
+            PRIMARY KEY (name, conv_key)
+        )
+        """)
+
+        # Версии кэшей: процесс, изменивший данные, увеличивает версию, остальные сбрасывают свои кэши
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            cache_name VARCHAR(32) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+        """)
+        cursor.execute("INSERT IGNORE INTO cache_versions (cache_name) VALUES ('feed'), ('orders')")
+
+        # Журнал изменений ленты: остальные процессы применяют их по одному заказу, без полной перезагрузки
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS feed_changes (
+            change_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            process_id INT NOT NULL,
+            order_id INT,
+            worker_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_created (created_at)
+        )
+        """)
+
+        # Пакеты выплат
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payout_batches (
+            batch_id INT AUTO_INCREMENT PRIMARY KEY,
+            created_by BIGINT,
+            payments_count INT DEFAULT 0,
+            total_amount DECIMAL(12, 2) DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        _ensure_column(cursor, 'payout_batches', 'paid_at', 'paid_at DATETIME NULL')
+        _ensure_column(cursor, 'payments', 'batch_id', 'batch_id INT NULL')
+
+        # Очередь модерации
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS moderation_queue (
+            item_id INT AUTO_INCREMENT PRIMARY KEY,
+            item_type ENUM('order', 'dispute', 'deposit', 'withdrawal') NOT NULL,
+            ref_key VARCHAR(64) NOT NULL COMMENT 'Идентификатор объекта: заказ, заказ_исполнитель, пополнение, платеж',
+            text TEXT,
+            actions TEXT COMMENT 'Кнопки действий в формате JSON',
+            status ENUM('pending', 'claimed', 'done') DEFAULT 'pending',
+            claimed_by BIGINT NULL,
+            claimed_until DATETIME NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            resolved_at DATETIME NULL,
+            UNIQUE KEY unique_item (item_type, ref_key),
+            INDEX idx_queue_status (status, claimed_until)
+        )
+        """)
+
+        # Индексы для ленты заказов и поиска
+        _ensure_index(cursor, 'orders', 'idx_orders_status_price', 'INDEX idx_orders_status_price (status, price)')
+        _ensure_index(cursor, 'orders', 'idx_orders_status_created',
+                      'INDEX idx_orders_status_created (status, created_at)')
+        _ensure_index(cursor, 'orders', 'ft_orders_text', 'FULLTEXT INDEX ft_orders_text (title, description)')
+        _ensure_index(cursor, 'accepted_orders', 'idx_accepted_order_status',
+                      'INDEX idx_accepted_order_status (order_id, status)')
+
+        _ensure_index(cursor, 'accepted_orders', 'idx_accepted_status_due',
+                      'INDEX idx_accepted_status_due (status, due_at)')
+        _ensure_index(cursor, 'accepted_orders', 'idx_accepted_status_review',
+                      'INDEX idx_accepted_status_review (status, review_started_at)')
+
+        # Индексы для пакетов выплат
+        _ensure_index(cursor, 'payments', 'idx_payments_status', 'INDEX idx_payments_status (status, payment_id)')
+        _ensure_index(cursor, 'payments', 'idx_payments_batch', 'INDEX idx_payments_batch (batch_id)')
+
         connection.commit()
     except Error as e:
         logger.error(f"Ошибка инициализации БД: {e}")
@@ -130,6 +917,116 @@ def init_db():
             connection.close()
 
 
+def _increment_counters(cursor, table, key_column, key_value, deltas):
+    """Прибавляет значения к счетчикам строки, создавая ее при необходимости, в текущей транзакции"""
+    columns = list(deltas)
+    cursor.execute(f"""
+    INSERT INTO {table} ({key_column}, {', '.join(columns)})
+    VALUES (%s, {', '.join(['%s'] * len(columns))})
+    ON DUPLICATE KEY UPDATE {', '.join(f'{column} = {column} + VALUES({column})' for column in columns)}
+    """, (key_value, *deltas.values()))
+
+
+def record_daily_stats(cursor=None, **deltas):
+    """Добавляет значения к сводке за сегодня. Если передан cursor, запись идет в его транзакции"""
+    if cursor is not None:
+        _increment_counters(cursor, 'daily_stats', 'stat_date', date.today(), deltas)
+        return True
+
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        _increment_counters(cursor, 'daily_stats', 'stat_date', date.today(), deltas)
+        connection.commit()
+        return True
+    except Error as e:
+        logger.error(f"Ошибка обновления ежедневной сводки: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_daily_stats(days):
+    """Возвращает сводку за последние дни, начиная с сегодняшнего"""
+    connection = create_connection()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+        SELECT * FROM daily_stats
+        WHERE stat_date > %s
+        ORDER BY stat_date DESC
+        """, (date.today() - timedelta(days=days),))
+        return cursor.fetchall()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения сводки: {e}")
+        return []
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@serve_last_known
+@db_retry(idempotent=True)
+def get_worker_stats(worker_id):
+    """Возвращает счетчики репутации исполнителя"""
+    empty = {'accepted_count': 0, 'completed_count': 0, 'cancelled_count': 0, 'expired_count': 0,
+             'disputed_count': 0, 'rejected_count': 0, 'earned': 0}
+    connection = create_read_connection(user_id=worker_id)
+    if not connection:
+        return empty
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM worker_stats WHERE worker_id = %s", (worker_id,))
+        return cursor.fetchone() or empty
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения статистики исполнителя: {e}")
+        return empty
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@serve_last_known
+@db_retry(idempotent=True)
+def get_worker_history(worker_id, before_id=None, per_page=HISTORY_PER_PAGE):
+    """Возвращает страницу истории заказов исполнителя (ключевая пагинация по id) и признак следующей"""
+    connection = create_read_connection(user_id=worker_id)
+    if not connection:
+        return [], False
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+        SELECT ao.id, ao.status, ao.started_at, o.title, o.price
+        FROM accepted_orders ao
+        JOIN orders o ON ao.order_id = o.order_id
+        WHERE ao.worker_id = %s AND ao.id < %s
+        ORDER BY ao.id DESC
+        LIMIT %s
+        """, (worker_id, before_id if before_id is not None else 2 ** 31 - 1, per_page + 1))
+        rows = cursor.fetchall()
+        return rows[:per_page], len(rows) > per_page
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения истории исполнителя: {e}")
+        return [], False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
 def add_user(user_id):
     """Добавляет нового пользователя в БД"""
     connection = create_connection()
@@ -141,17 +1038,20 @@ def add_user(user_id):
         cursor.execute("INSERT IGNORE INTO users (user_id) VALUES (%s)", (user_id,))
         connection.commit()
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка добавления пользователя: {e}")
     finally:
         if connection.is_connected():
             connection.close()
 
 
+@serve_last_known
+@db_retry(idempotent=True)
 def get_user_status(user_id):
-    """Возвращает статус пользователя"""
-    connection = create_connection()
+    """Возвращает статус пользователя; None — статус неизвестен (база недоступна), действие нужно отклонить"""
+    connection = create_read_connection(user_id=user_id)
     if not connection:
-        return 'verified'
+        return None
 
     try:
         cursor = connection.cursor()
@@ -159,13 +1059,15 @@ def get_user_status(user_id):
         result = cursor.fetchone()
         return result[0] if result else 'verified'
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка получения статуса: {e}")
-        return 'verified'
+        return None
     finally:
         if connection.is_connected():
             connection.close()
 
 
+@db_retry(idempotent=True)
 def update_user_status(user_id, status):
     """Обновляет статус пользователя"""
     connection = create_connection()
@@ -176,8 +1078,60 @@ def update_user_status(user_id, status):
         cursor = connection.cursor()
         cursor.execute("UPDATE users SET status = %s WHERE user_id = %s", (status, user_id))
         connection.commit()
+        note_write(user_id=user_id)
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка обновления статуса пользователя: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=False)
+def escalate_user_status(user_id):
+    """Ужесточает статус одним запросом: проверенный становится подозрительным, остальные — заблокированными"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        # Текущий статус не читаем отдельно: при недоступной реплике или гонке нельзя случайно снять бан
+        cursor.execute(
+            "UPDATE users SET status = IF(status = 'verified', 'suspicious', 'banned') WHERE user_id = %s",
+            (user_id,))
+        connection.commit()
+        note_write(user_id=user_id)
         return True
     except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка обновления статуса пользователя: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def flag_user_suspicious(user_id):
+    """Помечает проверенного пользователя как подозрительного. Возвращает True, если статус изменился"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        UPDATE users SET status = 'suspicious'
+        WHERE user_id = %s AND status = 'verified'
+        """, (user_id,))
+        connection.commit()
+        note_write(user_id=user_id)
+        return cursor.rowcount > 0
+    except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка обновления статуса пользователя: {e}")
         return False
     finally:
@@ -185,6 +1139,8 @@ def update_user_status(user_id, status):
             connection.close()
 
 
+@serve_last_known
+@db_retry(idempotent=True)
 def get_user_balance(user_id):
     """Возвращает баланс пользователя"""
     connection = create_connection()
@@ -197,6 +1153,7 @@ def get_user_balance(user_id):
         result = cursor.fetchone()
         return float(result[0]) if result else 0
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка получения баланса: {e}")
         return 0
     finally:
@@ -204,6 +1161,8 @@ def get_user_balance(user_id):
             connection.close()
 
 
+@serve_last_known
+@db_retry(idempotent=True)
 def get_client_balance(user_id):
     """Возвращает баланс заказчика"""
     connection = create_connection()
@@ -216,6 +1175,7 @@ def get_client_balance(user_id):
         result = cursor.fetchone()
         return float(result[0]) if result else 0
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка получения баланса заказчика: {e}")
         return 0
     finally:
@@ -223,6 +1183,7 @@ def get_client_balance(user_id):
             connection.close()
 
 
+@db_retry()
 def update_user_balance(user_id, amount):
     """Обновляет баланс пользователя"""
     connection = create_connection()
@@ -235,6 +1196,7 @@ def update_user_balance(user_id, amount):
         connection.commit()
         return True
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка обновления баланса: {e}")
         return False
     finally:
@@ -242,6 +1204,7 @@ def update_user_balance(user_id, amount):
             connection.close()
 
 
+@db_retry()
 def update_client_balance(user_id, amount):
     """Обновляет баланс заказчика"""
     connection = create_connection()
@@ -254,6 +1217,7 @@ def update_client_balance(user_id, amount):
         connection.commit()
         return True
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка обновления баланса заказчика: {e}")
         return False
     finally:
@@ -261,8 +1225,10 @@ def update_client_balance(user_id, amount):
             connection.close()
 
 
-def get_active_orders(sort_by='newest'):
-    connection = create_connection()
+@db_retry(idempotent=True)
+def get_active_orders(sort_by='newest', primary=False):
+    """Возвращает активные заказы со свободными местами. primary — читать с основной базы, а не с реплики"""
+    connection = create_connection() if primary else create_read_connection()
     if not connection:
         return []
 
@@ -276,11 +1242,11 @@ def get_active_orders(sort_by='newest'):
             order_id, title, price, description, 
             quantity, deadline, created_at,
             (SELECT COUNT(*) FROM accepted_orders 
-             WHERE order_id = o.order_id AND status != 'canceled') as accepted_count
+             WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) as accepted_count
         FROM orders o
         WHERE status = 'active'
         AND (SELECT COUNT(*) FROM accepted_orders 
-             WHERE order_id = o.order_id AND status != 'canceled') < quantity
+             WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) < quantity
         """
 
         # Добавляем сортировку один раз перед выполнением запроса
@@ -304,6 +1270,7 @@ def get_active_orders(sort_by='newest'):
         return orders
 
     except Exception as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка в get_active_orders: {e}")
         return []
     finally:
@@ -311,49 +1278,148 @@ def get_active_orders(sort_by='newest'):
             connection.close()
 
 
-def get_order_details(order_id):
-    """Возвращает детали заказа"""
+@db_retry(idempotent=True)
+def get_active_order_row(order_id):
+    """Возвращает заказ в том же виде, что и get_active_orders, или None, если он не должен быть в ленте.
+
+    Если базу прочитать не удалось, выбрасывает Error: None здесь означало бы удаление заказа из ленты.
+    """
     connection = create_connection()
     if not connection:
-        return None
+        raise Error("нет соединения с базой данных")
 
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM orders WHERE order_id = %s", (order_id,))
-        return cursor.fetchone()
-    except Error as e:
-        logger.error(f"Ошибка получения заказа: {e}")
+        cursor.execute("""
+        SELECT 
+            order_id, title, price, description, 
+            quantity, deadline, created_at,
+            (SELECT COUNT(*) FROM accepted_orders 
+             WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) as accepted_count
+        FROM orders o
+        WHERE order_id = %s AND status = 'active'
+        """, (order_id,))
+        order = cursor.fetchone()
+        if order and order['accepted_count'] < order['quantity']:
+            return order
         return None
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения заказа для ленты: {e}")
+        raise
     finally:
         if connection.is_connected():
             connection.close()
 
 
-def accept_order(order_id, worker_id):
-    """Принимает заказ исполнителем"""
-    connection = create_connection()
+def _build_fulltext_query(keywords):
+    """Преобразует ключевые слова в запрос для MATCH ... AGAINST в режиме BOOLEAN"""
+    words = [w for w in re.findall(r'\w+', keywords) if len(w) >= SEARCH_MIN_WORD_LENGTH]
+    return ' '.join(f"+{w}*" for w in words)
+
+
+@db_retry(idempotent=True)
+def search_orders(filters, page=0, per_page=5):
+    """Ищет активные заказы по фильтрам. Возвращает (заказы страницы, есть ли следующая страница)"""
+    connection = create_read_connection()
     if not connection:
-        return False
+        return [], False
 
     try:
-        cursor = connection.cursor()
+        cursor = connection.cursor(dictionary=True)
 
-        # 1. Проверяем, не взял ли уже этот исполнитель данный заказ
-        cursor.execute("""
-        SELECT 1 
-        FROM accepted_orders 
+        conditions = ["o.status = 'active'"]
+        params = []
+
+        fulltext_query = _build_fulltext_query(filters.get('keywords') or '')
+        if fulltext_query:
+            conditions.append("MATCH(o.title, o.description) AGAINST (%s IN BOOLEAN MODE)")
+            params.append(fulltext_query)
+        if filters.get('price_min') is not None:
+            conditions.append("o.price >= %s")
+            params.append(filters['price_min'])
+        if filters.get('price_max') is not None:
+            conditions.append("o.price <= %s")
+            params.append(filters['price_max'])
+        if filters.get('max_deadline') is not None:
+            conditions.append("o.deadline <= %s")
+            params.append(filters['max_deadline'])
+
+        min_slots = filters.get('min_slots') or 1
+
+        # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+        query = f"""
+        SELECT
+            o.order_id, o.title, o.price, o.quantity, o.deadline, o.created_at,
+            (SELECT COUNT(*) FROM accepted_orders
+             WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) as accepted_count
+        FROM orders o
+        WHERE {' AND '.join(conditions)}
+        HAVING o.quantity - accepted_count >= %s
+        ORDER BY o.created_at DESC
+        LIMIT %s OFFSET %s
+        """
+        params.extend([min_slots, per_page + 1, page * per_page])
+
+        cursor.execute(query, tuple(params))
+        orders = cursor.fetchall()
+        return orders[:per_page], len(orders) > per_page
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка поиска заказов: {e}")
+        return [], False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@serve_last_known
+@db_retry(idempotent=True)
+def fetch_order_details(order_id):
+    """Загружает заказ из базы (используйте get_order_details, он кэширует результат)"""
+    connection = create_read_connection(order_id=order_id)
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM orders WHERE order_id = %s", (order_id,))
+        return cursor.fetchone()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения заказа: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def accept_order(order_id, worker_id):
+    """Принимает заказ исполнителем"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+
+        # 1. Проверяем, не взял ли уже этот исполнитель данный заказ
+        cursor.execute("""
+        SELECT 1 
+        FROM accepted_orders 
         WHERE order_id = %s AND worker_id = %s AND status NOT IN ('canceled', 'rejected')
         """, (order_id, worker_id))
         if cursor.fetchone():
             return False  # Исполнитель уже взял этот заказ
 
-        # 2. Проверяем лимит принятых заказов у исполнителя (не более 5)
+        # 2. Проверяем лимит принятых заказов у исполнителя
         cursor.execute("""
         SELECT COUNT(*) 
         FROM accepted_orders 
         WHERE worker_id = %s AND status IN ('in_progress', 'waiting_review', 'under_review')
         """, (worker_id,))
-        if cursor.fetchone()[0] >= 5:
+        if cursor.fetchone()[0] >= MAX_ACTIVE_ASSIGNMENTS:
             return False
 
         # 3. Проверяем доступность заказа
@@ -361,7 +1427,8 @@ def accept_order(order_id, worker_id):
         SELECT o.quantity, 
                (SELECT COUNT(*) 
                 FROM accepted_orders 
-                WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) as accepted_count
+                WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) as accepted_count,
+               o.deadline
         FROM orders o 
         WHERE o.order_id = %s AND o.status = 'active'
         FOR UPDATE
@@ -371,16 +1438,19 @@ def accept_order(order_id, worker_id):
         if not result or result[0] <= result[1]:
             return False
 
-        # 4. Принимаем заказ
+        # 4. Принимаем заказ и сразу фиксируем срок сдачи
         cursor.execute("""
-        INSERT INTO accepted_orders (order_id, worker_id, status) 
-        VALUES (%s, %s, 'in_progress')
-        """, (order_id, worker_id))
+        INSERT INTO accepted_orders (order_id, worker_id, status, due_at) 
+        VALUES (%s, %s, 'in_progress', NOW() + INTERVAL %s HOUR)
+        """, (order_id, worker_id, result[2]))
+        _increment_counters(cursor, 'worker_stats', 'worker_id', worker_id, {'accepted_count': 1})
 
         connection.commit()
+        publish(AssignmentAccepted(order_id, worker_id))
         return True
 
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка принятия заказа: {e}")
         connection.rollback()
         return False
@@ -389,9 +1459,38 @@ def accept_order(order_id, worker_id):
             connection.close()
 
 
+@db_retry(idempotent=True)
+def get_worker_order_ids(worker_id):
+    """Возвращает (id всех заказов, которые исполнитель брал, число активных заказов) или None при ошибке"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT order_id, status
+        FROM accepted_orders
+        WHERE worker_id = %s
+        """, (worker_id,))
+        rows = cursor.fetchall()
+        order_ids = {row[0] for row in rows}
+        active_count = sum(1 for row in rows if row[1] in ('in_progress', 'waiting_review', 'under_review'))
+        return order_ids, active_count
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения заказов исполнителя: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@serve_last_known
+@db_retry(idempotent=True)
 def get_user_orders(user_id):
     """Возвращает активные заказы пользователя"""
-    connection = create_connection()
+    connection = create_read_connection(user_id=user_id)
     if not connection:
         return []
 
@@ -399,7 +1498,7 @@ def get_user_orders(user_id):
         cursor = connection.cursor(dictionary=True)
         cursor.execute("""
         SELECT ao.id, ao.order_id, o.title, o.price, ao.status, o.description, 
-               o.deadline, ao.started_at
+               o.deadline, ao.started_at, ao.due_at
         FROM accepted_orders ao
         JOIN orders o ON ao.order_id = o.order_id
         WHERE ao.worker_id = %s
@@ -409,6 +1508,7 @@ def get_user_orders(user_id):
         """, (user_id,))
         return cursor.fetchall()
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка получения заказов пользователя: {e}")
         return []
     finally:
@@ -416,9 +1516,11 @@ def get_user_orders(user_id):
             connection.close()
 
 
+@serve_last_known
+@db_retry(idempotent=True)
 def get_client_orders(user_id):
     """Возвращает заказы клиента"""
-    connection = create_connection()
+    connection = create_read_connection(user_id=user_id)
     if not connection:
         return []
 
@@ -426,7 +1528,7 @@ def get_client_orders(user_id):
         cursor = connection.cursor(dictionary=True)
         cursor.execute("""
         SELECT o.order_id, o.title, o.price, o.description, o.quantity, o.deadline, o.status,
-               (SELECT COUNT(*) FROM accepted_orders WHERE order_id = o.order_id AND status != 'canceled') as accepted_count,
+               (SELECT COUNT(*) FROM accepted_orders WHERE order_id = o.order_id AND status NOT IN ('canceled', 'rejected')) as accepted_count,
                (SELECT COUNT(*) FROM accepted_orders WHERE order_id = o.order_id AND status = 'completed') as completed_count
         FROM orders o
         WHERE o.user_id = %s
@@ -435,6 +1537,7 @@ def get_client_orders(user_id):
         """, (user_id,))
         return cursor.fetchall()
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка получения заказов клиента: {e}")
         return []
     finally:
@@ -442,6 +1545,7 @@ def get_client_orders(user_id):
             connection.close()
 
 
+@db_retry()
 def create_order(user_id, title, price, quantity, description, deadline):
     """Создает новый заказ"""
     connection = create_connection()
@@ -449,11 +1553,11 @@ def create_order(user_id, title, price, quantity, description, deadline):
         return None
 
     try:
-        # Проверяем лимит активных заказов (не более 10)
+        # Проверяем лимит активных заказов
         cursor = connection.cursor()
         cursor.execute("SELECT COUNT(*) FROM orders WHERE user_id = %s AND status = 'active'", (user_id,))
         active_orders_count = cursor.fetchone()[0]
-        if active_orders_count >= 10:
+        if active_orders_count >= MAX_ACTIVE_ORDERS:
             return None
 
         cursor.execute("""
@@ -462,8 +1566,10 @@ def create_order(user_id, title, price, quantity, description, deadline):
         """, (user_id, title, price, quantity, description, deadline))
         order_id = cursor.lastrowid
         connection.commit()
+        publish(OrderCreated(order_id, user_id))
         return order_id
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка создания заказа: {e}")
         return None
     finally:
@@ -471,6 +1577,84 @@ def create_order(user_id, title, price, quantity, description, deadline):
             connection.close()
 
 
+@db_retry(idempotent=True)
+def count_active_orders(user_id):
+    """Возвращает число активных заказов заказчика"""
+    connection = create_connection()
+    if not connection:
+        return 0
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE user_id = %s AND status = 'active'", (user_id,))
+        return cursor.fetchone()[0]
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка проверки лимита заказов: {e}")
+        return 0
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def create_orders_bulk(user_id, orders, total):
+    """Создает пакет заказов одной многострочной вставкой и одним списанием с баланса заказчика.
+
+    Возвращает список order_id или None, если не хватило средств, превышен лимит или произошла ошибка.
+    """
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        # Блокируем строку заказчика: баланс и лимит проверяются и списываются атомарно
+        cursor.execute("SELECT client_balance FROM users WHERE user_id = %s FOR UPDATE", (user_id,))
+        result = cursor.fetchone()
+        if not result or result[0] < total:
+            connection.rollback()
+            return None
+
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE user_id = %s AND status = 'active'", (user_id,))
+        if cursor.fetchone()[0] + len(orders) > MAX_ACTIVE_ORDERS:
+            connection.rollback()
+            return None
+
+        # executemany превращает INSERT ... VALUES в одну многострочную вставку
+        cursor.executemany("""
+        INSERT INTO orders (user_id, title, price, quantity, description, deadline)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """, [(user_id, order['title'], order['price'], order['quantity'], order['description'], order['deadline'])
+              for order in orders])
+        cursor.execute("""
+        SELECT order_id FROM orders
+        WHERE user_id = %s AND order_id >= LAST_INSERT_ID()
+        ORDER BY order_id
+        LIMIT %s
+        """, (user_id, len(orders)))
+        order_ids = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""
+        UPDATE users SET client_balance = client_balance - %s WHERE user_id = %s
+        """, (total, user_id))
+        record_daily_stats(cursor, orders_created=len(orders), gmv=total,
+                           commission=total - sum(order['price'] * order['quantity'] for order in orders))
+
+        connection.commit()
+        publish(OrdersCreated(tuple(order_ids), user_id))
+        return order_ids
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка массового создания заказов: {e}")
+        connection.rollback()
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
 def update_order_status(order_id, status):
     """Обновляет статус заказа"""
     connection = create_connection()
@@ -485,8 +1669,12 @@ def update_order_status(order_id, status):
         WHERE order_id = %s
         """, (status, order_id))
         connection.commit()
+        invalidate_feed_cache(order_ids=[order_id])
+        invalidate_order_details(order_id)
+        note_write(order_id=order_id)
         return True
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка обновления статуса заказа: {e}")
         return False
     finally:
@@ -494,31 +1682,198 @@ def update_order_status(order_id, status):
             connection.close()
 
 
-def update_accepted_order_status(order_id, worker_id, status):
-    """Обновляет статус принятого заказа"""
+def _record_submission_decision(cursor, order_id, worker_id, decision, reason=None):
+    """Записывает решение по последней сданной работе задания в текущей транзакции"""
+    cursor.execute("""
+    UPDATE submissions s
+    JOIN accepted_orders ao ON s.assignment_id = ao.id
+    SET s.decision = %s, s.reason = COALESCE(%s, s.reason), s.decided_at = NOW()
+    WHERE ao.order_id = %s AND ao.worker_id = %s AND s.decision IN ('pending', 'disputed')
+    """, (decision, reason, order_id, worker_id))
+
+
+@db_retry(idempotent=True)
+def get_submission(order_id, worker_id):
+    """Возвращает задание вместе с заказом и последней сданной работой одним запросом"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+        SELECT ao.id AS assignment_id, ao.order_id, ao.worker_id, ao.status,
+               o.user_id AS client_id, o.title, o.price, o.description, o.quantity,
+               s.link, s.submitted_at, s.decision, s.reason
+        FROM accepted_orders ao
+        JOIN orders o ON ao.order_id = o.order_id
+        LEFT JOIN submissions s ON s.submission_id = (
+            SELECT MAX(submission_id) FROM submissions WHERE assignment_id = ao.id
+        )
+        WHERE ao.order_id = %s AND ao.worker_id = %s
+        """, (order_id, worker_id))
+        return cursor.fetchone()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения сданной работы: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def set_submission_reason(order_id, worker_id, reason):
+    """Сохраняет причину отклонения сданной работы заказчиком"""
     connection = create_connection()
     if not connection:
         return False
 
     try:
         cursor = connection.cursor()
-        cursor.execute("""
-        UPDATE accepted_orders 
-        SET status = %s 
-        WHERE order_id = %s AND worker_id = %s
-        """, (status, order_id, worker_id))
+        _record_submission_decision(cursor, order_id, worker_id, 'disputed', reason)
         connection.commit()
         return cursor.rowcount > 0
     except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка сохранения причины отклонения: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_link_usage(link_hash):
+    """Возвращает (сколько раз ссылка уже сдавалась, сколькими исполнителями)"""
+    connection = create_connection()
+    if not connection:
+        return 0, 0
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT COUNT(*), COUNT(DISTINCT worker_id)
+        FROM submissions
+        WHERE link_hash = %s
+        """, (link_hash,))
+        return cursor.fetchone()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка проверки повторной ссылки: {e}")
+        return 0, 0
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_link_hashes(after_id=0):
+    """Возвращает [(submission_id, хэш), ...] сданных ссылок после after_id для заполнения фильтра Блума"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT submission_id, link_hash FROM submissions
+        WHERE submission_id > %s AND link_hash IS NOT NULL
+        ORDER BY submission_id
+        """, (after_id,))
+        return cursor.fetchall()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка загрузки хэшей ссылок: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_top_reused_links(limit):
+    """Возвращает ссылки, которые сдавались больше одного раза, по убыванию числа повторов"""
+    connection = create_connection()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+        SELECT MIN(link) AS link, COUNT(*) AS uses, COUNT(DISTINCT worker_id) AS workers,
+               MAX(submitted_at) AS last_used
+        FROM submissions
+        WHERE link_hash IS NOT NULL
+        GROUP BY link_hash
+        HAVING uses > 1
+        ORDER BY uses DESC, last_used DESC
+        LIMIT %s
+        """, (limit,))
+        return cursor.fetchall()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения повторных ссылок: {e}")
+        return []
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def update_accepted_order_status(order_id, worker_id, status, from_status=None):
+    """Обновляет статус принятого заказа. from_status — обновить, только если заказ сейчас в этом статусе"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        if status == 'in_progress':
+            # Возврат в работу: срок продолжает идти с сохраненного остатка. У заданий, отправленных
+            # на проверку до появления остатка, его нет — им дается полный срок заказа
+            cursor.execute(f"""
+            UPDATE accepted_orders ao
+            JOIN orders o ON ao.order_id = o.order_id
+            SET ao.status = %s,
+                ao.due_at = NOW() + INTERVAL COALESCE(ao.paused_seconds_left, o.deadline * 3600) SECOND,
+                ao.paused_seconds_left = NULL
+            WHERE ao.order_id = %s AND ao.worker_id = %s AND ao.status {'=' if from_status else '!='} %s
+            """, (status, order_id, worker_id, from_status or status))
+        else:
+            cursor.execute(f"""
+            UPDATE accepted_orders 
+            SET status = %s 
+            WHERE order_id = %s AND worker_id = %s AND status {'=' if from_status else '!='} %s
+            """, (status, order_id, worker_id, from_status or status))
+        updated = cursor.rowcount > 0
+
+        if updated and status in WORKER_STATUS_COUNTERS:
+            deltas = {WORKER_STATUS_COUNTERS[status]: 1}
+            if status == 'completed':
+                cursor.execute("SELECT price FROM orders WHERE order_id = %s", (order_id,))
+                deltas['earned'] = cursor.fetchone()[0]
+            _increment_counters(cursor, 'worker_stats', 'worker_id', worker_id, deltas)
+        if updated and status in SUBMISSION_DECISIONS:
+            _record_submission_decision(cursor, order_id, worker_id, SUBMISSION_DECISIONS[status])
+
+        connection.commit()
+        invalidate_feed_cache(worker_id, [order_id])
+        note_write(user_id=worker_id, order_id=order_id)
+        return updated
+    except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка обновления статуса: {e}")
+        connection.rollback()
         return False
     finally:
         if connection.is_connected():
             connection.close()
 
 
-def cancel_order(order_id, worker_id):
-    """Отменяет заказ и возвращает его в биржу"""
+@db_retry()
+def cancel_order(order_id, worker_id, expired=False):
+    """Отменяет заказ и возвращает его в биржу. expired — отмена из-за истечения срока"""
     connection = create_connection()
     if not connection:
         return False
@@ -528,11 +1883,17 @@ def cancel_order(order_id, worker_id):
         cursor.execute("""
         UPDATE accepted_orders 
         SET status = 'canceled' 
-        WHERE order_id = %s AND worker_id = %s
+        WHERE order_id = %s AND worker_id = %s AND status != 'canceled'
         """, (order_id, worker_id))
+        if cursor.rowcount > 0:
+            counter = 'expired_count' if expired else 'cancelled_count'
+            _increment_counters(cursor, 'worker_stats', 'worker_id', worker_id, {counter: 1})
         connection.commit()
+        invalidate_feed_cache(worker_id, [order_id])
+        note_write(user_id=worker_id, order_id=order_id)
         return True
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка отмены заказа: {e}")
         return False
     finally:
@@ -540,8 +1901,9 @@ def cancel_order(order_id, worker_id):
             connection.close()
 
 
-def submit_order_for_review(order_id, worker_id):
-    """Отправляет заказ на проверку и запрещает повторную отправку"""
+@db_retry()
+def submit_order_for_review(order_id, worker_id, link):
+    """Отправляет заказ на проверку, сохраняет ссылку на работу и запрещает повторную отправку"""
     connection = create_connection()
     if not connection:
         return False
@@ -565,95 +1927,149 @@ def submit_order_for_review(order_id, worker_id):
         if current_status in ('waiting_review', 'under_review'):
             return False
 
+        # Время на проверке не засчитывается: запоминаем остаток и снимаем срок сдачи
         cursor.execute("""
         UPDATE accepted_orders 
-        SET status = 'waiting_review'
+        SET status = 'waiting_review',
+            review_started_at = NOW(),
+            paused_seconds_left = GREATEST(TIMESTAMPDIFF(SECOND, NOW(), due_at), 0),
+            due_at = NULL
         WHERE order_id = %s AND worker_id = %s
         AND status = 'in_progress'
         """, (order_id, worker_id))
+        if cursor.rowcount == 0:
+            connection.rollback()
+            return False
+
+        # Проверяем до сохранения, чтобы не учесть текущую отправку
+        link_hash = hash_link(link)
+        previous_uses, previous_workers = find_link_duplicates(link)
+        cursor.execute("""
+        INSERT INTO submissions (assignment_id, worker_id, link, link_hash)
+        SELECT id, worker_id, %s, %s FROM accepted_orders
+        WHERE order_id = %s AND worker_id = %s
+        """, (link, link_hash, order_id, worker_id))
 
         connection.commit()
-        return cursor.rowcount > 0
+        publish(WorkSubmitted(order_id, worker_id, link, link_hash, previous_uses, previous_workers))
+        return True
     except Error as e:
+        raise_if_retryable(e)
         logger.error(f"Ошибка отправки на проверку: {e}")
+        connection.rollback()
         return False
     finally:
         if connection.is_connected():
             connection.close()
 
 
-def get_user_active_order(user_id, order_id):
-    """Проверяет, есть ли у пользователя активный заказ"""
+@db_retry()
+def expire_overdue_assignments():
+    """Отменяет принятые заказы с истекшим сроком. Возвращает список отмененных"""
     connection = create_connection()
     if not connection:
-        return False
+        return []
 
     try:
-        cursor = connection.cursor()
+        cursor = connection.cursor(dictionary=True)
+        # Диапазонное сканирование индекса (status, due_at)
         cursor.execute("""
-        SELECT 1 FROM accepted_orders 
-        WHERE order_id = %s AND worker_id = %s 
-        AND status IN ('in_progress', 'waiting_review', 'under_review')
-        """, (order_id, user_id))
-        return cursor.fetchone() is not None
+        SELECT ao.id, ao.order_id, ao.worker_id, o.title
+        FROM accepted_orders ao
+        JOIN orders o ON ao.order_id = o.order_id
+        WHERE ao.status = 'in_progress' AND ao.due_at <= NOW()
+        FOR UPDATE
+        """)
+        expired = cursor.fetchall()
+        if not expired:
+            connection.rollback()
+            return []
+
+        placeholders = ', '.join(['%s'] * len(expired))
+        cursor.execute(f"""
+        UPDATE accepted_orders
+        SET status = 'canceled'
+        WHERE id IN ({placeholders})
+        """, tuple(assignment['id'] for assignment in expired))
+        for assignment in expired:
+            _increment_counters(cursor, 'worker_stats', 'worker_id', assignment['worker_id'], {'expired_count': 1})
+
+        connection.commit()
+        return expired
     except Error as e:
-        logger.error(f"Ошибка проверки заказа: {e}")
-        return False
+        raise_if_retryable(e)
+        logger.error(f"Ошибка отмены просроченных заказов: {e}")
+        connection.rollback()
+        return []
     finally:
         if connection.is_connected():
             connection.close()
 
 
-def delete_completed_order(order_id):
-    """Удаляет полностью выполненный заказ из БД"""
+@db_retry(idempotent=True)
+def get_reminder_candidates():
+    """Возвращает заказы в работе, пересекшие хотя бы один порог напоминания, с уже отправленными типами"""
+    if not _deadline_reminders:
+        return []
+
+    max_fraction = max((fraction or 0 for fraction, _ in _deadline_reminders.values()), default=0)
+    max_seconds = max((seconds or 0 for _, seconds in _deadline_reminders.values()), default=0)
+
     connection = create_connection()
     if not connection:
-        return False
+        return []
 
     try:
-        cursor = connection.cursor()
-
-        # Удаляем сначала принятые заказы
-        cursor.execute("DELETE FROM accepted_orders WHERE order_id = %s", (order_id,))
-
-        # Затем удаляем сам заказ
-        cursor.execute("DELETE FROM orders WHERE order_id = %s", (order_id,))
-
-        connection.commit()
-        return True
+        cursor = connection.cursor(dictionary=True)
+        # Диапазон по индексу (status, due_at): только заказы в работе, срок которых еще не истек
+        cursor.execute("""
+        SELECT ao.id, ao.worker_id, o.title, o.deadline,
+               TIMESTAMPDIFF(SECOND, NOW(), ao.due_at) AS seconds_left,
+               GROUP_CONCAT(r.reminder_kind) AS sent_kinds
+        FROM accepted_orders ao
+        JOIN orders o ON ao.order_id = o.order_id
+        LEFT JOIN deadline_reminders r ON r.assignment_id = ao.id
+        WHERE ao.status = 'in_progress' AND ao.due_at > NOW()
+        AND TIMESTAMPDIFF(SECOND, NOW(), ao.due_at) <= GREATEST(o.deadline * 3600 * %s, %s)
+        GROUP BY ao.id
+        """, (max_fraction, max_seconds))
+        return cursor.fetchall()
     except Error as e:
-        logger.error(f"Ошибка удаления заказа: {e}")
-        connection.rollback()
-        return False
+        raise_if_retryable(e)
+        logger.error(f"Ошибка поиска заказов для напоминаний: {e}")
+        return []
     finally:
         if connection.is_connected():
             connection.close()
 
 
-def create_payment(user_id, amount, method, details):
-    """Создает запись о выплате"""
+@db_retry(idempotent=True)
+def mark_reminders_sent(reminders):
+    """Отмечает напоминания [(assignment_id, тип), ...] отправленными"""
     connection = create_connection()
     if not connection:
         return False
 
     try:
         cursor = connection.cursor()
-        cursor.execute("""
-        INSERT INTO payments (user_id, amount, payment_method, details)
-        VALUES (%s, %s, %s, %s)
-        """, (user_id, amount, method, details))
+        cursor.executemany("""
+        INSERT IGNORE INTO deadline_reminders (assignment_id, reminder_kind)
+        VALUES (%s, %s)
+        """, reminders)
         connection.commit()
         return True
     except Error as e:
-        logger.error(f"Ошибка создания платежа: {e}")
+        raise_if_retryable(e)
+        logger.error(f"Ошибка сохранения напоминаний: {e}")
         return False
     finally:
         if connection.is_connected():
             connection.close()
 
 
-def create_deposit_request(user_id, amount, fio, phone, bank):
-    """Создает запрос на пополнение баланса"""
+@db_retry(idempotent=True)
+def get_user_active_order(user_id, order_id):
+    """Проверяет, есть ли у пользователя активный заказ"""
     connection = create_connection()
     if not connection:
         return False
@@ -661,57 +2077,2482 @@ def create_deposit_request(user_id, amount, fio, phone, bank):
     try:
         cursor = connection.cursor()
         cursor.execute("""
-        INSERT INTO deposits (user_id, amount, fio, phone, bank, status)
-        VALUES (%s, %s, %s, %s, %s, 'pending')
-        """, (user_id, amount, fio, phone, bank))
-        connection.commit()
-        return cursor.lastrowid
-    except Error as e:
-        logger.error(f"Ошибка создания запроса на пополнение: {e}")
-        return None
-    finally:
+        SELECT 1 FROM accepted_orders 
+        WHERE order_id = %s AND worker_id = %s 
+        AND status IN ('in_progress', 'waiting_review', 'under_review')
+        """, (order_id, user_id))
+        return cursor.fetchone() is not None
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка проверки заказа: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def finalize_order_if_completed(order_id, quantity):
+    """Завершает заказ, если его выполнили все исполнители. Заказ и задания остаются для истории"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT COUNT(*) as completed_count 
+        FROM accepted_orders 
+        WHERE order_id = %s AND status = 'completed'
+        """, (order_id,))
+        completed_count = cursor.fetchone()[0]
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка проверки завершения заказа: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+    if completed_count < quantity:
+        return False
+
+    update_order_status(order_id, 'completed')
+    return True
+
+
+def _select_stale_reviews(cursor, limit, lock=True):
+    """Возвращает работы, которые заказчики не проверили за REVIEW_SLA_HOURS; lock — заблокировать их"""
+    cursor.execute(f"""
+    SELECT ao.id, ao.order_id, ao.worker_id, o.user_id AS client_id,
+           o.title, o.price, o.description, o.quantity,
+           (SELECT s.link FROM submissions s WHERE s.assignment_id = ao.id
+            ORDER BY s.submission_id DESC LIMIT 1) AS link
+    FROM accepted_orders ao
+    JOIN orders o ON ao.order_id = o.order_id
+    WHERE ao.status = 'waiting_review' AND ao.review_started_at <= NOW() - INTERVAL %s HOUR
+    ORDER BY ao.review_started_at
+    LIMIT %s
+    {'FOR UPDATE' if lock else ''}
+    """, (REVIEW_SLA_HOURS, limit))
+    return cursor.fetchall()
+
+
+@db_retry(idempotent=True)
+def get_stale_reviews(limit):
+    """Возвращает работы, которые заказчики не проверили за REVIEW_SLA_HOURS"""
+    connection = create_connection()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        return _select_stale_reviews(cursor, limit, lock=False)
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка поиска непроверенных работ: {e}")
+        return []
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def escalate_stale_reviews(limit):
+    """Передает просроченные проверкой работы на рассмотрение администратору одной транзакцией"""
+    connection = create_connection()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        stale = _select_stale_reviews(cursor, limit)
+        if not stale:
+            connection.rollback()
+            return []
+
+        placeholders = ', '.join(['%s'] * len(stale))
+        cursor.execute(f"""
+        UPDATE accepted_orders
+        SET status = 'under_review'
+        WHERE id IN ({placeholders})
+        """, tuple(review['id'] for review in stale))
+        cursor.execute(f"""
+        UPDATE submissions
+        SET decision = 'disputed', reason = %s, decided_at = NOW()
+        WHERE assignment_id IN ({placeholders}) AND decision = 'pending'
+        """, (f"Заказчик не проверил работу за {REVIEW_SLA_HOURS} ч.",) + tuple(review['id'] for review in stale))
+        for review in stale:
+            _increment_counters(cursor, 'worker_stats', 'worker_id', review['worker_id'], {'disputed_count': 1})
+
+        connection.commit()
+        return stale
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка передачи работ администратору: {e}")
+        connection.rollback()
+        return []
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def bump_cache_version(cache_name):
+    """Увеличивает версию кэша, чтобы другие процессы его сбросили"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("UPDATE cache_versions SET version = version + 1 WHERE cache_name = %s", (cache_name,))
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка обновления версии кэша: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_cache_versions():
+    """Возвращает {имя кэша: версия}"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT cache_name, version FROM cache_versions")
+        return dict(cursor.fetchall())
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения версий кэша: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def log_feed_changes(order_ids, worker_id=None):
+    """Записывает измененные заказы в журнал, из которого их подхватят остальные процессы"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        rows = [(os.getpid(), order_id, None) for order_id in order_ids]
+        if worker_id is not None:
+            rows.append((os.getpid(), None, worker_id))
+        cursor.executemany(
+            "INSERT INTO feed_changes (process_id, order_id, worker_id) VALUES (%s, %s, %s)", rows)
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка записи изменений ленты: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_feed_changes(after_id, limit):
+    """Возвращает (изменения после after_id, первый и последний номер в журнале)"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT MIN(change_id) AS first_id, MAX(change_id) AS last_id FROM feed_changes")
+        bounds = cursor.fetchone()
+        changes = []
+        if after_id is not None:
+            cursor.execute("""
+            SELECT change_id, process_id, order_id, worker_id FROM feed_changes
+            WHERE change_id > %s ORDER BY change_id LIMIT %s
+            """, (after_id, limit))
+            changes = cursor.fetchall()
+        return changes, bounds['first_id'], bounds['last_id']
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения изменений ленты: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def prune_feed_changes():
+    """Удаляет из журнала изменения ленты старше FEED_CHANGES_RETENTION"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM feed_changes WHERE created_at < NOW() - INTERVAL %s SECOND",
+                       (FEED_CHANGES_RETENTION,))
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка очистки журнала изменений ленты: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def load_partition_user_data(partition, partitions):
+    """Возвращает сохраненные user_data (JSON) пользователей, которые обслуживает этот процесс"""
+    connection = create_connection()
+    if not connection:
+        return {}
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT user_id, data FROM bot_user_data
+        WHERE MOD(user_id, %s) = %s
+        """, (partitions, partition))
+        return dict(cursor.fetchall())
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка загрузки данных пользователей: {e}")
+        return {}
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def save_user_data(user_id, data):
+    """Сохраняет user_data пользователя (JSON)"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT INTO bot_user_data (user_id, data) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE data = VALUES(data)
+        """, (user_id, data))
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка сохранения данных пользователя: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def load_partition_conversations(name, partition, partitions):
+    """Возвращает состояния диалога name для пользователей этого процесса"""
+    connection = create_connection()
+    if not connection:
+        return {}
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT conv_key, state FROM bot_conversations
+        WHERE name = %s AND MOD(user_id, %s) = %s
+        """, (name, partitions, partition))
+        return {tuple(json.loads(conv_key)): json.loads(state) for conv_key, state in cursor.fetchall()}
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка загрузки состояний диалогов: {e}")
+        return {}
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def save_conversation(name, key, state):
+    """Сохраняет состояние диалога или удаляет его, если диалог завершен (state is None)"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        conv_key = json.dumps(list(key))
+        if state is None:
+            cursor.execute("DELETE FROM bot_conversations WHERE name = %s AND conv_key = %s", (name, conv_key))
+        else:
+            # Ключ диалога — (chat_id, user_id), последний элемент — пользователь
+            cursor.execute("""
+            INSERT INTO bot_conversations (name, conv_key, user_id, state) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE state = VALUES(state)
+            """, (name, conv_key, key[-1], json.dumps(state)))
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка сохранения состояния диалога: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def create_payment(user_id, amount, method, details):
+    """Создает запись о выплате и возвращает ее ID"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT INTO payments (user_id, amount, payment_method, details)
+        VALUES (%s, %s, %s, %s)
+        """, (user_id, amount, method, details))
+        connection.commit()
+        return cursor.lastrowid
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка создания платежа: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def complete_payment(payment_id):
+    """Отмечает выплату выполненной"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT amount FROM payments
+        WHERE payment_id = %s AND status = 'pending'
+        FOR UPDATE
+        """, (payment_id,))
+        result = cursor.fetchone()
+        if not result:
+            connection.rollback()
+            return False
+
+        cursor.execute("UPDATE payments SET status = 'completed' WHERE payment_id = %s", (payment_id,))
+        record_daily_stats(cursor, withdrawals_paid=result[0])
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка завершения выплаты: {e}")
+        connection.rollback()
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def create_payout_batch(moderator_id):
+    """Собирает ожидающие выплаты в пакет одной транзакцией.
+
+    Платежи остаются ожидающими, пока модератор не подтвердит оплату пакета.
+    Возвращает (batch_id, число платежей, сумма) или None, если выплат нет.
+    """
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO payout_batches (created_by) VALUES (%s)", (moderator_id,))
+        batch_id = cursor.lastrowid
+
+        # Условие batch_id IS NULL не даст включить платеж в два пакета одновременно
+        cursor.execute("""
+        UPDATE payments
+        SET batch_id = %s
+        WHERE status = 'pending' AND batch_id IS NULL
+        ORDER BY payment_id
+        LIMIT %s
+        """, (batch_id, PAYOUT_BATCH_LIMIT))
+        if cursor.rowcount == 0:
+            connection.rollback()
+            return None
+
+        cursor.execute("""
+        SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM payments WHERE batch_id = %s
+        """, (batch_id,))
+        payments_count, total_amount = cursor.fetchone()
+
+        cursor.execute("""
+        UPDATE payout_batches
+        SET payments_count = %s, total_amount = %s
+        WHERE batch_id = %s
+        """, (payments_count, total_amount, batch_id))
+        # Заявки переходят в пакет и больше не ждут модератора в очереди
+        cursor.execute("""
+        UPDATE moderation_queue mq
+        JOIN payments p ON mq.ref_key = CAST(p.payment_id AS CHAR)
+        SET mq.status = 'done', mq.resolved_at = NOW(), mq.claimed_until = NULL
+        WHERE mq.item_type = 'withdrawal' AND p.batch_id = %s
+        """, (batch_id,))
+
+        connection.commit()
+        return batch_id, payments_count, total_amount
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка создания пакета выплат: {e}")
+        connection.rollback()
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def complete_payout_batch(batch_id):
+    """Отмечает платежи пакета выполненными после подтверждения оплаты модератором.
+
+    Возвращает список получателей или None, если пакет не найден или уже подтвержден.
+    """
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        # Блокировка строки пакета не даст подтвердить его дважды
+        cursor.execute("""
+        SELECT batch_id FROM payout_batches
+        WHERE batch_id = %s AND paid_at IS NULL
+        FOR UPDATE
+        """, (batch_id,))
+        if not cursor.fetchone():
+            connection.rollback()
+            return None
+
+        cursor.execute("""
+        SELECT user_id, amount FROM payments
+        WHERE batch_id = %s AND status = 'pending'
+        FOR UPDATE
+        """, (batch_id,))
+        payments = cursor.fetchall()
+
+        cursor.execute("""
+        UPDATE payments SET status = 'completed'
+        WHERE batch_id = %s AND status = 'pending'
+        """, (batch_id,))
+        record_daily_stats(cursor, withdrawals_paid=sum((amount for _, amount in payments), Decimal('0')))
+        cursor.execute("UPDATE payout_batches SET paid_at = NOW() WHERE batch_id = %s", (batch_id,))
+
+        connection.commit()
+        # Пользователь с несколькими платежами в пакете получит одно уведомление
+        return list(dict.fromkeys(user_id for user_id, _ in payments))
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка подтверждения пакета выплат: {e}")
+        connection.rollback()
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+def stream_batch_payments(batch_id, handle_payment):
+    """Передает платежи пакета в handle_payment по одному, читая их небуферизованным курсором"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        # Небуферизованный курсор получает строки с сервера по мере чтения, не загружая весь пакет в память
+        cursor = connection.cursor(dictionary=True, buffered=False)
+        cursor.execute("""
+        SELECT payment_id, user_id, amount, payment_method, details, created_at
+        FROM payments
+        WHERE batch_id = %s
+        ORDER BY payment_id
+        """, (batch_id,))
+        for payment in cursor:
+            handle_payment(payment)
+        return True
+    except Error as e:
+        logger.error(f"Ошибка чтения пакета выплат: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def create_deposit_request(user_id, amount, fio, phone, bank):
+    """Создает запрос на пополнение баланса"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT INTO deposits (user_id, amount, fio, phone, bank, status)
+        VALUES (%s, %s, %s, %s, %s, 'pending')
+        """, (user_id, amount, fio, phone, bank))
+        connection.commit()
+        return cursor.lastrowid
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка создания запроса на пополнение: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def complete_deposit(deposit_id):
+    """Подтверждает пополнение баланса"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        # Получаем данные о пополнении
+        # Подтверждаем только ожидающее пополнение, чтобы не зачислить его дважды
+        cursor.execute("""
+        SELECT user_id, amount FROM deposits
+        WHERE deposit_id = %s AND status = 'pending'
+        FOR UPDATE
+        """, (deposit_id,))
+        deposit = cursor.fetchone()
+
+        if not deposit:
+            connection.rollback()
+            return False
+
+        # Обновляем баланс
+        cursor.execute("""
+        UPDATE users 
+        SET client_balance = client_balance + %s 
+        WHERE user_id = %s
+        """, (deposit['amount'], deposit['user_id']))
+
+        # Обновляем статус пополнения
+        cursor.execute("""
+        UPDATE deposits 
+        SET status = 'completed' 
+        WHERE deposit_id = %s
+        """, (deposit_id,))
+        record_daily_stats(cursor, deposits_count=1, deposits_amount=deposit['amount'])
+
+        connection.commit()
+        publish(DepositConfirmed(deposit_id, deposit['user_id'], deposit['amount']))
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка подтверждения пополнения: {e}")
+        connection.rollback()
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_pending_deposits():
+    """Возвращает все ожидающие подтверждения пополнения"""
+    connection = create_connection()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+        SELECT deposit_id, user_id, amount, fio, phone
+        FROM deposits
+        WHERE status = 'pending'
+        ORDER BY deposit_id
+        """)
+        return cursor.fetchall()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения ожидающих пополнений: {e}")
+        return []
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def complete_deposits_batch(deposit_ids):
+    """Подтверждает несколько пополнений одной транзакцией. Возвращает подтвержденные пополнения"""
+    if not deposit_ids:
+        return []
+
+    connection = create_connection()
+    if not connection:
+        return []
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        placeholders = ', '.join(['%s'] * len(deposit_ids))
+
+        # Блокируем пополнения, чтобы их не подтвердили параллельно вручную
+        cursor.execute(f"""
+        SELECT deposit_id, user_id, amount
+        FROM deposits
+        WHERE deposit_id IN ({placeholders}) AND status = 'pending'
+        FOR UPDATE
+        """, tuple(deposit_ids))
+        deposits = cursor.fetchall()
+        if not deposits:
+            connection.rollback()
+            return []
+
+        # Одно обновление баланса на пользователя
+        totals = {}
+        for deposit in deposits:
+            totals[deposit['user_id']] = totals.get(deposit['user_id'], 0) + deposit['amount']
+        cursor.executemany("""
+        UPDATE users
+        SET client_balance = client_balance + %s
+        WHERE user_id = %s
+        """, [(amount, user_id) for user_id, amount in totals.items()])
+
+        confirmed_ids = [deposit['deposit_id'] for deposit in deposits]
+        placeholders = ', '.join(['%s'] * len(confirmed_ids))
+        cursor.execute(f"""
+        UPDATE deposits
+        SET status = 'completed'
+        WHERE deposit_id IN ({placeholders})
+        """, tuple(confirmed_ids))
+        record_daily_stats(cursor, deposits_count=len(deposits),
+                           deposits_amount=sum(deposit['amount'] for deposit in deposits))
+        cursor.execute(f"""
+        UPDATE moderation_queue
+        SET status = 'done', resolved_at = NOW(), claimed_until = NULL
+        WHERE item_type = 'deposit' AND ref_key IN ({placeholders})
+        """, tuple(str(deposit_id) for deposit_id in confirmed_ids))
+
+        connection.commit()
+        for deposit in deposits:
+            publish(DepositConfirmed(deposit['deposit_id'], deposit['user_id'], deposit['amount']))
+        return deposits
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка пакетного подтверждения пополнений: {e}")
+        connection.rollback()
+        return []
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+def enqueue_moderation_item(item_type, ref_key, text, actions):
+    """Добавляет элемент в очередь модерации (или возвращает в нее повторно)"""
+    return enqueue_moderation_items([(item_type, ref_key, text, actions)])
+
+
+@db_retry()
+def enqueue_moderation_items(items):
+    """Добавляет в очередь модерации несколько элементов [(тип, ref_key, текст, кнопки), ...]"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.executemany("""
+        INSERT INTO moderation_queue (item_type, ref_key, text, actions)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            text = VALUES(text), actions = VALUES(actions), status = 'pending',
+            claimed_by = NULL, claimed_until = NULL, resolved_at = NULL, created_at = CURRENT_TIMESTAMP
+        """, [(item_type, str(ref_key), text, json.dumps(actions, ensure_ascii=False))
+              for item_type, ref_key, text, actions in items])
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка добавления в очередь модерации: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def get_moderation_queue(moderator_id, page=0, per_page=QUEUE_PER_PAGE):
+    """Возвращает (доступные модератору элементы очереди, есть ли следующая страница)"""
+    connection = create_connection()
+    if not connection:
+        return [], False
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+        SELECT item_id, item_type, ref_key, claimed_by, created_at
+        FROM moderation_queue
+        WHERE status = 'pending'
+           OR (status = 'claimed' AND (claimed_until < NOW() OR claimed_by = %s))
+        ORDER BY item_id
+        LIMIT %s OFFSET %s
+        """, (moderator_id, per_page + 1, page * per_page))
+        items = cursor.fetchall()
+        return items[:per_page], len(items) > per_page
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка получения очереди модерации: {e}")
+        return [], False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def claim_moderation_item(item_id, moderator_id):
+    """Атомарно закрепляет элемент очереди за модератором. Возвращает элемент или None"""
+    connection = create_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        # Закрепить можно свободный элемент, элемент с истекшим сроком или уже свой (продление)
+        cursor.execute("""
+        UPDATE moderation_queue
+        SET status = 'claimed', claimed_by = %s, claimed_until = NOW() + INTERVAL %s SECOND
+        WHERE item_id = %s
+        AND (status = 'pending' OR (status = 'claimed' AND (claimed_until < NOW() OR claimed_by = %s)))
+        """, (moderator_id, MODERATION_LEASE_SECONDS, item_id, moderator_id))
+        connection.commit()
+
+        cursor.execute("""
+        SELECT * FROM moderation_queue
+        WHERE item_id = %s AND status = 'claimed' AND claimed_by = %s
+        """, (item_id, moderator_id))
+        return cursor.fetchone()
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка закрепления элемента очереди: {e}")
+        connection.rollback()
+        return None
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry()
+def acquire_moderation_item(item_type, ref_key, moderator_id):
+    """Закрепляет объект модерации за модератором перед действием.
+
+    Возвращает False, если объект уже обработан или закреплен за другим модератором.
+    Объекты, которых нет в очереди (созданные до ее появления), разрешено обрабатывать.
+    """
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        UPDATE moderation_queue
+        SET status = 'claimed', claimed_by = %s, claimed_until = NOW() + INTERVAL %s SECOND
+        WHERE item_type = %s AND ref_key = %s
+        AND (status = 'pending' OR (status = 'claimed' AND (claimed_until < NOW() OR claimed_by = %s)))
+        """, (moderator_id, MODERATION_LEASE_SECONDS, item_type, str(ref_key), moderator_id))
+        connection.commit()
+
+        cursor.execute("""
+        SELECT status, claimed_by FROM moderation_queue
+        WHERE item_type = %s AND ref_key = %s
+        """, (item_type, str(ref_key)))
+        result = cursor.fetchone()
+        if not result:
+            return True
+        return result[0] == 'claimed' and result[1] == moderator_id
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка закрепления объекта модерации: {e}")
+        connection.rollback()
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def release_moderation_item(item_id, moderator_id):
+    """Возвращает закрепленный модератором элемент в очередь"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        UPDATE moderation_queue
+        SET status = 'pending', claimed_by = NULL, claimed_until = NULL
+        WHERE item_id = %s AND status = 'claimed' AND claimed_by = %s
+        """, (item_id, moderator_id))
+        connection.commit()
+        return cursor.rowcount > 0
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка возврата элемента в очередь: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+@db_retry(idempotent=True)
+def resolve_moderation_item(item_type, ref_key):
+    """Отмечает объект модерации как обработанный"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        UPDATE moderation_queue
+        SET status = 'done', resolved_at = NOW(), claimed_until = NULL
+        WHERE item_type = %s AND ref_key = %s
+        """, (item_type, str(ref_key)))
+        connection.commit()
+        return True
+    except Error as e:
+        raise_if_retryable(e)
+        logger.error(f"Ошибка завершения элемента очереди: {e}")
+        return False
+    finally:
         if connection.is_connected():
             connection.close()
 
 
-def complete_deposit(deposit_id):
-    """Подтверждает пополнение баланса"""
-    connection = create_connection()
-    if not connection:
-        return False
+# ========== ЛЕНТА ЗАКАЗОВ ==========
+
+# Активные заказы в памяти: два отсортированных списка ключей дают все четыре сортировки
+# (по возрастанию — прямой обход, по убыванию — обратный), любая страница — O(log n + размер страницы)
+_feed = {
+    'loaded': False,
+    'version': 0,  # Увеличивается при каждом изменении ленты
+    'orders': {},  # order_id -> строка заказа
+    'by_price': [],  # [(price, order_id), ...] по возрастанию
+    'by_created': []  # [(created_at, order_id), ...] по возрастанию
+}
+FEED_SORTS = {
+    'price_high': ('by_price', True),
+    'price_low': ('by_price', False),
+    'newest': ('by_created', True),
+    'oldest': ('by_created', False)
+}
+_worker_exclusions = {}  # worker_id -> (время загрузки, id заказов, число активных заказов)
+_feed_cache_lock = threading.Lock()
+
+
+def _feed_keys(order):
+    """Ключи заказа в отсортированных списках ленты"""
+    return {'by_price': (order['price'], order['order_id']), 'by_created': (order['created_at'], order['order_id'])}
+
+
+def _feed_insert(order):
+    """Добавляет заказ в ленту (вызывается под _feed_cache_lock)"""
+    _feed['orders'][order['order_id']] = order
+    for structure, key in _feed_keys(order).items():
+        bisect.insort(_feed[structure], key)
+
+
+def _feed_remove(order_id):
+    """Убирает заказ из ленты (вызывается под _feed_cache_lock)"""
+    order = _feed['orders'].pop(order_id, None)
+    if order is None:
+        return
+    for structure, key in _feed_keys(order).items():
+        keys = _feed[structure]
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+
+def _replace_feed(orders):
+    """Заменяет ленту целиком (вызывается под _feed_cache_lock)"""
+    _feed['orders'] = {order['order_id']: order for order in orders}
+    _feed['by_price'] = sorted(_feed_keys(order)['by_price'] for order in orders)
+    _feed['by_created'] = sorted(_feed_keys(order)['by_created'] for order in orders)
+    _feed['loaded'] = True
+    _feed['version'] += 1
+
+
+def _ensure_feed():
+    """Загружает ленту из базы при первом обращении или после сброса"""
+    if _feed['loaded']:
+        return
+    orders, ok = call_db(get_active_orders, 'newest', primary=True)
+    if not ok:
+        # База недоступна — показываем прежнюю ленту и попробуем загрузить в следующий раз
+        return
+    with _feed_cache_lock:
+        if not _feed['loaded']:
+            _replace_feed(orders)
+
+
+def feed_refresh_order(order_id):
+    """Перечитывает один заказ из базы и обновляет его место в ленте"""
+    if not _feed['loaded']:
+        return
+    try:
+        order, ok = call_db(get_active_order_row, order_id)
+    except Error:
+        ok = False
+    if not ok:
+        # Не знаем актуального состояния: прежняя лента остается, а когда база ответит — перезагрузим ее целиком
+        with _feed_cache_lock:
+            _feed['loaded'] = False
+        return
+
+    with _feed_cache_lock:
+        _feed_remove(order_id)
+        if order:
+            _feed_insert(order)
+        _feed['version'] += 1
+
+
+def _reset_local_feed_cache():
+    """Сбрасывает ленту и исключения всех исполнителей в этом процессе после изменений в другом процессе"""
+    with _feed_cache_lock:
+        _feed['loaded'] = False
+        _worker_exclusions.clear()
+
+
+def invalidate_feed_cache(worker_id=None, order_ids=()):
+    """Обновляет в ленте измененные заказы и, если указан исполнитель, сбрасывает его набор исключений"""
+    with _feed_cache_lock:
+        if worker_id is not None:
+            _worker_exclusions.pop(worker_id, None)
+    for order_id in order_ids:
+        feed_refresh_order(order_id)
+    # Остальные процессы применят те же заказы из журнала изменений, без полной перезагрузки ленты
+    if BOT_PROCESSES > 1 and (order_ids or worker_id is not None):
+        log_feed_changes(order_ids, worker_id)
+
+
+def get_feed_snapshot():
+    """Возвращает (версия ленты, заказы от новых к старым)"""
+    _ensure_feed()
+    with _feed_cache_lock:
+        orders = _feed['orders']
+        return _feed['version'], [orders[order_id] for _, order_id in reversed(_feed['by_created'])]
+
+
+def get_feed_page(sort_by, page, per_page, excluded=()):
+    """Возвращает (заказы страницы, всего заказов) без исключенных заказов"""
+    _ensure_feed()
+    structure, descending = FEED_SORTS.get(sort_by, FEED_SORTS['newest'])
+
+    with _feed_cache_lock:
+        keys = _feed[structure]
+        count = len(keys)
+
+        def position(order_id):
+            index = bisect.bisect_left(keys, _feed_keys(_feed['orders'][order_id])[structure])
+            return count - 1 - index if descending else index
+
+        # Позиции исключенных заказов в выбранной сортировке: их немного, поэтому пропуск дешевый
+        skipped = sorted(position(order_id) for order_id in excluded if order_id in _feed['orders'])
+        skipped_set = set(skipped)
+
+        # Смещение страницы берем сразу по позиции, сдвигая его на каждый исключенный заказ не дальше него
+        index = page * per_page
+        for skipped_position in skipped:
+            if skipped_position > index:
+                break
+            index += 1
+
+        # Фильтруем только окно страницы: per_page позиций плюс исключенные внутри него
+        result = []
+        while index < count and len(result) < per_page:
+            end = min(count, index + per_page - len(result))
+            window = keys[count - end:count - index][::-1] if descending else keys[index:end]
+            for position, key in enumerate(window, index):
+                if position not in skipped_set:
+                    result.append(_feed['orders'][key[1]])
+            index = end
+
+        return result, count - len(skipped)
+
+
+def reconcile_feed_job(context: CallbackContext):
+    """Сверяет ленту в памяти с базой и исправляет расхождения"""
+    if not _feed['loaded']:
+        return
+
+    version = _feed['version']
+    orders, ok = call_db(get_active_orders, 'newest', primary=True)
+    if not ok:
+        return
+    with _feed_cache_lock:
+        # Лента изменилась, пока шел запрос, — сверим в следующий раз, чтобы не откатить свежие изменения
+        if _feed['version'] != version:
+            return
+        actual = {order['order_id']: order for order in orders}
+        stale = sum(1 for order_id, order in _feed['orders'].items() if actual.get(order_id) != order)
+        missing = sum(1 for order_id in actual if order_id not in _feed['orders'])
+        if stale or missing:
+            logger.warning(f"Лента расходилась с базой: устаревших {stale}, отсутствовавших {missing}")
+            _replace_feed(orders)
+
+
+def get_worker_exclusions(worker_id):
+    """Возвращает (id заказов, которые исполнитель уже брал или отменил, число его активных заказов)"""
+    now = time.monotonic()
+    with _feed_cache_lock:
+        cached = _worker_exclusions.get(worker_id)
+    if cached and now - cached[0] < FEED_CACHE_TTL:
+        return cached[1], cached[2]
+
+    result = get_worker_order_ids(worker_id)
+    if result is None:
+        return set(), 0
+
+    order_ids, active_count = result
+    with _feed_cache_lock:
+        # Удаляем устаревшие записи, чтобы кэш не рос бесконечно
+        for key in [key for key, value in _worker_exclusions.items() if now - value[0] >= FEED_CACHE_TTL]:
+            del _worker_exclusions[key]
+        _worker_exclusions[worker_id] = (now, order_ids, active_count)
+    return order_ids, active_count
+
+
+def get_worker_feed(worker_id, sort_by='newest', page=0, per_page=5):
+    """Возвращает (страница ленты без заказов, что исполнитель уже брал, всего заказов, число его активных заказов)"""
+    excluded, active_count = get_worker_exclusions(worker_id)
+    orders, total = get_feed_page(sort_by, page, per_page, excluded)
+    return orders, total, active_count
+
+
+# ========== КЭШ ЗАКАЗОВ ==========
+
+_order_cache = OrderedDict()  # order_id -> (версия, время загрузки, строка заказа)
+_order_versions = {}  # order_id -> число изменений заказа
+_order_cache_state = {'epoch': 0}  # Эпоха увеличивается при полном сбросе кэша
+_order_cache_lock = threading.Lock()
+
+
+def _order_version(order_id):
+    """Возвращает текущую версию заказа: (эпоха кэша, число изменений)"""
+    return _order_cache_state['epoch'], _order_versions.get(order_id, 0)
+
+
+def _reset_local_order_cache():
+    """Сбрасывает кэш заказов этого процесса целиком: все загрузки, начатые раньше, тоже устаревают"""
+    with _order_cache_lock:
+        _order_cache_state['epoch'] += 1
+        _order_versions.clear()
+        _order_cache.clear()
+
+
+def invalidate_order_details(order_id):
+    """Увеличивает версию заказа: закэшированная строка и загрузки, начатые до изменения, становятся устаревшими"""
+    with _order_cache_lock:
+        _order_versions[order_id] = _order_versions.get(order_id, 0) + 1
+        _order_cache.pop(order_id, None)
+        overflow = len(_order_versions) > ORDER_CACHE_SIZE * 10
+    # Счетчики изменений не должны расти бесконечно: время от времени начинаем новую эпоху
+    if overflow:
+        _reset_local_order_cache()
+    if BOT_PROCESSES > 1:
+        bump_cache_version('orders')
+
+
+def get_order_details(order_id):
+    """Возвращает детали заказа"""
+    now = time.monotonic()
+    with _order_cache_lock:
+        version = _order_version(order_id)
+        cached = _order_cache.get(order_id)
+        if cached and cached[0] == version and now - cached[1] < ORDER_CACHE_TTL:
+            _order_cache.move_to_end(order_id)
+            return dict(cached[2])
+
+    order = fetch_order_details(order_id)
+    if order is None:
+        return None
+
+    with _order_cache_lock:
+        # Заказ изменился, пока мы его читали, — не кэшируем устаревшую строку
+        if _order_version(order_id) == version:
+            _order_cache[order_id] = (version, now, order)
+            _order_cache.move_to_end(order_id)
+            while len(_order_cache) > ORDER_CACHE_SIZE:
+                _order_cache.popitem(last=False)
+    return dict(order)
+
+
+# ========== ИНЛАЙН-ПОИСК ==========
+
+# Индекс строится из ленты и перестраивается, когда она меняется
+_inline_index = {'source': None, 'orders': {}, 'positions': {}, 'vocabulary': [], 'postings': {}}
+_inline_query_cache = OrderedDict()  # нормализованный запрос -> список order_id
+_inline_lock = threading.Lock()
+
+
+def _inline_tokens(text):
+    """Разбивает текст на слова для инлайн-поиска"""
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def _refresh_inline_index():
+    """Перестраивает индекс, если лента изменилась"""
+    version, orders = get_feed_snapshot()
+    with _inline_lock:
+        if _inline_index['source'] == version:
+            return
+
+        postings = {}
+        for order in orders:
+            for word in set(_inline_tokens(order['title']) + _inline_tokens(order['description'])):
+                postings.setdefault(word, set()).add(order['order_id'])
+
+        _inline_index.update(
+            source=version,
+            orders={order['order_id']: order for order in orders},
+            positions={order['order_id']: position for position, order in enumerate(orders)},
+            vocabulary=sorted(postings),
+            postings=postings
+        )
+        _inline_query_cache.clear()
+
+
+def _match_prefix(prefix):
+    """Возвращает id заказов со словами, начинающимися с prefix (бинарный поиск по словарю)"""
+    vocabulary = _inline_index['vocabulary']
+    matched = set()
+    for index in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+        if not vocabulary[index].startswith(prefix):
+            break
+        matched |= _inline_index['postings'][vocabulary[index]]
+    return matched
+
+
+def search_inline_orders(text):
+    """Возвращает активные заказы, в названии или описании которых есть все слова запроса (по префиксу)"""
+    _refresh_inline_index()
+    tokens = _inline_tokens(text)
+    key = ' '.join(tokens)
+
+    with _inline_lock:
+        order_ids = _inline_query_cache.get(key)
+        if order_ids is not None:
+            _inline_query_cache.move_to_end(key)
+        else:
+            if tokens:
+                matched = _match_prefix(tokens[0])
+                for word in tokens[1:]:
+                    if not matched:
+                        break
+                    matched &= _match_prefix(word)
+                order_ids = sorted(matched, key=_inline_index['positions'].get)
+            else:
+                order_ids = list(_inline_index['orders'])
+
+            _inline_query_cache[key] = order_ids
+            while len(_inline_query_cache) > INLINE_QUERY_CACHE_SIZE:
+                _inline_query_cache.popitem(last=False)
+
+        return [_inline_index['orders'][order_id] for order_id in order_ids]
+
+
+def inline_query(update: Update, context: CallbackContext) -> None:
+    """Отвечает на инлайн-запрос списком подходящих заказов"""
+    query = update.inline_query
+    orders = search_inline_orders(query.query)
+
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+    page = orders[offset:offset + INLINE_RESULTS_LIMIT]
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if offset + INLINE_RESULTS_LIMIT < len(orders) else ''
+
+    results = []
+    for order in page:
+        free_slots = order['quantity'] - order['accepted_count']
+        results.append(InlineQueryResultArticle(
+            id=str(order['order_id']),
+            title=order['title'],
+            description=f"💵 {order['price']} руб. • ⏱ {order['deadline']} ч. • свободно мест: {free_slots}",
+            input_message_content=InputTextMessageContent(
+                f"📌 {order['title']}\n💵 Цена: {order['price']} руб.\n"
+                f"⏱ Срок: {order['deadline']} ч.\n👥 Свободно мест: {free_slots}"
+            ),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "📌 Открыть заказ", url=f"https://t.me/{context.bot.username}?start=order_{order['order_id']}"
+            )]])
+        ))
+
+    # Результаты одинаковы для всех пользователей, поэтому Telegram может отдавать их из своего кэша
+    query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
+
+
+# ========== ОЧЕРЕДЬ МОДЕРАЦИИ ==========
+
+MODERATION_TYPE_LABELS = {
+    'order': '🆕 Заказ',
+    'dispute': '⚠️ Спор',
+    'deposit': '💳 Пополнение',
+    'withdrawal': '💸 Вывод'
+}
+
+
+def is_moderator(user_id):
+    """Проверяет, является ли пользователь модератором"""
+    return user_id in MODERATOR_IDS
+
+
+def build_actions_markup(actions):
+    """Строит клавиатуру из списка рядов кнопок [(текст, callback_data), ...]"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in actions
+    ])
+
+
+def notify_moderators(bot, item_type, ref_key, text, actions):
+    """Ставит объект в очередь модерации и дублирует его администратору сообщением"""
+    enqueue_moderation_item(item_type, ref_key, text, actions)
+    try:
+        bot.send_message(chat_id=ADMIN_ID, text=text, reply_markup=build_actions_markup(actions))
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления админу: {e}")
+
+
+def claim_for_action(query, item_type, ref_key):
+    """Проверяет права модератора и закрепляет за ним объект перед выполнением действия"""
+    moderator_id = query.from_user.id
+    if not is_moderator(moderator_id):
+        logger.warning(f"Пользователь {moderator_id} попытался выполнить действие модератора")
+        return False
+
+    if not acquire_moderation_item(item_type, ref_key, moderator_id):
+        query.edit_message_text(
+            text=(query.message.text or '') + "\n\n⏳ Уже обработано или обрабатывается другим модератором."
+        )
+        return False
+    return True
+
+
+def build_queue_page(moderator_id, page=0):
+    """Формирует страницу очереди модерации"""
+    items, has_next = get_moderation_queue(moderator_id, page=page)
+
+    keyboard = []
+    if not items:
+        text = "✅ Очередь модерации пуста." if page == 0 else "Больше элементов в очереди нет."
+    else:
+        text = f"🗂 Очередь модерации (страница {page + 1}):"
+        for item in items:
+            mine = " 🔒" if item['claimed_by'] == moderator_id else ""
+            keyboard.append([InlineKeyboardButton(
+                f"{MODERATION_TYPE_LABELS.get(item['item_type'], item['item_type'])} #{item['ref_key']} "
+                f"от {item['created_at']:%d.%m %H:%M}{mine}",
+                callback_data=f"queue_claim_{item['item_id']}"
+            )])
+
+    pagination = []
+    if page > 0:
+        pagination.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"queue_page_{page - 1}"))
+    if has_next:
+        pagination.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"queue_page_{page + 1}"))
+    if pagination:
+        keyboard.append(pagination)
+
+    keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data=f"queue_page_{page}")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def queue_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /queue"""
+    moderator_id = update.effective_user.id
+    if not is_moderator(moderator_id):
+        update.message.reply_text("⛔ Команда доступна только модераторам.")
+        return
+
+    text, reply_markup = build_queue_page(moderator_id)
+    update.message.reply_text(text, reply_markup=reply_markup)
+
+
+def handle_queue_action(query):
+    """Обрабатывает навигацию по очереди модерации и закрепление элементов"""
+    moderator_id = query.from_user.id
+    if not is_moderator(moderator_id):
+        return
+
+    parts = query.data.split('_')
+    action = parts[1]
+    value = int(parts[2])
+
+    if action == 'page':
+        text, reply_markup = build_queue_page(moderator_id, page=value)
+        query.edit_message_text(text=text, reply_markup=reply_markup)
+
+    elif action == 'claim':
+        item = claim_moderation_item(value, moderator_id)
+        if not item:
+            text, reply_markup = build_queue_page(moderator_id)
+            query.edit_message_text(
+                text="⏳ Элемент уже обработан или закреплен за другим модератором.\n\n" + text,
+                reply_markup=reply_markup
+            )
+            return
+
+        actions = json.loads(item['actions'] or '[]')
+        keyboard = build_actions_markup(actions).inline_keyboard + [
+            [InlineKeyboardButton("↩️ Вернуть в очередь", callback_data=f"queue_release_{value}")],
+            [InlineKeyboardButton("🔙 К очереди", callback_data='queue_page_0')]
+        ]
+        query.edit_message_text(
+            text=f"{item['text']}\n\n🔒 Закреплено за вами до {item['claimed_until']:%H:%M}",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+    elif action == 'release':
+        release_moderation_item(value, moderator_id)
+        text, reply_markup = build_queue_page(moderator_id)
+        query.edit_message_text(text=text, reply_markup=reply_markup)
+
+
+# ========== МАССОВЫЕ РАССЫЛКИ ==========
+
+def send_bulk_messages(bot, messages):
+    """Рассылает сообщения [(chat_id, text), ...] не быстрее BULK_SEND_RATE в секунду.
+
+    Возвращает (отправлено, не доставлено).
+    """
+    interval = 1 / BULK_SEND_RATE
+    sent = failed = 0
+
+    for chat_id, text in messages:
+        started = time.monotonic()
+        for attempt in range(2):
+            try:
+                bot.send_message(chat_id=chat_id, text=text)
+                sent += 1
+                break
+            except RetryAfter as e:
+                # Telegram просит подождать — ждем и повторяем один раз
+                time.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.error(f"Ошибка массовой отправки пользователю {chat_id}: {e}")
+                failed += 1
+                break
+        else:
+            failed += 1
+
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+    return sent, failed
+
+
+def schedule_bulk_messages(job_queue, messages):
+    """Запускает рассылку в потоке JobQueue, чтобы не задерживать обработку обновлений"""
+    if not messages:
+        return
+
+    def job(context: CallbackContext):
+        sent, failed = send_bulk_messages(context.bot, messages)
+        logger.info(f"Массовая рассылка завершена: отправлено {sent}, ошибок {failed}")
+
+    job_queue.run_once(job, 0)
+
+
+# ========== ПЕРИОДИЧЕСКИЕ ЗАДАЧИ ==========
+
+def expire_assignments_job(context: CallbackContext):
+    """Отменяет просроченные заказы и уведомляет исполнителей"""
+    expired = expire_overdue_assignments()
+    if not expired:
+        return
+
+    for assignment in expired:
+        invalidate_feed_cache(assignment['worker_id'], [assignment['order_id']])
+        track_worker_event(context.bot, assignment['worker_id'], 'cancel', assignment['order_id'])
+
+    logger.info(f"Отменено просроченных заказов: {len(expired)}")
+    send_bulk_messages(context.bot, [
+        (assignment['worker_id'],
+         f"🕛 Время на выполнение заказа \"{assignment['title']}\" истекло. Заказ отменен и возвращен в биржу.")
+        for assignment in expired
+    ])
+
+
+def _parse_reminder_thresholds(value):
+    """Разбирает пороги напоминаний вида '25%,1h,30m' в {тип: (доля срока или None, секунды или None)}"""
+    thresholds = {}
+    for item in value.split(','):
+        item = item.strip().lower()
+        if item.endswith('%'):
+            thresholds[item] = (float(item[:-1]) / 100, None)
+        elif item.endswith('h'):
+            thresholds[item] = (None, int(float(item[:-1]) * 3600))
+        elif item.endswith('m'):
+            thresholds[item] = (None, int(float(item[:-1]) * 60))
+    return thresholds
+
+
+_deadline_reminders = _parse_reminder_thresholds(DEADLINE_REMINDERS)
+
+
+def deadline_reminders_job(context: CallbackContext):
+    """Рассылает напоминания исполнителям, у которых заканчивается время на заказ"""
+    reminders = []
+    messages = []
+
+    for assignment in get_reminder_candidates():
+        sent_kinds = set((assignment['sent_kinds'] or '').split(','))
+        # Фиксированный порог не меньше всего срока заказа пересечен уже при принятии — такое напоминание
+        # пришло бы сразу после принятия, поэтому его пропускаем
+        crossed = [
+            kind for kind, (fraction, seconds) in _deadline_reminders.items()
+            if kind not in sent_kinds and (fraction is not None or seconds < assignment['deadline'] * 3600)
+            and assignment['seconds_left'] <= (
+                assignment['deadline'] * 3600 * fraction if fraction is not None else seconds)
+        ]
+        if not crossed:
+            continue
+
+        # Если пересечено сразу несколько порогов, отправляем одно сообщение, а отмечаем все
+        reminders.extend((assignment['id'], kind) for kind in crossed)
+        hours = assignment['seconds_left'] // 3600
+        minutes = (assignment['seconds_left'] % 3600) // 60
+        messages.append((
+            assignment['worker_id'],
+            f"⏰ По заказу \"{assignment['title']}\" осталось {hours}ч {minutes}м. "
+            f"Не забудьте отправить работу через раздел «Мои заказы»."
+        ))
+
+    # Сначала фиксируем отправку, чтобы при сбое рассылки не напомнить дважды
+    if reminders and mark_reminders_sent(reminders):
+        sent, failed = send_bulk_messages(context.bot, messages)
+        logger.info(f"Напоминания о сроке: отправлено {sent}, ошибок {failed}")
+
+
+def stale_reviews_job(context: CallbackContext):
+    """Принимает или передает администратору работы, которые заказчики не проверили вовремя"""
+    if REVIEW_SLA_ACTION == 'approve':
+        # Тот же путь, что и при ручной приемке; уведомления, сводка и завершение заказов — подписчики WorkApproved.
+        # Работу, которую заказчик успел отклонить, from_status не даст принять
+        approved = 0
+        for review in get_stale_reviews(REVIEW_SWEEP_BATCH):
+            if approve_work(review['order_id'], review['worker_id'], review, 'timeout', from_status='waiting_review'):
+                approved += 1
+        if approved:
+            logger.info(f"Автоматически принято работ: {approved}")
+
+    elif REVIEW_SLA_ACTION == 'escalate':
+        escalated = escalate_stale_reviews(REVIEW_SWEEP_BATCH)
+        if not escalated:
+            return
+
+        enqueue_moderation_items([
+            ('dispute', f"{review['order_id']}_{review['worker_id']}",
+             format_submission_text(review, f"⏰ Заказчик не проверил работу за {REVIEW_SLA_HOURS} ч.:\n\n",
+                                    "Примите решение:"),
+             [[("✅ Принять работу", f"admin_final_approve_{review['order_id']}_{review['worker_id']}"),
+               ("❌ Отклонить работу", f"admin_final_reject_{review['order_id']}_{review['worker_id']}")]])
+            for review in escalated
+        ])
+
+        logger.info(f"Передано администратору непроверенных работ: {len(escalated)}")
+        try:
+            context.bot.send_message(
+                chat_id=ADMIN_ID,
+                text=f"⏰ {len(escalated)} работ не проверены заказчиками за {REVIEW_SLA_HOURS} ч. "
+                     f"и добавлены в очередь модерации: /queue"
+            )
+        except TelegramError as e:
+            logger.error(f"Ошибка отправки уведомления админу: {e}")
+        send_bulk_messages(context.bot, [
+            (review['client_id'],
+             f"Работа по вашему заказу \"{review['title']}\" не была проверена за {REVIEW_SLA_HOURS} ч. "
+             f"и передана администратору.")
+            for review in escalated
+        ])
+
+
+# ========== СВЕРКА БАНКОВСКОЙ ВЫПИСКИ ==========
+
+def _normalize_phone(phone):
+    """Оставляет последние 10 цифр номера телефона"""
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-10:] if len(digits) >= 10 else None
+
+
+def _normalize_fio(fio):
+    """Приводит ФИО к виду для сравнения: нижний регистр, без точек и лишних пробелов"""
+    fio = (fio or '').lower().replace('ё', 'е').replace('.', ' ')
+    return ' '.join(fio.split()) or None
+
+
+def _amount_key(amount):
+    """Переводит сумму в копейки для точного сравнения. Для нечисловых и бесконечных сумм — ValueError"""
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError(f"некорректная сумма: {amount!r}")
+    if not value.is_finite():
+        raise ValueError(f"некорректная сумма: {amount!r}")
+    return int(value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def _open_csv_upload(binary_file):
+    """Открывает загруженный файл как поток строк CSV, определяя кодировку и разделитель"""
+    sample = binary_file.read(64 * 1024)
+    binary_file.seek(0)
+    try:
+        sample_text = sample.decode('utf-8-sig')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        sample_text = sample.decode('cp1251', errors='replace')
+        encoding = 'cp1251'
+
+    try:
+        dialect = csv.Sniffer().sniff(sample_text, delimiters=';,\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    text_stream = io.TextIOWrapper(binary_file, encoding=encoding, errors='replace', newline='')
+    return csv.reader(text_stream, dialect)
+
+
+def _map_statement_columns(header):
+    """Находит номера нужных колонок по заголовку выписки"""
+    normalized = [column.strip().lower() for column in header]
+    columns = {}
+    for field, names in STATEMENT_COLUMNS.items():
+        for index, column in enumerate(normalized):
+            if column in names:
+                columns[field] = index
+                break
+    return columns
+
+
+def reconcile_statement(rows, pending_deposits):
+    """Сопоставляет строки выписки с ожидающими пополнениями по сумме и телефону.
+
+    Совпадение только по сумме и ФИО не подтверждается автоматически, а уходит на ручную проверку.
+    Возвращает (id совпавших пополнений, строки на проверку, несовпавшие строки, число строк, ошибка).
+    """
+    header = next(rows, None)
+    columns = _map_statement_columns(header or [])
+    if 'amount' not in columns or 'phone' not in columns:
+        return [], [], [], 0, "не найдены колонки суммы и телефона"
+
+    # Хэш-индексы ожидающих пополнений: (сумма, телефон) и (сумма, ФИО) -> id
+    by_phone = {}
+    by_fio = {}
+    for deposit in pending_deposits:
+        amount = _amount_key(deposit['amount'])
+        phone = _normalize_phone(deposit['phone'])
+        fio = _normalize_fio(deposit['fio'])
+        if phone:
+            by_phone.setdefault((amount, phone), []).append(deposit['deposit_id'])
+        if fio:
+            by_fio.setdefault((amount, fio), []).append(deposit['deposit_id'])
+
+    matched = []
+    used = set()
+    review = []
+    unmatched = []
+    total_rows = 0
+
+    for line_no, row in enumerate(rows, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        total_rows += 1
+
+        def cell(field):
+            index = columns.get(field)
+            return row[index] if index is not None and index < len(row) else ''
+
+        try:
+            amount = _amount_key(cell('amount').replace(' ', '').replace('\xa0', '').replace(',', '.'))
+        except ValueError:
+            unmatched.append((line_no, row))
+            continue
+
+        phone = _normalize_phone(cell('phone'))
+        fio = _normalize_fio(cell('fio'))
+        candidates = by_phone.get((amount, phone), []) if phone else []
+
+        deposit_id = next((candidate for candidate in candidates if candidate not in used), None)
+        if deposit_id is None:
+            # Одно ФИО не доказывает, что платил именно этот пользователь: решает модератор
+            fio_candidates = [candidate for candidate in by_fio.get((amount, fio), []) if candidate not in used] \
+                if fio else []
+            if fio_candidates:
+                review.append((line_no, row, fio_candidates))
+            else:
+                unmatched.append((line_no, row))
+            continue
+
+        used.add(deposit_id)
+        matched.append(deposit_id)
+
+    return matched, review, unmatched, total_rows, None
+
+
+def reconcile_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /reconcile — ждет загрузки CSV-выписки"""
+    if not is_moderator(update.effective_user.id):
+        update.message.reply_text("⛔ Команда доступна только модераторам.")
+        return
+    if reject_if_read_only(update.message.reply_text):
+        return
+
+    context.user_data['awaiting_statement'] = True
+    update.message.reply_text(
+        "📄 Отправьте банковскую выписку в формате CSV.\n\n"
+        "В заголовке должны быть колонки «Сумма» и «Телефон», по желанию — «ФИО». "
+        "Пополнения будут подтверждены, если совпадут сумма и телефон; "
+        "совпадения только по ФИО придут списком на ручную проверку."
+    )
+
+
+def process_bank_statement(update: Update, context: CallbackContext):
+    """Сверяет загруженную выписку с ожидающими пополнениями и подтверждает совпадения"""
+    del context.user_data['awaiting_statement']
+    document = update.message.document
+
+    with tempfile.TemporaryFile() as statement_file:
+        try:
+            context.bot.get_file(document.file_id).download(out=statement_file)
+        except TelegramError as e:
+            logger.error(f"Ошибка загрузки выписки: {e}")
+            update.message.reply_text("❌ Не удалось загрузить файл. Попробуйте еще раз.")
+            return
+        statement_file.seek(0)
+
+        rows = _open_csv_upload(statement_file)
+        try:
+            matched, review, unmatched, total_rows, error = reconcile_statement(rows, get_pending_deposits())
+        except csv.Error as e:
+            logger.error(f"Ошибка разбора выписки: {e}")
+            update.message.reply_text("❌ Не удалось разобрать CSV-файл.")
+            return
+
+    if error:
+        update.message.reply_text(f"❌ Ошибка сверки: {error}.")
+        return
+
+    confirmed = complete_deposits_batch(matched)
+    confirmed_total = sum(deposit['amount'] for deposit in confirmed)
+
+    report = (
+        f"📊 Сверка выписки завершена\n\n"
+        f"📄 Строк в выписке: {total_rows}\n"
+        f"✅ Подтверждено пополнений: {len(confirmed)} на {confirmed_total} руб.\n"
+        f"🔍 Совпали только по ФИО: {len(review)}\n"
+        f"❓ Без совпадений: {len(unmatched)}"
+    )
+    if len(confirmed) < len(matched):
+        report += f"\n⚠ Уже обработаны ранее: {len(matched) - len(confirmed)}"
+    if review:
+        report += "\n\nПроверьте вручную (телефон не совпал):\n" + '\n'.join(
+            f"{line_no}: {'; '.join(row)} → пополнения #{', #'.join(map(str, deposit_ids))}"
+            for line_no, row, deposit_ids in review[:STATEMENT_REPORT_LIMIT]
+        )
+        if len(review) > STATEMENT_REPORT_LIMIT:
+            report += f"\n... и еще {len(review) - STATEMENT_REPORT_LIMIT}"
+    if unmatched:
+        report += "\n\nСтроки без совпадений:\n" + '\n'.join(
+            f"{line_no}: {'; '.join(row)}" for line_no, row in unmatched[:STATEMENT_REPORT_LIMIT]
+        )
+        if len(unmatched) > STATEMENT_REPORT_LIMIT:
+            report += f"\n... и еще {len(unmatched) - STATEMENT_REPORT_LIMIT}"
+
+    # Ограничение Telegram на длину сообщения: строки выписки могут быть длинными
+    update.message.reply_text(report[:4096])
+
+
+def handle_document(update: Update, context: CallbackContext) -> None:
+    """Обрабатывает загруженные файлы"""
+    if context.user_data.get('awaiting_statement') and is_moderator(update.effective_user.id):
+        process_bank_statement(update, context)
+    elif context.user_data.get('awaiting_bulk_orders'):
+        process_bulk_orders_upload(update, context)
+
+
+# ========== ПАКЕТЫ ВЫПЛАТ ==========
+
+def build_payout_registries(batch_id):
+    """Раскладывает платежи пакета по CSV-реестрам для банка, по одному на способ выплаты.
+
+    Возвращает {способ: {'file', 'writer', 'count', 'total'}} или None.
+    """
+    registries = {}
+
+    def handle_payment(payment):
+        method = payment['payment_method'] or 'Без способа'
+        registry = registries.get(method)
+        if registry is None:
+            binary_file = tempfile.TemporaryFile()
+            text_file = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+            writer = csv.writer(text_file, delimiter=';')
+            writer.writerow(['ID платежа', 'ID пользователя', 'Сумма', 'Реквизиты', 'Дата запроса'])
+            registry = registries[method] = {'file': text_file, 'writer': writer, 'count': 0, 'total': 0}
+
+        registry['writer'].writerow([
+            payment['payment_id'], payment['user_id'], payment['amount'],
+            payment['details'], f"{payment['created_at']:%d.%m.%Y %H:%M}"
+        ])
+        registry['count'] += 1
+        registry['total'] += payment['amount']
+
+    if not stream_batch_payments(batch_id, handle_payment):
+        for registry in registries.values():
+            registry['file'].close()
+        return None
+    return registries
+
+
+def send_payout_registries(bot, chat_id, batch_id, registries):
+    """Отправляет реестры пакета выплат модератору файлами, возвращает True, если отправлены все"""
+    sent = True
+    for method, registry in registries.items():
+        text_file = registry['file']
+        method_slug = re.sub(r'\W+', '_', method).strip('_')
+        try:
+            text_file.flush()
+            text_file.seek(0)
+            bot.send_document(
+                chat_id=chat_id,
+                document=text_file.buffer,
+                filename=f"payouts_{batch_id}_{method_slug}.csv",
+                caption=f"💸 {method}: {registry['count']} платежей на {registry['total']} руб."
+            )
+        except TelegramError as e:
+            logger.error(f"Ошибка отправки реестра выплат: {e}")
+            sent = False
+        finally:
+            text_file.close()
+    return sent
+
+
+def payouts_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /payouts — формирует пакет выплат или повторно выгружает пакет по номеру"""
+    moderator_id = update.effective_user.id
+    if not is_moderator(moderator_id):
+        update.message.reply_text("⛔ Команда доступна только модераторам.")
+        return
+
+    if context.args:
+        try:
+            batch_id = int(context.args[0])
+        except ValueError:
+            update.message.reply_text("Использование: /payouts [номер пакета]")
+            return
+    else:
+        if reject_if_read_only(update.message.reply_text):
+            return
+        batch = create_payout_batch(moderator_id)
+        if not batch:
+            update.message.reply_text("✅ Ожидающих выплат нет.")
+            return
+        batch_id, payments_count, total_amount = batch
+        update.message.reply_text(
+            f"📦 Пакет выплат #{batch_id}: {payments_count} платежей на {total_amount} руб."
+        )
+
+    result = build_payout_registries(batch_id)
+    if result is None:
+        update.message.reply_text(
+            f"❌ Не удалось выгрузить реестры пакета #{batch_id}. Повторите: /payouts {batch_id}")
+        return
+
+    registries = result
+    if not registries:
+        update.message.reply_text(f"Пакет #{batch_id} не найден или пуст.")
+        return
+
+    if not send_payout_registries(context.bot, update.effective_chat.id, batch_id, registries):
+        update.message.reply_text(
+            f"❌ Не все реестры пакета #{batch_id} отправлены. Повторите: /payouts {batch_id}")
+        return
+
+    # Получатели узнают о выплате только после подтверждения оплаты пакета
+    keyboard = [[InlineKeyboardButton("✅ Пакет оплачен", callback_data=f"payout_paid_{batch_id}")]]
+    update.message.reply_text(
+        f"Переведите средства по реестрам пакета #{batch_id} и подтвердите оплату — "
+        f"получатели будут уведомлены.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+def confirm_payout_batch(query, context):
+    """Подтверждает оплату пакета выплат и уведомляет получателей"""
+    if not is_moderator(query.from_user.id):
+        query.message.reply_text("⛔ Действие доступно только модераторам.")
+        return
+
+    batch_id = int(query.data.split('_')[2])
+    recipients = complete_payout_batch(batch_id)
+    if recipients is None:
+        query.edit_message_text(text=query.message.text + "\n\n⚠️ Пакет уже подтвержден или не найден")
+        return
+
+    schedule_bulk_messages(context.job_queue, [(user_id, PAYOUT_NOTIFICATION) for user_id in recipients])
+    query.edit_message_text(
+        text=query.message.text + f"\n\n✅ Оплата подтверждена, уведомлено получателей: {len(recipients)}")
+
+
+# ========== СТАТИСТИКА ==========
+
+def stats_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /stats [дней] — показывает ежедневную сводку"""
+    if not is_moderator(update.effective_user.id):
+        update.message.reply_text("⛔ Команда доступна только модераторам.")
+        return
 
     try:
-        cursor = connection.cursor(dictionary=True)
-        # Получаем данные о пополнении
-        cursor.execute("SELECT user_id, amount FROM deposits WHERE deposit_id = %s", (deposit_id,))
-        deposit = cursor.fetchone()
+        days = int(context.args[0]) if context.args else STATS_DEFAULT_DAYS
+    except ValueError:
+        days = STATS_DEFAULT_DAYS
+    days = max(1, min(days, STATS_MAX_DAYS))
 
-        if not deposit:
+    rows = get_daily_stats(days)
+    if not rows:
+        update.message.reply_text(f"📊 Нет данных за последние {days} дн.")
+        return
+
+    fields = ('orders_created', 'gmv', 'commission', 'refunds', 'worker_payouts',
+              'withdrawals_requested', 'withdrawals_paid', 'deposits_count', 'deposits_amount')
+    totals = {field: sum(row[field] for row in rows) for field in fields}
+
+    def describe(stats):
+        return (
+            f"🆕 Заказов: {stats['orders_created']}, оборот: {stats['gmv']} руб., "
+            f"комиссия: {stats['commission']} руб., возвраты: {stats['refunds']} руб.\n"
+            f"👷 Начислено исполнителям: {stats['worker_payouts']} руб.\n"
+            f"💸 Выводы: запрошено {stats['withdrawals_requested']} руб., выплачено {stats['withdrawals_paid']} руб.\n"
+            f"💳 Пополнения: {stats['deposits_count']} на {stats['deposits_amount']} руб."
+        )
+
+    text = f"📊 Сводка за {days} дн.\n\nИтого:\n{describe(totals)}"
+
+    # Повторы транзакций, запросы к Telegram и потоки диспетчера считаются с запуска этого процесса
+    runtime = []
+    retry_totals = defaultdict(int)
+    for (counter, _, _), value in get_db_retry_stats().items():
+        retry_totals[counter] += value
+    if retry_totals:
+        runtime.append(f"🔁 Повторы транзакций с запуска: {retry_totals['retries']}, "
+                       f"успешных после повтора: {retry_totals['recovered']}, "
+                       f"исчерпано попыток: {retry_totals['exhausted']}")
+    bot_api = get_bot_api_metrics()
+    if bot_api['requests']:
+        runtime.append(f"🌐 Запросов к Telegram с запуска: {bot_api['requests']}, "
+                       f"одновременно до {bot_api['in_flight_high_watermark']} из {BOT_API_POOL_SIZE}, "
+                       f"сверх пула: {bot_api['overflow']}, ошибок: {bot_api['errors']}")
+    if isinstance(context.dispatcher, ShardedDispatcher):
+        shards = context.dispatcher.shard_metrics()
+        runtime.append(f"🧵 Потоки диспетчера: {len(shards)}, в очередях: {sum(shard[1] for shard in shards)}, "
+                       f"максимум очереди: {max(shard[2] for shard in shards)}, "
+                       f"обработано с запуска: {sum(shard[3] for shard in shards)}")
+        runtime += [f"   • поток {index}: в очереди {depth}, максимум {high_watermark}, обработано {processed}"
+                    for index, depth, high_watermark, processed in shards]
+    if runtime:
+        text += "\n\n" + "\n".join(runtime)
+    for row in rows:
+        text += f"\n\n📅 {row['stat_date']:%d.%m.%Y}\n{describe(row)}"
+
+    # Ограничение Telegram на длину сообщения
+    update.message.reply_text(text[:4096])
+
+
+# ========== ПОВТОРНЫЕ ССЫЛКИ ==========
+
+_link_bloom = bytearray(LINK_BLOOM_BITS // 8)
+_link_bloom_loaded = False
+_link_bloom_last_id = 0  # Последняя учтенная сдача; новые подгружаются при синхронизации процессов
+_link_bloom_lock = threading.Lock()
+
+
+def normalize_link(link):
+    """Приводит ссылку к каноническому виду: без схемы, www, якоря, utm-меток и завершающего слэша"""
+    parts = urlsplit(link.strip())
+    if not parts.netloc:
+        # Ссылка без схемы: "disk.yandex.ru/d/..."
+        parts = urlsplit('//' + link.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query)
+                             if not key.lower().startswith('utm_')))
+    # Регистр пути не меняем: идентификаторы файлов в облаках регистрозависимы
+    return urlunsplit(('', host, parts.path.rstrip('/'), query, '')).lstrip('/')
+
+
+def hash_link(link):
+    """Возвращает SHA-256 нормализованной ссылки"""
+    return hashlib.sha256(normalize_link(link).encode('utf-8')).hexdigest()
+
+
+def _bloom_positions(link_hash):
+    """Позиции битов для хэша ссылки (двойное хэширование по двум половинам SHA-256)"""
+    first = int(link_hash[:16], 16)
+    second = int(link_hash[16:32], 16) | 1
+    return [(first + i * second) % LINK_BLOOM_BITS for i in range(LINK_BLOOM_HASHES)]
+
+
+def load_new_link_hashes():
+    """Добавляет в фильтр Блума ссылки, сданные после последней загрузки (в том числе другими процессами)"""
+    global _link_bloom_last_id
+    with _link_bloom_lock:
+        rows = get_link_hashes(_link_bloom_last_id)
+        if rows is None:
             return False
+        for submission_id, link_hash in rows:
+            for position in _bloom_positions(link_hash):
+                _link_bloom[position >> 3] |= 1 << (position & 7)
+            _link_bloom_last_id = submission_id
+    return True
 
-        # Обновляем баланс
-        cursor.execute("""
-        UPDATE users 
-        SET client_balance = client_balance + %s 
-        WHERE user_id = %s
-        """, (deposit['amount'], deposit['user_id']))
 
-        # Обновляем статус пополнения
-        cursor.execute("""
-        UPDATE deposits 
-        SET status = 'completed' 
-        WHERE deposit_id = %s
-        """, (deposit_id,))
+def _ensure_link_bloom():
+    """Заполняет фильтр Блума хэшами из базы при первом обращении"""
+    global _link_bloom_loaded
+    if not _link_bloom_loaded and load_new_link_hashes():
+        _link_bloom_loaded = True
+    return _link_bloom_loaded
+
+
+def add_link_to_bloom(link_hash):
+    """Добавляет хэш сданной ссылки в фильтр Блума"""
+    with _link_bloom_lock:
+        for position in _bloom_positions(link_hash):
+            _link_bloom[position >> 3] |= 1 << (position & 7)
+
+
+def find_link_duplicates(link):
+    """Возвращает (повторов, исполнителей) для ссылки; база опрашивается только при срабатывании фильтра"""
+    link_hash = hash_link(link)
+    if _ensure_link_bloom() and not all(_link_bloom[position >> 3] & (1 << (position & 7))
+                                        for position in _bloom_positions(link_hash)):
+        return 0, 0
+    return get_link_usage(link_hash)
+
+
+def duplicates_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /duplicates — ссылки, которые сдавались чаще всего"""
+    if not is_moderator(update.effective_user.id):
+        update.message.reply_text("⛔ Команда доступна только модераторам.")
+        return
+
+    rows = get_top_reused_links(DUPLICATES_REPORT_LIMIT)
+    if not rows:
+        update.message.reply_text("🔗 Повторно сданных ссылок нет.")
+        return
+
+    text = "🔗 Чаще всего повторно сдаваемые ссылки:\n"
+    for number, row in enumerate(rows, 1):
+        text += (f"\n{number}. {row['link']}\n"
+                 f"   Сдана {row['uses']} раз, исполнителей: {row['workers']}, "
+                 f"последний раз {row['last_used']:%d.%m.%Y %H:%M}")
+
+    # Ограничение Telegram на длину сообщения
+    update.message.reply_text(text[:4096], disable_web_page_preview=True)
+
+
+# ========== МАССОВОЕ СОЗДАНИЕ ЗАКАЗОВ ==========
+
+def _positive_number(value, convert, message, maximum=None):
+    """Преобразует строку в положительное число не больше maximum или выбрасывает ValueError с текстом для пользователя"""
+    try:
+        number = convert(value)
+    except ValueError:
+        raise ValueError(message)
+    if number <= 0 or (maximum is not None and number > maximum):
+        raise ValueError(message)
+    return number
+
+
+def _positive_price(value, message):
+    """Преобразует строку в положительную сумму с точностью до копеек или выбрасывает ValueError"""
+    try:
+        price = Decimal(value)
+        # NaN и бесконечность ломают сравнение с балансом при списании
+        if not price.is_finite():
+            raise ValueError(message)
+        price = price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(message)
+    # Колонка orders.price — DECIMAL(10, 2)
+    if price <= 0 or price >= Decimal('1e8'):
+        raise ValueError(message)
+    return price
+
+
+def parse_bulk_orders(rows):
+    """Проверяет строки CSV с заказами за один проход.
+
+    Возвращает (заказы, [(номер строки, ошибка), ...], ошибка формата файла).
+    """
+    header = next(rows, None)
+    normalized = [column.strip().lower() for column in header or []]
+    columns = {}
+    for field, names in BULK_ORDER_COLUMNS.items():
+        for index, column in enumerate(normalized):
+            if column in names:
+                columns[field] = index
+                break
+    missing = [names[0] for field, names in BULK_ORDER_COLUMNS.items() if field not in columns]
+    if missing:
+        return [], [], f"не найдены колонки: {', '.join(missing)}"
+
+    orders = []
+    errors = []
+    for line_no, row in enumerate(rows, 2):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(orders) + len(errors) >= BULK_ORDERS_MAX_ROWS:
+            return [], [], f"в файле больше {BULK_ORDERS_MAX_ROWS} заказов"
+
+        values = {field: row[index].strip() if index < len(row) else '' for field, index in columns.items()}
+        try:
+            title = values['title']
+            if not title or len(title) > 100:
+                raise ValueError("название должно быть от 1 до 100 символов")
+            price = _positive_price(values['price'].replace(',', '.').replace(' ', ''),
+                                    "цена должна быть положительным числом")
+            quantity = _positive_number(values['quantity'], int,
+                                        f"количество должно быть целым числом от 1 до {ORDER_MAX_QUANTITY}",
+                                        ORDER_MAX_QUANTITY)
+            deadline = _positive_number(values['deadline'], int,
+                                        f"срок должен быть целым числом часов от 1 до {ORDER_MAX_DEADLINE}",
+                                        ORDER_MAX_DEADLINE)
+            if not values['description']:
+                raise ValueError("пустое описание")
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+            continue
+
+        orders.append({'title': title, 'price': price, 'quantity': quantity,
+                       'deadline': deadline, 'description': values['description']})
+
+    return orders, errors, None
+
+
+def start_bulk_orders(query, context: CallbackContext):
+    """Просит заказчика загрузить CSV-файл с заказами"""
+    context.user_data['awaiting_bulk_orders'] = True
+    query.edit_message_text(
+        text="📥 Отправьте CSV-файл с заказами.\n\n"
+             "Колонки: «Название», «Цена», «Количество», «Срок» (в часах), «Описание». "
+             f"Не более {BULK_ORDERS_MAX_ROWS} заказов в файле. Все заказы проверяются и оплачиваются одной суммой "
+             "(с учетом комиссии 50%).",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data='client_menu')]])
+    )
+
+
+def process_bulk_orders_upload(update: Update, context: CallbackContext):
+    """Проверяет загруженный файл с заказами и показывает итог к оплате"""
+    del context.user_data['awaiting_bulk_orders']
+    user_id = update.effective_user.id
+    document = update.message.document
+
+    with tempfile.TemporaryFile() as orders_file:
+        try:
+            context.bot.get_file(document.file_id).download(out=orders_file)
+        except TelegramError as e:
+            logger.error(f"Ошибка загрузки файла заказов: {e}")
+            update.message.reply_text("❌ Не удалось загрузить файл. Попробуйте еще раз.")
+            return
+        orders_file.seek(0)
+
+        try:
+            orders, errors, error = parse_bulk_orders(_open_csv_upload(orders_file))
+        except csv.Error as e:
+            logger.error(f"Ошибка разбора файла заказов: {e}")
+            update.message.reply_text("❌ Не удалось разобрать CSV-файл.")
+            return
+
+    if error:
+        update.message.reply_text(f"❌ Ошибка в файле: {error}.")
+        return
+    if errors:
+        report = f"❌ Найдены ошибки в {len(errors)} строках, заказы не созданы:\n" + '\n'.join(
+            f"Строка {line_no}: {message}" for line_no, message in errors[:BULK_ORDERS_ERRORS_LIMIT]
+        )
+        if len(errors) > BULK_ORDERS_ERRORS_LIMIT:
+            report += f"\n... и еще {len(errors) - BULK_ORDERS_ERRORS_LIMIT}"
+        update.message.reply_text(report)
+        return
+    if not orders:
+        update.message.reply_text("❌ В файле нет заказов.")
+        return
+
+    total = (sum(order['price'] * order['quantity'] for order in orders) * Decimal('1.5')).quantize(
+        Decimal('0.01'), rounding=ROUND_HALF_UP)  # 50% комиссия
+    client_balance = get_client_balance(user_id)
+    if client_balance < total:
+        update.message.reply_text(
+            f"❌ Недостаточно средств на балансе заказчика. Нужно: {total} руб., доступно: {client_balance} руб.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("💳 Пополнить баланс", callback_data='deposit')],
+                [InlineKeyboardButton("🔙 Назад", callback_data='client_menu')]
+            ])
+        )
+        return
+    if count_active_orders(user_id) + len(orders) > MAX_ACTIVE_ORDERS:
+        update.message.reply_text(f"⚠ Вы не можете иметь более {MAX_ACTIVE_ORDERS} активных заказов одновременно.")
+        return
+
+    context.user_data['bulk_orders'] = {'orders': orders, 'total': total}
+    update.message.reply_text(
+        f"📥 Заказов в файле: {len(orders)}\n"
+        f"👥 Всего исполнителей: {sum(order['quantity'] for order in orders)}\n"
+        f"💰 Итого к оплате (с комиссией 50%): {total} руб.\n\n"
+        f"Создать заказы?",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Создать", callback_data='bulk_confirm')],
+            [InlineKeyboardButton("❌ Отмена", callback_data='bulk_discard')]
+        ])
+    )
+
+
+def confirm_bulk_orders(query, context: CallbackContext):
+    """Создает проверенные заказы из файла и отправляет их на модерацию"""
+    bulk = context.user_data.pop('bulk_orders', None)
+    if not bulk:
+        query.edit_message_text(text="❌ Нет заказов для создания. Загрузите файл еще раз.")
+        return
+
+    user_id = query.from_user.id
+    orders = bulk['orders']
+    order_ids = create_orders_bulk(user_id, orders, bulk['total'])
+    if not order_ids:
+        query.edit_message_text(
+            text="❌ Не удалось создать заказы: проверьте баланс и число активных заказов и попробуйте позже.")
+        return
+
+    author = f"@{query.from_user.username or query.from_user.full_name}"
+    enqueue_moderation_items([
+        ('order', order_id,
+         f"Новый заказ для проверки:\n\n"
+         f"ID: {order_id}\n"
+         f"От: {author}\n"
+         f"Название: {order['title']}\n"
+         f"Цена: {order['price']} руб.\n"
+         f"Количество: {order['quantity']}\n"
+         f"Срок: {order['deadline']} ч.\n"
+         f"Описание:\n{order['description']}\n\n"
+         f"Подтвердить заказ?",
+         [[("✅ Подтвердить", f"admin_approve_{order_id}"), ("❌ Отклонить", f"admin_reject_{order_id}")]])
+        for order_id, order in zip(order_ids, orders)
+    ])
+    # Одно уведомление вместо сообщения на каждый заказ
+    try:
+        query.bot.send_message(
+            chat_id=ADMIN_ID,
+            text=f"📥 {author} загрузил {len(order_ids)} заказов на {bulk['total']} руб. "
+                 f"Они добавлены в очередь модерации: /queue"
+        )
+    except TelegramError as e:
+        logger.error(f"Ошибка отправки уведомления админу: {e}")
+
+    query.edit_message_text(
+        text=f"✅ Создано заказов: {len(order_ids)}. Они отправлены на модерацию, "
+             f"вы получите уведомление по каждому проверенному заказу.")
+
+
+# ========== АНТИФРОД ==========
+
+# worker_id -> {'events': deque[(время, тип, order_id)], 'counts': {тип: количество}}
+_worker_activity = OrderedDict()
+_worker_activity_lock = threading.Lock()
+
+
+def _score_worker(state, event_time, kind, order_id):
+    """Возвращает причины, по которым исполнитель выглядит подозрительно, после нового события"""
+    counts = state['counts']
+    reasons = []
+
+    if kind == 'accept' and counts.get('accept', 0) > FRAUD_MAX_ACCEPTS:
+        reasons.append(f"принял {counts['accept']} заказов за {FRAUD_WINDOW_SECONDS // 60} мин.")
+
+    if kind == 'cancel' and counts.get('accept', 0) >= FRAUD_MIN_ACCEPTS_FOR_RATIO:
+        ratio = counts.get('cancel', 0) / counts['accept']
+        if ratio >= FRAUD_CANCEL_RATIO:
+            reasons.append(f"отменил {counts.get('cancel', 0)} из {counts['accept']} принятых заказов")
+
+    if kind == 'submit':
+        accepted_at = next((event[0] for event in reversed(state['events'])
+                            if event[1] == 'accept' and event[2] == order_id), None)
+        if accepted_at is not None and event_time - accepted_at < FRAUD_FAST_SUBMIT_SECONDS:
+            counts['fast_submit'] = counts.get('fast_submit', 0) + 1
+            state['events'].append((event_time, 'fast_submit', order_id))
+            if counts['fast_submit'] >= FRAUD_MAX_FAST_SUBMITS:
+                reasons.append(f"{counts['fast_submit']} раз сдал работу быстрее "
+                               f"{FRAUD_FAST_SUBMIT_SECONDS} сек. после принятия")
+
+    return reasons
+
+
+def track_worker_event(bot, worker_id, kind, order_id=None):
+    """Учитывает событие исполнителя ('accept', 'cancel', 'submit') в скользящем окне
+    и при превышении порогов помечает его как подозрительного"""
+    now = time.monotonic()
+
+    with _worker_activity_lock:
+        state = _worker_activity.pop(worker_id, None)
+        if state is None:
+            state = {'events': deque(), 'counts': {}}
+        _worker_activity[worker_id] = state
+        while len(_worker_activity) > FRAUD_MAX_TRACKED_WORKERS:
+            _worker_activity.popitem(last=False)
+
+        # Сдвигаем окно: устаревшие события уменьшают счетчики
+        events, counts = state['events'], state['counts']
+        while events and (now - events[0][0] > FRAUD_WINDOW_SECONDS or len(events) >= FRAUD_MAX_EVENTS_PER_WORKER):
+            counts[events.popleft()[1]] -= 1
+
+        events.append((now, kind, order_id))
+        counts[kind] = counts.get(kind, 0) + 1
+        reasons = _score_worker(state, now, kind, order_id)
+        if reasons:
+            # Начинаем окно заново, чтобы не поднимать тревогу на каждом следующем событии
+            del _worker_activity[worker_id]
+
+    if not reasons or not flag_user_suspicious(worker_id):
+        return
+
+    logger.warning(f"Исполнитель {worker_id} помечен как подозрительный: {'; '.join(reasons)}")
+    try:
+        bot.send_message(
+            chat_id=ADMIN_ID,
+            text=f"🚨 Исполнитель {worker_id} автоматически помечен как подозрительный:\n• " + "\n• ".join(reasons)
+        )
+    except TelegramError as e:
+        logger.error(f"Ошибка отправки уведомления админу: {e}")
+
+
+# ========== ПОДПИСЧИКИ СОБЫТИЙ ==========
+
+@subscribe(OrderCreated)
+def _order_created_caches(event):
+    """Добавляет новый заказ в ленту"""
+    invalidate_feed_cache(order_ids=[event.order_id])
+    note_write(user_id=event.user_id, order_id=event.order_id)
+
+
+@subscribe(OrdersCreated)
+def _orders_created_caches(event):
+    """Перезагружает ленту один раз на весь пакет заказов вместо обновления по каждому заказу"""
+    with _feed_cache_lock:
+        _feed['loaded'] = False
+    if BOT_PROCESSES > 1:
+        bump_cache_version('feed')
+    note_write(user_id=event.user_id)
+    for order_id in event.order_ids:
+        note_write(order_id=order_id)
+
+
+@subscribe(OrderApproved, run_async=True)
+def _notify_order_approved(event):
+    """Уведомляет заказчика о публикации заказа"""
+    order = get_order_details(event.order_id)
+    if order:
+        _event_context['bot'].send_message(
+            chat_id=order['user_id'],
+            text=f"✅ Ваш заказ \"{order['title']}\" подтвержден и опубликован!"
+        )
+
+
+@subscribe(AssignmentAccepted)
+def _assignment_accepted_caches(event):
+    """Обновляет место заказа в ленте и исключения исполнителя"""
+    invalidate_feed_cache(event.worker_id, [event.order_id])
+    note_write(user_id=event.worker_id, order_id=event.order_id)
+
+
+@subscribe(AssignmentAccepted)
+def _track_assignment_accepted(event):
+    """Учитывает принятие заказа в антифроде"""
+    track_worker_event(_event_context['bot'], event.worker_id, 'accept', event.order_id)
+
+
+@subscribe(WorkSubmitted)
+def _work_submitted_caches(event):
+    """Добавляет ссылку в фильтр Блума повторных ссылок"""
+    add_link_to_bloom(event.link_hash)
+    note_write(user_id=event.worker_id, order_id=event.order_id)
+
+
+@subscribe(WorkSubmitted)
+def _track_work_submitted(event):
+    """Учитывает сдачу работы в антифроде"""
+    track_worker_event(_event_context['bot'], event.worker_id, 'submit', event.order_id)
+
+
+@subscribe(WorkSubmitted, run_async=True)
+def _notify_work_submitted(event):
+    """Отправляет работу заказчику на проверку, а о повторной ссылке предупреждает и администратора"""
+    bot = _event_context['bot']
+    submission = get_submission(event.order_id, event.worker_id)
+    if not submission:
+        return
+
+    header = ""
+    if event.previous_uses:
+        header = f"⚠️ Эта ссылка уже сдавалась ранее ({event.previous_uses} раз). Проверьте работу внимательно.\n\n"
+        try:
+            bot.send_message(
+                chat_id=ADMIN_ID,
+                text=f"🔗 Повторная ссылка от исполнителя {event.worker_id} по заказу \"{submission['title']}\":\n"
+                     f"{event.link}\n\nРанее сдана {event.previous_uses} раз, "
+                     f"исполнителей: {event.previous_workers}. Отчет: /duplicates",
+                disable_web_page_preview=True
+            )
+        except TelegramError as e:
+            logger.error(f"Ошибка отправки уведомления админу: {e}")
+
+    try:
+        bot.send_message(
+            chat_id=submission['client_id'],
+            text=format_submission_text(submission, header, "Проверьте выполнение:"),
+            reply_markup=InlineKeyboardMarkup([
+                [
+                    InlineKeyboardButton("✅ Принять",
+                                         callback_data=f"client_approve_{event.order_id}_{event.worker_id}"),
+                    InlineKeyboardButton("❌ Отклонить",
+                                         callback_data=f"client_reject_{event.order_id}_{event.worker_id}")
+                ]
+            ])
+        )
+    except TelegramError as e:
+        # Исполнитель уже получил ответ, поэтому о недоставленной работе узнает администратор
+        logger.error(f"Ошибка отправки работы заказчику: {e}")
+        try:
+            bot.send_message(
+                chat_id=ADMIN_ID,
+                text=f"❌ Не удалось отправить заказчику {submission['client_id']} работу исполнителя "
+                     f"{event.worker_id} по заказу \"{submission['title']}\" (#{event.order_id}):\n{event.link}",
+                disable_web_page_preview=True
+            )
+        except TelegramError as e:
+            logger.error(f"Ошибка отправки уведомления админу: {e}")
 
-        connection.commit()
-        return True
-    except Error as e:
-        logger.error(f"Ошибка подтверждения пополнения: {e}")
-        connection.rollback()
-        return False
-    finally:
-        if connection.is_connected():
-            connection.close()
+
+@subscribe(WorkApproved)
+def _count_work_approved(event):
+    """Учитывает выплату исполнителю в дневной сводке"""
+    record_daily_stats(worker_payouts=event.price)
+
+
+@subscribe(WorkApproved)
+def _finalize_work_approved(event):
+    """Завершает заказ, когда приняты работы всех исполнителей"""
+    finalize_order_if_completed(event.order_id, event.quantity)
+
+
+@subscribe(WorkApproved, run_async=True)
+def _notify_work_approved(event):
+    """Уведомляет исполнителя и заказчика о приемке работы"""
+    if event.decided_by == 'client':
+        worker_text = f"✅ Ваш заказ \"{event.title}\" принят! На ваш баланс зачислено {event.price} руб."
+        client_text = f"Вы приняли заказ \"{event.title}\"."
+    elif event.decided_by == 'admin':
+        worker_text = (f"✅ Администратор принял ваш заказ \"{event.title}\"! "
+                       f"На ваш баланс зачислено {event.price} руб.")
+        client_text = f"Администратор принял работу по вашему заказу \"{event.title}\"."
+    else:
+        worker_text = (f"✅ Заказчик не проверил работу по заказу \"{event.title}\" за {REVIEW_SLA_HOURS} ч., "
+                       f"она принята автоматически. На ваш баланс зачислено {event.price} руб.")
+        client_text = (f"Работа по вашему заказу \"{event.title}\" принята автоматически, "
+                       f"так как не была проверена за {REVIEW_SLA_HOURS} ч.")
+    send_bulk_messages(_event_context['bot'], [(event.worker_id, worker_text), (event.client_id, client_text)])
+
+
+@subscribe(WorkRejected)
+def _work_rejected_caches(event):
+    """Возвращает заказ в ленту"""
+    invalidate_feed_cache(event.worker_id, [event.order_id])
+    invalidate_order_details(event.order_id)
+    note_write(user_id=event.worker_id, order_id=event.order_id)
+
+
+@subscribe(WorkRejected)
+def _escalate_work_rejected(event):
+    """Наказывает исполнителя: первый раз — подозрительный, повторно — бан.
+    Отдельного правила антифрода для отклонений нет: эта эскалация срабатывает раньше любого порога"""
+    escalate_user_status(event.worker_id)
+
+
+@subscribe(WorkRejected, run_async=True)
+def _notify_work_rejected(event):
+    """Уведомляет исполнителя и заказчика об отклонении работы"""
+    status = get_user_status(event.worker_id)
+    status_message = {
+        'banned': "заблокирован",
+        'suspicious': "помечен как подозрительный"
+    }.get(status, "получил отметку о нарушении")
+    send_bulk_messages(_event_context['bot'], [
+        (event.worker_id,
+         f"❌ Администратор отклонил ваш заказ \"{event.title}\". "
+         f"Ваш статус: {status_message}.\n\n"
+         f"Заказ возвращен в биржу."),
+        (event.client_id,
+         f"Администратор отклонил работу по вашему заказу \"{event.title}\".\n"
+         f"Исполнитель {status_message}.\n\n"
+         f"Заказ возвращен в биржу для выполнения другим исполнителем.")
+    ])
+
+
+@subscribe(DepositConfirmed, run_async=True)
+def _notify_deposit_confirmed(event):
+    """Уведомляет заказчика о зачислении пополнения"""
+    send_bulk_messages(_event_context['bot'],
+                       [(event.user_id, f"✅ Ваш баланс заказчика пополнен на {event.amount} руб.!")])
+
+
+@subscribe(WithdrawalRequested)
+def _count_withdrawal_requested(event):
+    """Учитывает запрос на вывод в дневной сводке"""
+    record_daily_stats(withdrawals_requested=event.amount)
+
+
+@subscribe(WithdrawalRequested, run_async=True)
+def _notify_withdrawal_requested(event):
+    """Ставит запрос на вывод в очередь модерации"""
+    notify_moderators(
+        _event_context['bot'], 'withdrawal', event.payment_id,
+        f"📌 Новый запрос на вывод:\n\n"
+        f"👤 Пользователь: @{event.user_name} (ID: {event.user_id})\n"
+        f"💵 Сумма: {event.amount} руб.\n"
+        f"📱 Способ: {event.method}\n"
+        f"🔢 Реквизиты: {event.details}",
+        [[("✅ Уведомить пользователя", f"notify_user_{event.user_id}_{event.payment_id}")]]
+    )
 
 
 # ========== ОСНОВНЫЕ ФУНКЦИИ БОТА ==========
@@ -730,19 +4571,39 @@ def start(update: Update, context: CallbackContext) -> None:
     reply_markup = InlineKeyboardMarkup(keyboard)
     update.message.reply_text('Добро пожаловать в фриланс-бот! Выберите действие:', reply_markup=reply_markup)
 
+    # Переход по ссылке из инлайн-поиска: /start order_<id>
+    if context.args and context.args[0].startswith('order_') and context.args[0][6:].isdigit():
+        order_id = int(context.args[0][6:])
+        update.message.reply_text(
+            "Заказ, по ссылке которого вы перешли:",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📌 Открыть заказ",
+                                                                     callback_data=f"order_{order_id}")]])
+        )
+
 
 def show_order_list(query, page=0, per_page=5, sort_by='newest'):
     """Показывает список заказов с пагинацией и сортировкой"""
     try:
-        orders = get_active_orders(sort_by)
+        current_orders, total, active_count = get_worker_feed(query.from_user.id, sort_by, page, per_page)
+
+        # Лимит активных заказов исчерпан — не показываем заказы, которые все равно нельзя принять
+        if active_count >= MAX_ACTIVE_ASSIGNMENTS:
+            query.edit_message_text(
+                text=f"⚠ У вас уже {active_count} активных заказов. "
+                     f"Завершите текущие заказы, чтобы взять новые.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("📌 Мои заказы", callback_data='my_orders')],
+                    [InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_menu')]
+                ])
+            )
+            return
 
-        if not orders:
+        if not total:
             if query.message.text != "На данный момент нет доступных заказов.":
                 query.edit_message_text(text="На данный момент нет доступных заказов.")
             return
 
-        total_pages = (len(orders) + per_page - 1) // per_page
-        current_orders = orders[page * per_page: (page + 1) * per_page]
+        total_pages = (total + per_page - 1) // per_page
 
         sort_text = {
             'price_high': ' (сначала дорогие)',
@@ -751,7 +4612,7 @@ def show_order_list(query, page=0, per_page=5, sort_by='newest'):
             'oldest': ' (сначала старые)'
         }.get(sort_by, '')
 
-        text = f"Доступные заказы{sort_text} (страница {page + 1} из {total_pages}):"
+        text = read_only_banner() + f"Доступные заказы{sort_text} (страница {page + 1} из {total_pages}):"
 
         keyboard = []
         for order in current_orders:
@@ -772,8 +4633,9 @@ def show_order_list(query, page=0, per_page=5, sort_by='newest'):
         if pagination:
             keyboard.append(pagination)
 
-        # Кнопка сортировки
-        keyboard.append([InlineKeyboardButton("🔀 Сортировать", callback_data='sort_orders')])
+        # Кнопки сортировки и поиска
+        keyboard.append([InlineKeyboardButton("🔀 Сортировать", callback_data='sort_orders'),
+                         InlineKeyboardButton("🔍 Поиск", callback_data='search')])
         keyboard.append([InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_menu')])
 
         query.edit_message_text(
@@ -799,6 +4661,148 @@ def show_sort_options(query):
     )
 
 
+SEARCH_FILTER_PROMPTS = {
+    'keywords': "Введите ключевые слова для поиска по названию и описанию:",
+    'price_min': "Введите минимальную цену (в рублях):",
+    'price_max': "Введите максимальную цену (в рублях):",
+    'max_deadline': "Введите максимальный срок выполнения (в часах):",
+    'min_slots': "Введите минимальное количество свободных мест:"
+}
+
+
+def build_search_filters_screen(filters):
+    """Формирует экран фильтров поиска"""
+    def value(key, suffix=''):
+        return f"{filters[key]}{suffix}" if filters.get(key) is not None else 'не задано'
+
+    text = (
+        f"🔍 Поиск заказов\n\n"
+        f"🔤 Ключевые слова: {filters.get('keywords') or 'не заданы'}\n"
+        f"💵 Цена: от {value('price_min', ' руб.')} до {value('price_max', ' руб.')}\n"
+        f"⏱ Срок не более: {value('max_deadline', ' ч.')}\n"
+        f"👥 Свободных мест не менее: {value('min_slots')}"
+    )
+
+    keyboard = [
+        [InlineKeyboardButton("🔤 Ключевые слова", callback_data='search_set_keywords')],
+        [InlineKeyboardButton("💵 Цена от", callback_data='search_set_price_min'),
+         InlineKeyboardButton("💵 Цена до", callback_data='search_set_price_max')],
+        [InlineKeyboardButton("⏱ Срок до", callback_data='search_set_max_deadline'),
+         InlineKeyboardButton("👥 Мест от", callback_data='search_set_min_slots')],
+        [InlineKeyboardButton("🔍 Показать заказы", callback_data='search_page_0')],
+        [InlineKeyboardButton("♻️ Сбросить фильтры", callback_data='search_reset')],
+        [InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_menu')]
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def build_search_results(filters, page=0):
+    """Формирует страницу результатов поиска"""
+    orders, has_next = search_orders(filters, page=page, per_page=SEARCH_PER_PAGE)
+
+    keyboard = []
+    if not orders:
+        text = "По вашему запросу заказов не найдено." if page == 0 else "Больше заказов не найдено."
+    else:
+        text = f"🔍 Результаты поиска (страница {page + 1}):"
+        for order in orders:
+            available = order['quantity'] - order['accepted_count']
+            keyboard.append([InlineKeyboardButton(
+                f"{order['title']} - {order['price']} руб. (осталось: {available})",
+                callback_data=f"order_{order['order_id']}"
+            )])
+
+    pagination = []
+    if page > 0:
+        pagination.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page_{page - 1}"))
+    if has_next:
+        pagination.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"search_page_{page + 1}"))
+    if pagination:
+        keyboard.append(pagination)
+
+    keyboard.append([InlineKeyboardButton("⚙️ Изменить фильтры", callback_data='search')])
+    keyboard.append([InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_menu')])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def search_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /search"""
+    add_user(update.effective_user.id)
+    filters = context.user_data.setdefault('search_filters', {})
+    context.user_data.pop('awaiting_search_filter', None)
+
+    if context.args:
+        keywords = ' '.join(context.args)
+        if not _build_fulltext_query(keywords):
+            update.message.reply_text(
+                f"❌ Укажите хотя бы одно слово длиной от {SEARCH_MIN_WORD_LENGTH} символов.")
+            return
+        filters['keywords'] = keywords
+        text, reply_markup = build_search_results(filters)
+    else:
+        text, reply_markup = build_search_filters_screen(filters)
+
+    update.message.reply_text(text, reply_markup=reply_markup)
+
+
+def show_search_filters(query, context: CallbackContext):
+    """Показывает экран фильтров поиска"""
+    filters = context.user_data.setdefault('search_filters', {})
+    context.user_data.pop('awaiting_search_filter', None)
+    text, reply_markup = build_search_filters_screen(filters)
+    query.edit_message_text(text=text, reply_markup=reply_markup)
+
+
+def request_search_filter(query, context: CallbackContext):
+    """Запрашивает у пользователя значение фильтра поиска"""
+    field = query.data[len('search_set_'):]
+    if field not in SEARCH_FILTER_PROMPTS:
+        return
+
+    context.user_data['awaiting_search_filter'] = field
+    query.edit_message_text(
+        text=SEARCH_FILTER_PROMPTS[field],
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Назад", callback_data='search')]
+        ])
+    )
+
+
+def handle_search_filter_input(update: Update, context: CallbackContext):
+    """Обрабатывает ввод значения фильтра поиска"""
+    field = context.user_data['awaiting_search_filter']
+    filters = context.user_data.setdefault('search_filters', {})
+    value = update.message.text.strip()
+
+    try:
+        if field == 'keywords':
+            if not _build_fulltext_query(value):
+                raise ValueError
+            filters['keywords'] = value
+        elif field in ('price_min', 'price_max'):
+            # float() пропускает nan и inf, а они ломают сравнение цен в запросе
+            price = Decimal(value)
+            if not price.is_finite() or price < 0:
+                raise ValueError
+            filters[field] = price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        else:
+            number = int(value)
+            if number <= 0:
+                raise ValueError
+            filters[field] = number
+    except (ValueError, InvalidOperation):
+        if field == 'keywords':
+            update.message.reply_text(
+                f"❌ Укажите хотя бы одно слово длиной от {SEARCH_MIN_WORD_LENGTH} символов. Попробуйте еще раз:")
+        else:
+            update.message.reply_text("❌ Введите корректное положительное число. Попробуйте еще раз:")
+        return
+
+    del context.user_data['awaiting_search_filter']
+    text, reply_markup = build_search_filters_screen(filters)
+    update.message.reply_text(text, reply_markup=reply_markup)
+
+
 def show_order_details(query):
     """Показывает детали заказа"""
     order_id = int(query.data.split('_')[1])
@@ -822,7 +4826,11 @@ def accept_order_handler(query):
     user_id = query.from_user.id
     order_id = int(query.data.split('_')[1])
 
-    if get_user_status(user_id) == 'banned':
+    status = get_user_status(user_id)
+    if status is None:
+        query.edit_message_text(text="⚠ Не удалось проверить ваш статус. Попробуйте принять заказ чуть позже.")
+        return
+    if status == 'banned':
         query.edit_message_text(
             text="⛔ Вы забанены и не можете принимать заказы. Если вас забанили по ошибке, пожалуйста напишите в поддержку: @kirillrakitin")
         return
@@ -857,8 +4865,9 @@ def accept_order_handler(query):
                     "SELECT COUNT(*) FROM accepted_orders WHERE worker_id = %s AND status IN ('in_progress', 'waiting_review', 'under_review')",
                     (user_id,))
                 active_orders_count = cursor.fetchone()[0]
-                if active_orders_count >= 5:
-                    query.edit_message_text(text="⚠ Вы не можете принять более 5 заказов одновременно.")
+                if active_orders_count >= MAX_ACTIVE_ASSIGNMENTS:
+                    query.edit_message_text(
+                        text=f"⚠ Вы не можете принять более {MAX_ACTIVE_ASSIGNMENTS} заказов одновременно.")
                     return
             except Error as e:
                 logger.error(f"Ошибка проверки лимита заказов: {e}")
@@ -881,21 +4890,73 @@ def show_profile(query):
         'banned': '⛔ Заблокирован'
     }.get(status, '❓ Неизвестно')
 
-    text = f"👤 Ваш профиль\n\n💰 Баланс: {balance} руб.\n🔒 Статус: {status_text}"
+    text = read_only_banner() + f"👤 Ваш профиль\n\n💰 Баланс: {balance} руб.\n🔒 Статус: {status_text}"
 
     keyboard = [
         [InlineKeyboardButton("📌 Мои заказы", callback_data='my_orders')],
+        [InlineKeyboardButton("📜 История и заработок", callback_data='history')],
         [InlineKeyboardButton("💸 Вывести", callback_data='withdraw')],
         [InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_menu')]
     ]
     query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
+def show_worker_history(query, before_id=None):
+    """Показывает счетчики репутации и историю заказов исполнителя"""
+    user_id = query.from_user.id
+    stats = get_worker_stats(user_id)
+    orders, has_next = get_worker_history(user_id, before_id)
+
+    status_map = {
+        'in_progress': '🟡 В выполнении',
+        'waiting_review': '🟠 Ожидает проверки',
+        'under_review': '🟣 На проверке',
+        'completed': '✅ Выполнен',
+        'rejected': '❌ Отклонен',
+        'canceled': '⛔ Отменен'
+    }
+
+    text = (
+        f"📜 История и заработок\n\n"
+        f"📥 Принято заказов: {stats['accepted_count']}\n"
+        f"✅ Выполнено: {stats['completed_count']}\n"
+        f"❌ Отменено: {stats['cancelled_count']}\n"
+        f"🕛 Просрочено: {stats['expired_count']}\n"
+        f"⚠️ Споров: {stats['disputed_count']}\n"
+        f"⛔ Отклонено администратором: {stats['rejected_count']}\n"
+        f"💰 Заработано всего: {stats['earned']} руб."
+    )
+
+    if orders:
+        text += "\n\n🗂 Заказы:\n" + '\n'.join(
+            f"{order['started_at']:%d.%m.%Y} {order['title']} - {order['price']} руб. "
+            f"({status_map.get(order['status'], '❓ Неизвестно')})"
+            for order in orders
+        )
+    elif before_id is None:
+        text += "\n\nВы еще не брали заказы."
+
+    keyboard = []
+    pagination = []
+    if before_id is not None:
+        pagination.append(InlineKeyboardButton("⏮ К последним", callback_data='history'))
+    if has_next:
+        pagination.append(InlineKeyboardButton("Ранее ➡️", callback_data=f"history_{orders[-1]['id']}"))
+    if pagination:
+        keyboard.append(pagination)
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='profile')])
+
+    query.edit_message_text(text=read_only_banner() + text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
 def start_withdrawal(update: Update, context: CallbackContext):
     """Начинает процесс вывода средств"""
     query = update.callback_query
     query.answer()
 
+    if reject_if_read_only(query.message.reply_text):
+        return ConversationHandler.END
+
     user_id = query.from_user.id
     balance = get_user_balance(user_id)
 
@@ -985,27 +5046,17 @@ def complete_withdrawal(update: Update, context: CallbackContext):
         update.message.reply_text("Теперь введите реквизиты для перевода (номер карты/телефона):")
         return ENTER_DETAILS
 
+    if reject_if_read_only(update.message.reply_text):
+        return ConversationHandler.END
+
     # Записываем платеж в БД
-    if create_payment(user_id, withdrawal['amount'], withdrawal['method'], details):
+    payment_id = create_payment(user_id, withdrawal['amount'], withdrawal['method'], details)
+    if payment_id:
         # Списываем средства с баланса
         update_user_balance(user_id, -withdrawal['amount'])
-
-        # Отправляем уведомление админу
-        try:
-            context.bot.send_message(
-                chat_id=ADMIN_ID,
-                text=f"📌 Новый запрос на вывод:\n\n"
-                     f"👤 Пользователь: @{update.message.from_user.username or update.message.from_user.full_name} (ID: {user_id})\n"
-                     f"💵 Сумма: {withdrawal['amount']} руб.\n"
-                     f"📱 Способ: {withdrawal['method']}\n"
-                     f"🔢 Реквизиты: {details}",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Уведомить пользователя",
-                                          callback_data=f"notify_user_{user_id}")]
-                ])
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления админу: {e}")
+        publish(WithdrawalRequested(payment_id, user_id,
+                                    update.message.from_user.username or update.message.from_user.full_name,
+                                    withdrawal['amount'], withdrawal['method'], details))
 
         update.message.reply_text("✅ Запрос на вывод отправлен! Средства будут переведены в течение 24 часов.")
     else:
@@ -1045,6 +5096,7 @@ def process_order_cancellation(query):
     user_id = query.from_user.id
 
     if cancel_order(order_id, user_id):
+        track_worker_event(query.bot, user_id, 'cancel', order_id)
         query.edit_message_text(text="✅ Заказ успешно отменен.")
     else:
         query.edit_message_text(text="❌ Произошла ошибка при отмене заказа.")
@@ -1055,10 +5107,11 @@ def show_client_menu(query):
     user_id = query.from_user.id
     client_balance = get_client_balance(user_id)
 
-    text = f"👔 Меню заказчика\n\n💰 Баланс заказчика: {client_balance} руб."
+    text = read_only_banner() + f"👔 Меню заказчика\n\n💰 Баланс заказчика: {client_balance} руб."
 
     keyboard = [
         [InlineKeyboardButton("➕ Создать заказ", callback_data='create_order')],
+        [InlineKeyboardButton("📥 Загрузить заказы из CSV", callback_data='bulk_orders')],
         [InlineKeyboardButton("📋 Мои заказы", callback_data='client_orders')],
         [InlineKeyboardButton("💳 Пополнить баланс", callback_data='deposit')],
         [InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_menu')]
@@ -1092,7 +5145,7 @@ def show_client_orders(query):
 
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='client_menu')])
 
-    query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
+    query.edit_message_text(text=read_only_banner() + text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 def show_client_order_details(query):
@@ -1144,13 +5197,12 @@ def show_user_orders(query):
 
             # Рассчитываем оставшееся время только для заказов в работе
             if order['status'] == 'in_progress':
-                deadline_time = order['started_at'] + timedelta(hours=order['deadline'])
-                time_left = deadline_time - datetime.now()
+                time_left = order['due_at'] - datetime.now()
 
                 if time_left.total_seconds() <= 0:
                     time_text = "🕛 Просрочен"
                     # Автоматически отменяем просроченный заказ
-                    cancel_order(order['order_id'], user_id)
+                    cancel_order(order['order_id'], user_id, expired=True)
                 else:
                     hours = int(time_left.total_seconds() // 3600)
                     minutes = int((time_left.total_seconds() % 3600) // 60)
@@ -1166,7 +5218,7 @@ def show_user_orders(query):
 
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='profile')])
 
-    query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
+    query.edit_message_text(text=read_only_banner() + text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 def show_user_order_details(update: Update, order_id, worker_id):
@@ -1184,7 +5236,7 @@ def show_user_order_details(update: Update, order_id, worker_id):
     try:
         cursor = connection.cursor(dictionary=True)
         cursor.execute("""
-        SELECT status, started_at 
+        SELECT status, due_at 
         FROM accepted_orders 
         WHERE order_id = %s AND worker_id = %s
         """, (order_id, worker_id))
@@ -1208,13 +5260,12 @@ def show_user_order_details(update: Update, order_id, worker_id):
 
     # Рассчитываем оставшееся время только для заказов в работе
     if accepted_order['status'] == 'in_progress':
-        deadline_time = accepted_order['started_at'] + timedelta(hours=order['deadline'])
-        time_left = deadline_time - datetime.now()
+        time_left = accepted_order['due_at'] - datetime.now()
 
         if time_left.total_seconds() <= 0:
             status_text = "🕛 Просрочен"
             # Автоматически отменяем просроченный заказ
-            cancel_order(order_id, worker_id)
+            cancel_order(order_id, worker_id, expired=True)
         else:
             hours = int(time_left.total_seconds() // 3600)
             minutes = int((time_left.total_seconds() % 3600) // 60)
@@ -1264,11 +5315,27 @@ def handle_order_cancellation(update: Update, context: CallbackContext):
     user_id = query.from_user.id
 
     if cancel_order(order_id, user_id):
+        track_worker_event(query.bot, user_id, 'cancel', order_id)
         query.edit_message_text(text="Заказ успешно отменен и возвращен в биржу.")
     else:
         query.edit_message_text(text="Произошла ошибка при отмене заказа.")
 
 
+def format_submission_text(submission, header, footer):
+    """Формирует текст экрана проверки или спора по сданной работе"""
+    text = (
+        f"{header}"
+        f"📌 Заказ: {submission['title']}\n"
+        f"💵 Цена: {submission['price']} руб.\n\n"
+        f"📝 Описание заказа:\n{submission['description']}\n\n"
+    )
+    if submission.get('link'):
+        text += f"🔗 Ссылка на выполненную работу:\n{submission['link']}\n\n"
+    if submission.get('reason'):
+        text += f"🔹 Причина отклонения:\n{submission['reason']}\n\n"
+    return text + footer
+
+
 def handle_materials(update: Update, context: CallbackContext):
     """Обрабатывает полученные материалы с проверкой на повторную отправку"""
     if 'awaiting_materials' not in context.user_data or not update.message.text:
@@ -1305,35 +5372,29 @@ def handle_materials(update: Update, context: CallbackContext):
                 if connection.is_connected():
                     connection.close()
 
-        if submit_order_for_review(order_id, user_id):
-            # Отправляем ссылку заказчику
-            text = (
-                f"📌 Заказ: {order['title']}\n"
-                f"💵 Цена: {order['price']} руб.\n\n"
-                f"📝 Описание заказа:\n{order['description']}\n\n"
-                f"🔗 Ссылка на выполненную работу:\n{link}\n\n"
-                f"Проверьте выполнение:"
-            )
-
-            try:
-                context.bot.send_message(
-                    chat_id=order['user_id'],
-                    text=text,
-                    reply_markup=InlineKeyboardMarkup([
-                        [
-                            InlineKeyboardButton("✅ Принять", callback_data=f"client_approve_{order_id}_{user_id}"),
-                            InlineKeyboardButton("❌ Отклонить", callback_data=f"client_reject_{order_id}_{user_id}")
-                        ]
-                    ])
-                )
-                update.message.reply_text("✅ Ссылка отправлена заказчику.")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке ссылки: {e}")
-                update.message.reply_text("Ошибка при отправке материалов. Попробуйте позже.")
+        # Ссылку заказчику и предупреждение о повторной ссылке отправляют подписчики WorkSubmitted в фоне,
+        # а если заказчику отправить не удалось — сообщают администратору
+        if submit_order_for_review(order_id, user_id, link):
+            update.message.reply_text("✅ Материалы приняты и переданы заказчику на проверку.")
         else:
             update.message.reply_text("❌ Не удалось отправить материалы. Возможно, вы уже отправили их ранее.")
 
 
+def approve_work(order_id, worker_id, work, decided_by, from_status=None):
+    """Принимает сданную работу: завершает задание, начисляет оплату исполнителю и публикует WorkApproved.
+
+    work — строка с price, client_id, title и quantity заказа. Возвращает None, если задание уже не ждет
+    решения (или не в статусе from_status), False — если не удалось начислить оплату, иначе True.
+    """
+    if not update_accepted_order_status(order_id, worker_id, 'completed', from_status):
+        return None
+    if not update_user_balance(worker_id, work['price']):
+        return False
+    publish(WorkApproved(order_id, worker_id, work['client_id'], work['title'],
+                         work['price'], work['quantity'], decided_by))
+    return True
+
+
 def handle_client_decision(update: Update, context: CallbackContext):
     """Обрабатывает решение заказчика"""
     query = update.callback_query
@@ -1342,74 +5403,30 @@ def handle_client_decision(update: Update, context: CallbackContext):
     order_id = int(data[2])
     worker_id = int(data[3])
 
-    # Получаем информацию о заказе
-    order = get_order_details(order_id)
-    if not order:
+    # Задание, заказ и сданная работа одним запросом
+    submission = get_submission(order_id, worker_id)
+    if not submission:
         query.message.reply_text("Ошибка: заказ не найден.")
         return
 
-
-
-
+    # Работу могли уже принять по таймауту или передать администратору — тогда решение заказчика не применяется
     if action == 'approve':
-        if update_accepted_order_status(order_id, worker_id, 'completed'):
-            if update_user_balance(worker_id, order['price']):
-                context.bot.send_message(
-                    chat_id=worker_id,
-                    text=f"✅ Ваш заказ \"{order['title']}\" принят! На ваш баланс зачислено {order['price']} руб."
-                )
-                context.bot.send_message(
-                    chat_id=order['user_id'],
-                    text=f"Вы приняли заказ \"{order['title']}\"."
-                )
-
-                # Проверяем, все ли заказы выполнены
-                connection = create_connection()
-                if connection:
-                    try:
-                        cursor = connection.cursor()
-                        cursor.execute("""
-                        SELECT COUNT(*) as completed_count 
-                        FROM accepted_orders 
-                        WHERE order_id = %s AND status = 'completed'
-                        """, (order_id,))
-                        completed_count = cursor.fetchone()[0]
-
-                        if completed_count >= order['quantity']:
-                            update_order_status(order_id, 'completed')
-                            # Удаляем полностью выполненный заказ
-                            delete_completed_order(order_id)
-                    except Error as e:
-                        logger.error(f"Ошибка проверки завершения заказа: {e}")
-                    finally:
-                        if connection.is_connected():
-                            connection.close()
+        if approve_work(order_id, worker_id, submission, 'client', from_status='waiting_review') is None:
+            query.message.reply_text("ℹ️ Решение по этой работе уже принято.")
     elif action == 'reject':
-        if update_accepted_order_status(order_id, worker_id, 'under_review'):
-            # Просто пересылаем сообщение админу без указания причины
-            text = (
-                f"⚠️ Конфликт по заказу:\n\n"
-                f"📌 Заказ: {order['title']}\n"
-                f"💵 Цена: {order['price']} руб.\n"
-                f"📝 Описание заказа:\n{order['description']}\n\n"
-                f"Примите решение:"
-            )
+        if not update_accepted_order_status(order_id, worker_id, 'under_review', from_status='waiting_review'):
+            query.message.reply_text("ℹ️ Решение по этой работе уже принято.")
+        else:
+            # Пересылаем админу сданную работу без указания причины
+            text = format_submission_text(submission, "⚠️ Конфликт по заказу:\n\n", "Примите решение:")
 
-            context.bot.send_message(
-                chat_id=ADMIN_ID,
-                text=text,
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("✅ Принять работу",
-                                             callback_data=f"admin_final_approve_{order_id}_{worker_id}"),
-                        InlineKeyboardButton("❌ Отклонить работу",
-                                             callback_data=f"admin_final_reject_{order_id}_{worker_id}")
-                    ]
-                ])
-            )
+            notify_moderators(context.bot, 'dispute', f"{order_id}_{worker_id}", text, [[
+                ("✅ Принять работу", f"admin_final_approve_{order_id}_{worker_id}"),
+                ("❌ Отклонить работу", f"admin_final_reject_{order_id}_{worker_id}")
+            ]])
 
             context.bot.send_message(
-                chat_id=order['user_id'],
+                chat_id=submission['client_id'],
                 text="Работа отклонена и отправлена администратору на проверку."
             )
 
@@ -1424,31 +5441,19 @@ def handle_rejection_reason(update: Update, context: CallbackContext):
     worker_id = context.user_data['awaiting_rejection_reason']['worker_id']
     client_id = context.user_data['awaiting_rejection_reason']['client_id']
 
-    order = get_order_details(order_id)
-    if not order:
+    set_submission_reason(order_id, worker_id, reason)
+    submission = get_submission(order_id, worker_id)
+    if not submission:
         update.message.reply_text("Ошибка: заказ не найден.")
         return
 
     # Отправляем сообщение администратору
-    text = (
-        f"⚠️ Конфликт по заказу:\n\n"
-        f"📌 Заказ: {order['title']}\n"
-        f"💵 Цена: {order['price']} руб.\n"
-        f"📝 Описание заказа:\n{order['description']}\n\n"
-        f"🔹 Причина отклонения:\n{reason}\n\n"
-        f"Примите решение:"
-    )
+    text = format_submission_text(dict(submission, reason=reason), "⚠️ Конфликт по заказу:\n\n", "Примите решение:")
 
-    context.bot.send_message(
-        chat_id=ADMIN_ID,
-        text=text,
-        reply_markup=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("✅ Принять работу", callback_data=f"admin_final_approve_{order_id}_{worker_id}"),
-                InlineKeyboardButton("❌ Отклонить работу", callback_data=f"admin_final_reject_{order_id}_{worker_id}")
-            ]
-        ])
-    )
+    notify_moderators(context.bot, 'dispute', f"{order_id}_{worker_id}", text, [[
+        ("✅ Принять работу", f"admin_final_approve_{order_id}_{worker_id}"),
+        ("❌ Отклонить работу", f"admin_final_reject_{order_id}_{worker_id}")
+    ]])
 
     update.message.reply_text("Работа отклонена. Материалы отправлены администратору на проверку.")
     del context.user_data['awaiting_rejection_reason']
@@ -1463,8 +5468,11 @@ def handle_admin_final_decision(update: Update, context: CallbackContext):
     order_id = int(data[3])
     worker_id = int(data[4])
 
-    order = get_order_details(order_id)
-    if not order:
+    if not claim_for_action(query, 'dispute', f"{order_id}_{worker_id}"):
+        return
+
+    submission = get_submission(order_id, worker_id)
+    if not submission:
         try:
             query.edit_message_text(text="Заказ не найден.")
         except Exception as e:
@@ -1482,45 +5490,19 @@ def handle_admin_final_decision(update: Update, context: CallbackContext):
         logger.error(f"Ошибка при удалении сообщения: {e}")
 
     if action == 'approve':
-        if update_accepted_order_status(order_id, worker_id, 'completed'):
-            if update_user_balance(worker_id, order['price']):
-                # Уведомление исполнителю
-                context.bot.send_message(
-                    chat_id=worker_id,
-                    text=f"✅ Администратор принял ваш заказ \"{order['title']}\"! "
-                         f"На ваш баланс зачислено {order['price']} руб."
-                )
-                # Уведомление заказчику
-                context.bot.send_message(
-                    chat_id=order['user_id'],
-                    text=f"Администратор принял работу по вашему заказу \"{order['title']}\"."
-                )
-
-                # Проверка завершения всех заданий по заказу
-                connection = create_connection()
-                if connection:
-                    try:
-                        cursor = connection.cursor()
-                        cursor.execute("""
-                        SELECT COUNT(*) as completed_count 
-                        FROM accepted_orders 
-                        WHERE order_id = %s AND status = 'completed'
-                        """, (order_id,))
-                        completed_count = cursor.fetchone()[0]
-
-                        if completed_count >= order['quantity']:
-                            update_order_status(order_id, 'completed')
-                            delete_completed_order(order_id)
-                    except Error as e:
-                        logger.error(f"Ошибка проверки завершения заказа: {e}")
-                    finally:
-                        if connection.is_connected():
-                            connection.close()
-            else:
-                context.bot.send_message(
-                    chat_id=ADMIN_ID,
-                    text="Ошибка при начислении средств исполнителю."
-                )
+        approved = approve_work(order_id, worker_id, submission, 'admin', from_status='under_review')
+        # Спор закрываем и тогда, когда решение уже принято, иначе он вернется в очередь после аренды
+        resolve_moderation_item('dispute', f"{order_id}_{worker_id}")
+        if approved is None:
+            context.bot.send_message(
+                chat_id=query.message.chat_id,
+                text="ℹ️ Решение по этой работе уже принято."
+            )
+        elif approved is False:
+            context.bot.send_message(
+                chat_id=ADMIN_ID,
+                text="Ошибка при начислении средств исполнителю."
+            )
 
     elif action == 'reject':
         connection = create_connection()
@@ -1534,11 +5516,23 @@ def handle_admin_final_decision(update: Update, context: CallbackContext):
         try:
             cursor = connection.cursor()
 
-            # 1. Полностью удаляем запись о принятом заказе
+            # 1. Фиксируем решение по сданной работе и отклоняем задание: запись остается в истории исполнителя,
+            # а место в заказе освобождается. Решение по спору могли уже принять — тогда ничего не меняем
+            _record_submission_decision(cursor, order_id, worker_id, 'rejected')
             cursor.execute("""
-            DELETE FROM accepted_orders 
-            WHERE order_id = %s AND worker_id = %s
+            UPDATE accepted_orders 
+            SET status = 'rejected'
+            WHERE order_id = %s AND worker_id = %s AND status = 'under_review'
             """, (order_id, worker_id))
+            if cursor.rowcount == 0:
+                connection.rollback()
+                resolve_moderation_item('dispute', f"{order_id}_{worker_id}")
+                context.bot.send_message(
+                    chat_id=query.message.chat_id,
+                    text="ℹ️ Решение по этой работе уже принято."
+                )
+                return
+            _increment_counters(cursor, 'worker_stats', 'worker_id', worker_id, {'rejected_count': 1})
 
             # 2. Возвращаем заказ в биржу (активный статус)
             cursor.execute("""
@@ -1548,29 +5542,10 @@ def handle_admin_final_decision(update: Update, context: CallbackContext):
             """, (order_id,))
 
             connection.commit()
+            resolve_moderation_item('dispute', f"{order_id}_{worker_id}")
 
-            # 3. Наказываем исполнителя
-            current_status = get_user_status(worker_id)
-            new_status = 'banned' if current_status == 'suspicious' else 'suspicious'
-            update_user_status(worker_id, new_status)
-
-            status_message = "заблокирован" if new_status == 'banned' else "помечен как подозрительный"
-
-            # 4. Отправляем уведомления
-            # Исполнителю
-            context.bot.send_message(
-                chat_id=worker_id,
-                text=f"❌ Администратор отклонил ваш заказ \"{order['title']}\". "
-                     f"Ваш статус: {status_message}.\n\n"
-                     f"Заказ возвращен в биржу."
-            )
-            # Заказчику
-            context.bot.send_message(
-                chat_id=order['user_id'],
-                text=f"Администратор отклонил работу по вашему заказу \"{order['title']}\".\n"
-                     f"Исполнитель {status_message}.\n\n"
-                     f"Заказ возвращен в биржу для выполнения другим исполнителем."
-            )
+            # 3. Наказание исполнителя и уведомления — подписчики WorkRejected
+            publish(WorkRejected(order_id, worker_id, submission['client_id'], submission['title']))
 
         except Error as e:
             logger.error(f"Ошибка при отклонении заказа: {e}")
@@ -1635,6 +5610,8 @@ def confirm_order_creation(update: Update, context: CallbackContext):
     if order_id:
         # Списываем средства с баланса заказчика
         update_client_balance(user_id, -total)
+        record_daily_stats(orders_created=1, gmv=total,
+                           commission=total - order_data['price'] * order_data['quantity'])
 
         admin_text = (
             f"Новый заказ для проверки:\n\n"
@@ -1648,18 +5625,10 @@ def confirm_order_creation(update: Update, context: CallbackContext):
             f"Подтвердить заказ?"
         )
 
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Подтвердить", callback_data=f"admin_approve_{order_id}"),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{order_id}")
-            ]
-        ]
-
-        context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=admin_text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        notify_moderators(context.bot, 'order', order_id, admin_text, [[
+            ("✅ Подтвердить", f"admin_approve_{order_id}"),
+            ("❌ Отклонить", f"admin_reject_{order_id}")
+        ]])
 
         query.edit_message_text(
             text="Ваш заказ отправлен на модерацию. Вы получите уведомление, когда он будет проверен.")
@@ -1671,8 +5640,9 @@ def confirm_order_creation(update: Update, context: CallbackContext):
                 cursor = connection.cursor()
                 cursor.execute("SELECT COUNT(*) FROM orders WHERE user_id = %s AND status = 'active'", (user_id,))
                 active_orders_count = cursor.fetchone()[0]
-                if active_orders_count >= 10:
-                    query.edit_message_text(text="⚠ Вы не можете иметь более 10 активных заказов одновременно.")
+                if active_orders_count >= MAX_ACTIVE_ORDERS:
+                    query.edit_message_text(
+                        text=f"⚠ Вы не можете иметь более {MAX_ACTIVE_ORDERS} активных заказов одновременно.")
                     return
             except Error as e:
                 logger.error(f"Ошибка проверки лимита заказов: {e}")
@@ -1701,17 +5671,13 @@ def handle_admin_action(update: Update, context: CallbackContext):
     action = data[1]
     order_id = int(data[2])
 
+    if not claim_for_action(query, 'order', order_id):
+        return
+
     if action == 'approve':
         if update_order_status(order_id, 'active'):
-            # Получаем информацию о заказе
-            order = get_order_details(order_id)
-            if order:
-                # Уведомляем создателя заказа
-                context.bot.send_message(
-                    chat_id=order['user_id'],
-                    text=f"✅ Ваш заказ \"{order['title']}\" подтвержден и опубликован!"
-                )
-
+            resolve_moderation_item('order', order_id)
+            publish(OrderApproved(order_id))
             query.edit_message_text(text=f"Заказ #{order_id} успешно подтвержден и опубликован.")
         else:
             query.edit_message_text(text=f"Ошибка при подтверждении заказа #{order_id}")
@@ -1743,12 +5709,14 @@ def handle_admin_rejection_reason(update: Update, context: CallbackContext):
         # Возвращаем средства заказчику
         total = order['price'] * order['quantity'] * 1.5
         update_client_balance(order['user_id'], total)
+        record_daily_stats(refunds=total)
 
         # Уведомляем создателя заказа
         context.bot.send_message(
             chat_id=order['user_id'],
             text=f"❌ Ваш заказ \"{order['title']}\" был отклонен администратором.\n\nПричина: {reason}\n\nСредства возвращены на баланс."
         )
+        resolve_moderation_item('order', order_id)
 
     update.message.reply_text(f"Заказ #{order_id} отклонен. Средства возвращены заказчику.")
     del context.user_data['awaiting_admin_rejection_reason']
@@ -1759,6 +5727,9 @@ def start_deposit(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
 
+    if reject_if_read_only(query.message.reply_text):
+        return ConversationHandler.END
+
     query.edit_message_text(text="Введите сумму пополнения (минимум 100 руб):")
     return DEPOSIT_AMOUNT
 
@@ -1802,16 +5773,9 @@ def process_deposit_fio(update: Update, context: CallbackContext):
         f"После получения платежа нажмите кнопку ниже:"
     )
 
-    try:
-        context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=admin_text,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Подтвердить пополнение", callback_data=f"confirm_deposit_{deposit_id}")]
-            ])
-        )
-    except Exception as e:
-        logger.error(f"Ошибка отправки уведомления админу: {e}")
+    notify_moderators(context.bot, 'deposit', deposit_id, admin_text, [
+        [("✅ Подтвердить пополнение", f"confirm_deposit_{deposit_id}")]
+    ])
 
     update.message.reply_text(instructions)
     return ConversationHandler.END
@@ -1866,28 +5830,12 @@ def confirm_deposit(update: Update, context: CallbackContext):
 
     deposit_id = int(query.data.split('_')[2])
 
+    if not claim_for_action(query, 'deposit', deposit_id):
+        return
+
     if complete_deposit(deposit_id):
-        # Получаем информацию о пополнении
-        connection = create_connection()
-        if connection:
-            try:
-                cursor = connection.cursor(dictionary=True)
-                cursor.execute("SELECT user_id, amount FROM deposits WHERE deposit_id = %s", (deposit_id,))
-                deposit = cursor.fetchone()
-
-                if deposit:
-                    # Уведомляем пользователя
-                    context.bot.send_message(
-                        chat_id=deposit['user_id'],
-                        text=f"✅ Ваш баланс заказчика пополнен на {deposit['amount']} руб.!"
-                    )
-
-                    query.edit_message_text(text=query.message.text + "\n\n✅ Пополнение подтверждено")
-            except Error as e:
-                logger.error(f"Ошибка подтверждения пополнения: {e}")
-            finally:
-                if connection.is_connected():
-                    connection.close()
+        resolve_moderation_item('deposit', deposit_id)
+        query.edit_message_text(text=query.message.text + "\n\n✅ Пополнение подтверждено")
     else:
         query.edit_message_text(text="Ошибка при подтверждении пополнения.")
 
@@ -1970,6 +5918,12 @@ def button(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     query.answer()
 
+    if query.data.startswith(MONEY_CALLBACKS) and reject_if_read_only(query.message.reply_text):
+        return
+    if query.data.startswith(STATUS_CHECKED_CALLBACKS) and reject_if_read_only(query.message.reply_text,
+                                                                               READ_ONLY_WRITE_TEXT):
+        return
+
     if query.data == 'order_list':
         show_order_list(query, sort_by='newest')  # Всегда по умолчанию новые
     elif query.data.startswith('order_page_'):
@@ -1996,21 +5950,44 @@ def button(update: Update, context: CallbackContext) -> None:
 
         # Всегда показываем первую страницу при смене сортировки
         show_order_list(query, page=0, sort_by=sort_type)
+    elif query.data == 'search':
+        show_search_filters(query, context)
+    elif query.data.startswith('search_set_'):
+        request_search_filter(query, context)
+    elif query.data == 'search_reset':
+        context.user_data['search_filters'] = {}
+        show_search_filters(query, context)
+    elif query.data.startswith('search_page_'):
+        page = int(query.data.split('_')[2])
+        text, reply_markup = build_search_results(context.user_data.get('search_filters', {}), page)
+        query.edit_message_text(text=text, reply_markup=reply_markup)
 
     elif query.data.startswith('notify_user_'):
         # Обработчик уведомления пользователя
-        user_id = int(query.data.split('_')[2])
+        parts = query.data.split('_')
+        user_id = int(parts[2])
+        # В старых сообщениях ID платежа нет
+        payment_id = int(parts[3]) if len(parts) > 3 else None
+        if payment_id and not claim_for_action(query, 'withdrawal', payment_id):
+            return
+        if payment_id:
+            complete_payment(payment_id)
+            resolve_moderation_item('withdrawal', payment_id)
         try:
             context.bot.send_message(
                 chat_id=user_id,
-                text="✅ Средства были переведены на ваши реквизиты. Если вы не получили деньги, пожалуйста, обратитесь в поддержку бота - @kirillrakitin"
+                text=PAYOUT_NOTIFICATION
             )
             query.edit_message_text(text=query.message.text + "\n\n✅ Пользователь уведомлен")
         except Exception as e:
             logger.error(f"Ошибка уведомления пользователя: {e}")
             query.edit_message_text(text=query.message.text + "\n\n❌ Ошибка уведомления пользователя")
+    elif query.data.startswith('payout_paid_'):
+        confirm_payout_batch(query, context)
     elif query.data.startswith('confirm_deposit_'):
         confirm_deposit(update, context)
+    elif query.data.startswith('queue_'):
+        handle_queue_action(query)
     elif query.data == 'order_list':
         show_order_list(query)
     elif query.data.startswith('order_page_'):
@@ -2021,6 +5998,10 @@ def button(update: Update, context: CallbackContext) -> None:
         show_order_list(query, page=page)
     elif query.data == 'profile':
         show_profile(query)
+    elif query.data == 'history':
+        show_worker_history(query)
+    elif query.data.startswith('history_'):
+        show_worker_history(query, before_id=int(query.data.split('_')[1]))
     elif query.data == 'help':
         show_help(query)
     elif query.data == 'show_rules':
@@ -2033,11 +6014,19 @@ def button(update: Update, context: CallbackContext) -> None:
         show_client_order_details(query)
     elif query.data == 'create_order':
         start_order_creation(query, context)
+    elif query.data == 'bulk_orders':
+        start_bulk_orders(query, context)
+    elif query.data == 'bulk_confirm':
+        confirm_bulk_orders(query, context)
+    elif query.data == 'bulk_discard':
+        context.user_data.pop('bulk_orders', None)
+        query.edit_message_text(text="Создание заказов отменено.")
     elif query.data == 'deposit':
         start_deposit(update, context)
     elif query.data.startswith('order_'):
         order_id = int(query.data.split('_')[1])
-        if get_user_active_order(query.from_user.id, order_id):
+        excluded, _ = get_worker_exclusions(query.from_user.id)
+        if order_id in excluded:
             keyboard = [
                 [InlineKeyboardButton("📌 Мои заказы", callback_data='my_orders')],
                 [InlineKeyboardButton("🔙 Назад к списку", callback_data='order_list')]
@@ -2118,17 +6107,18 @@ def handle_message(update: Update, context: CallbackContext) -> None:
         elif step == 'quantity':
             try:
                 quantity = int(message_text)
-                if quantity <= 0:
+                if quantity <= 0 or quantity > ORDER_MAX_QUANTITY:
                     raise ValueError
                 context.user_data['creating_order']['quantity'] = quantity
                 context.user_data['creating_order']['step'] = 'deadline'
                 update.message.reply_text("4. Время на выполнение (в часах):")
             except ValueError:
-                update.message.reply_text("Пожалуйста, введите корректное количество (целое число больше 0).")
+                update.message.reply_text(
+                    f"Пожалуйста, введите корректное количество (целое число от 1 до {ORDER_MAX_QUANTITY}).")
         elif step == 'deadline':
             try:
                 deadline = int(message_text)
-                if deadline <= 0:
+                if deadline <= 0 or deadline > ORDER_MAX_DEADLINE:
                     raise ValueError
                 context.user_data['creating_order']['deadline'] = deadline
                 context.user_data['creating_order']['step'] = 'description'
@@ -2138,7 +6128,8 @@ def handle_message(update: Update, context: CallbackContext) -> None:
                     " \nВ отсутствии этой информации администратор может отклонить заказ. \nОбратите внимание,"
                     " что в качестве проверки ботом принимается только текст.")
             except ValueError:
-                update.message.reply_text("Пожалуйста, введите корректное время (целое число больше 0).")
+                update.message.reply_text(
+                    f"Пожалуйста, введите корректное время (целое число часов от 1 до {ORDER_MAX_DEADLINE}).")
         elif step == 'description':
             context.user_data['creating_order']['description'] = message_text
 
@@ -2178,6 +6169,10 @@ def handle_message(update: Update, context: CallbackContext) -> None:
     elif 'awaiting_rejection_reason' in context.user_data:
         handle_rejection_reason(update, context)
 
+    # Если пользователь вводит значение фильтра поиска
+    elif 'awaiting_search_filter' in context.user_data:
+        handle_search_filter_input(update, context)
+
     # Если пользователь в процессе вывода средств
     elif context.user_data.get('withdrawal_state') == 'amount':
         process_withdrawal_amount(update, context)
@@ -2185,13 +6180,559 @@ def handle_message(update: Update, context: CallbackContext) -> None:
         complete_withdrawal(update, context)
 
 
-def main() -> None:
-    """Основная функция"""
-    init_db()
-    updater = Updater(token)
-    dispatcher = updater.dispatcher
+# ========== ПАРАЛЛЕЛЬНЫЙ ДИСПЕТЧЕР ==========
+
+class ShardedDispatcher(Dispatcher):
+    """Диспетчер, который раскладывает обновления по потокам по id пользователя: разные пользователи
+    обрабатываются параллельно, а обновления одного пользователя — строго по порядку"""
+
+    def __init__(self, *args, shards=DISPATCH_SHARDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard_queues = [Queue(maxsize=DISPATCH_SHARD_QUEUE_SIZE) for _ in range(shards)]
+        self.shard_processed = [0] * shards
+        self.shard_high_watermark = [0] * shards
+        self.shard_threads = []
+
+    def start(self, ready=None):
+        for index in range(len(self.shard_queues)):
+            thread = threading.Thread(target=self._run_shard, args=(index,), name=f'dispatch_shard_{index}',
+                                      daemon=True)
+            thread.start()
+            self.shard_threads.append(thread)
+        super().start(ready)
+
+    def stop(self):
+        super().stop()
+        for shard_queue in self.shard_queues:
+            shard_queue.put(None)
+        for thread in self.shard_threads:
+            thread.join()
+        self.shard_threads = []
+
+    def process_update(self, update):
+        # Ошибки и служебные объекты из очереди обрабатываются как обычно
+        if not isinstance(update, Update):
+            super().process_update(update)
+            return
+
+        user = update.effective_user
+        index = user.id % len(self.shard_queues) if user else 0
+        shard_queue = self.shard_queues[index]
+        # Если поток пользователя не успевает, ждем: очередь вебхука заполнится и включит обратное давление
+        shard_queue.put(update)
+        depth = shard_queue.qsize()
+        if depth > self.shard_high_watermark[index]:
+            self.shard_high_watermark[index] = depth
+
+    def _run_shard(self, index):
+        shard_queue = self.shard_queues[index]
+        while True:
+            update = shard_queue.get()
+            if update is None:
+                break
+            try:
+                super().process_update(update)
+            except Exception:
+                logger.exception(f"Ошибка обработки обновления в потоке {index}")
+            self.shard_processed[index] += 1
+
+    def shard_metrics(self):
+        """Возвращает [(поток, глубина очереди, максимум глубины, обработано), ...]"""
+        return [(index, shard_queue.qsize(), self.shard_high_watermark[index], self.shard_processed[index])
+                for index, shard_queue in enumerate(self.shard_queues)]
+
+
+# ========== ТРАНСПОРТ BOT API ==========
+
+_bot_api_metrics = {
+    'requests': 0,
+    'errors': 0,
+    'overflow': 0,  # Запросов сверх пула: urllib3 открывает для них соединение и закрывает после ответа
+    'in_flight': 0,
+    'in_flight_high_watermark': 0,
+    'seconds': 0.0  # Суммарное время запросов
+}
+_bot_api_metrics_lock = threading.Lock()
+
+
+class BotApiRequest(Request):
+    """Транспорт Bot API: длинный опрос getUpdates через отдельное соединение,
+    остальные запросы — через общий пул с учетом его загрузки"""
+    __slots__ = ('_polling_request',)
+
+    def __init__(self):
+        super().__init__(con_pool_size=BOT_API_POOL_SIZE, connect_timeout=BOT_API_CONNECT_TIMEOUT,
+                         read_timeout=BOT_API_READ_TIMEOUT)
+        self._polling_request = Request(con_pool_size=1, connect_timeout=BOT_API_CONNECT_TIMEOUT,
+                                        read_timeout=BOT_API_READ_TIMEOUT)
+
+    def _tracked(self, call, *args):
+        """Выполняет запрос через общий пул и учитывает его загрузку"""
+        with _bot_api_metrics_lock:
+            _bot_api_metrics['requests'] += 1
+            if _bot_api_metrics['in_flight'] >= BOT_API_POOL_SIZE:
+                _bot_api_metrics['overflow'] += 1
+            _bot_api_metrics['in_flight'] += 1
+            _bot_api_metrics['in_flight_high_watermark'] = max(_bot_api_metrics['in_flight_high_watermark'],
+                                                               _bot_api_metrics['in_flight'])
+        started = time.monotonic()
+        try:
+            return call(*args)
+        except TelegramError:
+            with _bot_api_metrics_lock:
+                _bot_api_metrics['errors'] += 1
+            raise
+        finally:
+            with _bot_api_metrics_lock:
+                _bot_api_metrics['in_flight'] -= 1
+                _bot_api_metrics['seconds'] += time.monotonic() - started
+
+    def post(self, url, data, timeout=None):
+        if url.endswith('/getUpdates'):
+            return self._polling_request.post(url, data, timeout)
+        return self._tracked(super().post, url, data, timeout)
+
+    def retrieve(self, url, timeout=None):
+        # Через retrieve идет и download — загрузка выписок и файлов с заказами
+        return self._tracked(super().retrieve, url, timeout)
+
+    def stop(self):
+        super().stop()
+        self._polling_request.stop()
+
+
+def get_bot_api_metrics():
+    """Возвращает копию счетчиков транспорта Bot API"""
+    with _bot_api_metrics_lock:
+        return dict(_bot_api_metrics)
+
+
+# ========== РЕЖИМ ВЕБХУКА ==========
+
+_webhook_metrics = {
+    'received': 0,  # Всего запросов на путь вебхука
+    'enqueued': 0,  # Обновлений поставлено в очередь
+    'rejected_secret': 0,  # Неверный секретный токен
+    'rejected_full': 0,  # Отклонено с 503 из-за заполненной очереди
+    'invalid': 0,  # Некорректное тело запроса
+    'queue_high_watermark': 0  # Максимальная глубина очереди
+}
+_webhook_metrics_lock = threading.Lock()
+
+
+def _count_webhook(metric, queue_depth=None):
+    """Увеличивает счетчик вебхука и обновляет максимум глубины очереди"""
+    with _webhook_metrics_lock:
+        _webhook_metrics[metric] += 1
+        if queue_depth is not None and queue_depth > _webhook_metrics['queue_high_watermark']:
+            _webhook_metrics['queue_high_watermark'] = queue_depth
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """Принимает обновления от Telegram"""
+
+    def _reply(self, code, body=b'', content_type='text/plain', headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            self._reply(404)
+            return
+        _count_webhook('received')
+
+        secret = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+            _count_webhook('rejected_secret')
+            self._reply(403)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if not 0 < length <= WEBHOOK_MAX_BODY:
+                raise ValueError(f"размер тела {length}")
+            payload = json.loads(self.rfile.read(length))
+            if not isinstance(payload, dict):
+                raise ValueError("ожидался JSON-объект")
+            self.server.enqueue(payload)
+        except Full:
+            # Обратное давление: Telegram повторит доставку позже
+            _count_webhook('rejected_full')
+            self._reply(503, headers={'Retry-After': '1'})
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Некорректный запрос вебхука: {e}")
+            _count_webhook('invalid')
+            self._reply(400)
+            return
+
+        _count_webhook('enqueued', self.server.queue_depth())
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Вебхук {self.address_string()}: {format % args}")
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Отдает метрики очереди, диспетчера и транспорта на /metrics"""
+
+    _reply = WebhookRequestHandler._reply
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self._reply(404)
+            return
+
+        with _webhook_metrics_lock:
+            metrics = dict(_webhook_metrics)
+        lines = [f"webhook_{name}_total {value}" for name, value in metrics.items() if name != 'queue_high_watermark']
+        lines += [
+            f"webhook_queue_high_watermark {metrics['queue_high_watermark']}",
+            f"webhook_queue_depth {self.server.queue_depth()}",
+            f"webhook_queue_capacity {WEBHOOK_QUEUE_SIZE * BOT_PROCESSES}"
+        ]
+        if isinstance(self.server.dispatcher, ShardedDispatcher):
+            for index, depth, high_watermark, processed in self.server.dispatcher.shard_metrics():
+                lines += [
+                    f'dispatch_shard_queue_depth{{shard="{index}"}} {depth}',
+                    f'dispatch_shard_queue_high_watermark{{shard="{index}"}} {high_watermark}',
+                    f'dispatch_shard_processed_total{{shard="{index}"}} {processed}'
+                ]
+        for (counter, helper, reason), value in sorted(get_db_retry_stats().items()):
+            lines.append(f'db_retry_{counter}_total{{helper="{helper}",reason="{reason}"}} {value}')
+        bot_api = get_bot_api_metrics()
+        lines += [
+            f"bot_api_requests_total {bot_api['requests']}",
+            f"bot_api_errors_total {bot_api['errors']}",
+            f"bot_api_pool_overflow_total {bot_api['overflow']}",
+            f"bot_api_request_seconds_total {bot_api['seconds']:.3f}",
+            f"bot_api_in_flight {bot_api['in_flight']}",
+            f"bot_api_in_flight_high_watermark {bot_api['in_flight_high_watermark']}",
+            f"bot_api_pool_size {BOT_API_POOL_SIZE}"
+        ]
+        self._reply(200, ('\n'.join(lines) + '\n').encode(), 'text/plain; version=0.0.4')
+
+    def log_message(self, format, *args):
+        logger.debug(f"Метрики {self.address_string()}: {format % args}")
+
+
+def build_updater(persistence=None, mode=BOT_MODE, shards=DISPATCH_SHARDS):
+    """Создает Updater: для вебхука — с ограниченной очередью обновлений, при DISPATCH_SHARDS —
+    с параллельным диспетчером"""
+    bot = Bot(token, request=BotApiRequest())
+    if mode != 'webhook' and not shards:
+        return Updater(bot=bot, workers=DISPATCHER_WORKERS, persistence=persistence)
+
+    update_queue = Queue(maxsize=WEBHOOK_QUEUE_SIZE if mode == 'webhook' else 0)
+    if shards:
+        dispatcher = ShardedDispatcher(bot, update_queue, workers=DISPATCHER_WORKERS, job_queue=JobQueue(),
+                                       persistence=persistence, shards=shards)
+    else:
+        dispatcher = Dispatcher(bot, update_queue, workers=DISPATCHER_WORKERS, job_queue=JobQueue(),
+                                persistence=persistence)
+    # Updater запрещает передавать dispatcher вместе с workers, а по умолчанию workers=4
+    return Updater(dispatcher=dispatcher, workers=None)
+
+
+def check_startup():
+    """Собирает Updater во всех режимах запуска без обращения к сети и базе.
+
+    Ошибки сборки проявляются при старте (и в python main.py --check), а не в процессах-обработчиках.
+    """
+    for mode, shards in (('polling', 0), ('webhook', 0), (BOT_MODE, DISPATCH_SHARDS or 2)):
+        updater = build_updater(mode=mode, shards=shards)
+        setup_dispatcher(updater.dispatcher)
+        updater.bot.request.stop()
+
+
+def register_webhook(bot):
+    """Регистрирует адрес вебхука в Telegram"""
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужно указать WEBHOOK_URL")
+
+    # В этой версии библиотеки у set_webhook нет параметра secret_token, передаем его напрямую в Bot API
+    bot.set_webhook(url=WEBHOOK_URL, api_kwargs={'secret_token': WEBHOOK_SECRET})
+
+
+def serve_webhook(enqueue, queue_depth, dispatcher=None):
+    """Принимает обновления встроенным HTTP-сервером до SIGTERM/SIGINT.
+
+    enqueue(payload) ставит обновление в очередь или выбрасывает queue.Full, queue_depth() — глубина очередей.
+    """
+    server = ThreadingHTTPServer((WEBHOOK_LISTEN, WEBHOOK_PORT), WebhookRequestHandler)
+    server.daemon_threads = True
+    server.enqueue = enqueue
+    server.queue_depth = queue_depth
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = ThreadingHTTPServer((METRICS_LISTEN, METRICS_PORT), MetricsRequestHandler)
+        metrics_server.daemon_threads = True
+        metrics_server.queue_depth = queue_depth
+        metrics_server.dispatcher = dispatcher
+        threading.Thread(target=metrics_server.serve_forever, name='metrics', daemon=True).start()
+        logger.info(f"Метрики доступны на {METRICS_LISTEN}:{METRICS_PORT}/metrics")
+
+    def stop(signum, frame):
+        # shutdown() ждет завершения serve_forever, поэтому вызываем его из другого потока
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Вебхук слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if metrics_server:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+
+
+def run_webhook(updater):
+    """Регистрирует вебхук и обслуживает его встроенным HTTP-сервером до остановки процесса"""
+    register_webhook(updater.bot)
+    update_queue = updater.dispatcher.update_queue
+
+    updater.job_queue.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True)
+    dispatcher_thread.start()
+    try:
+        serve_webhook(lambda payload: update_queue.put_nowait(Update.de_json(payload, updater.bot)),
+                      update_queue.qsize, updater.dispatcher)
+    finally:
+        updater.job_queue.stop()
+        updater.dispatcher.stop()
+        dispatcher_thread.join()
+
+
+# ========== НЕСКОЛЬКО ПРОЦЕССОВ ==========
+
+def _encode_user_data_value(value):
+    """Кодирует в JSON значения user_data, которых нет в JSON: деньги и даты должны вернуться тем же типом"""
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"значение типа {type(value).__name__} нельзя сохранить в user_data")
+
+
+def _decode_user_data_value(obj):
+    """Восстанавливает значения, закодированные _encode_user_data_value"""
+    if len(obj) == 1:
+        if '__decimal__' in obj:
+            return Decimal(obj['__decimal__'])
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+class MySQLPersistence(BasePersistence):
+    """Хранит user_data и состояния диалогов в базе, чтобы они переживали перезапуск и смену числа процессов.
+    Каждый процесс загружает только своих пользователей (user_id % partitions == partition)"""
+
+    def __init__(self, partition, partitions):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.partition = partition
+        self.partitions = partitions
+        self.saved_user_data = {}  # user_id -> последний сохраненный JSON, чтобы не писать без изменений
+
+    def get_user_data(self):
+        user_data = defaultdict(dict)
+        for user_id, data in load_partition_user_data(self.partition, self.partitions).items():
+            user_data[user_id] = json.loads(data, object_hook=_decode_user_data_value)
+            self.saved_user_data[user_id] = data
+        return user_data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        return load_partition_conversations(name, self.partition, self.partitions)
+
+    def update_user_data(self, user_id, data):
+        try:
+            serialized = json.dumps(data, sort_keys=True, default=_encode_user_data_value)
+        except (TypeError, ValueError) as e:
+            # Несохраненные данные остаются в памяти процесса, но не переживут перезапуск
+            logger.error(f"Не удалось сохранить user_data пользователя {user_id}: {e}")
+            return
+        if self.saved_user_data.get(user_id) != serialized and save_user_data(user_id, serialized):
+            self.saved_user_data[user_id] = serialized
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def update_conversation(self, name, key, new_state):
+        save_conversation(name, key, new_state)
+
+
+_seen_cache_versions = {}
+_feed_changes_seen = {'last_id': None}
+
+
+def sync_caches_job(context: CallbackContext):
+    """Сбрасывает кэши, измененные другими процессами, и подгружает новые ссылки в фильтр Блума"""
+    versions = get_cache_versions()
+    if versions is None:
+        return
+
+    for cache_name, version in versions.items():
+        previous = _seen_cache_versions.get(cache_name)
+        _seen_cache_versions[cache_name] = version
+        if previous is None or previous == version:
+            continue
+        if cache_name == 'feed':
+            _reset_local_feed_cache()
+        elif cache_name == 'orders':
+            _reset_local_order_cache()
+
+    apply_feed_changes()
+
+    if _link_bloom_loaded:
+        load_new_link_hashes()
+
+
+def apply_feed_changes():
+    """Применяет к ленте этого процесса заказы, измененные другими процессами"""
+    result = get_feed_changes(_feed_changes_seen['last_id'], FEED_CHANGES_BATCH)
+    if result is None:
+        return
+    changes, first_id, last_id = result
+    seen_id = _feed_changes_seen['last_id']
+    if seen_id is None:
+        # Первая сверка: лента и так загружается из базы, достаточно запомнить, где журнал сейчас
+        _feed_changes_seen['last_id'] = last_id or 0
+        return
+    if len(changes) >= FEED_CHANGES_BATCH or (first_id is not None and first_id > seen_id + 1):
+        # Отстали дальше, чем хранится журнал, или изменений слишком много — перезагружаем ленту целиком
+        _reset_local_feed_cache()
+        _feed_changes_seen['last_id'] = last_id or seen_id
+        return
+
+    pid = os.getpid()
+    order_ids = {}
+    for change in changes:
+        if change['process_id'] == pid:
+            continue
+        if change['worker_id'] is not None:
+            with _feed_cache_lock:
+                _worker_exclusions.pop(change['worker_id'], None)
+        if change['order_id'] is not None:
+            order_ids[change['order_id']] = True
+    for order_id in order_ids:
+        feed_refresh_order(order_id)
+    if changes:
+        _feed_changes_seen['last_id'] = changes[-1]['change_id']
+
+
+def prune_feed_changes_job(context: CallbackContext):
+    """Периодически очищает журнал изменений ленты"""
+    prune_feed_changes()
+
+
+def _update_user_id(payload):
+    """Достает id пользователя из обновления Telegram (JSON), 0 — если пользователя нет"""
+    for key, value in payload.items():
+        if key != 'update_id' and isinstance(value, dict):
+            sender = value.get('from') or value.get('user') or value.get('chat') or {}
+            return sender.get('id', 0)
+    return 0
+
+
+def run_worker_process(partition, update_source):
+    """Процесс бота: обрабатывает обновления своих пользователей из очереди входного процесса"""
+    # Остановкой управляет входной процесс: он присылает None после закрытия HTTP-сервера
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    updater = build_updater(persistence=MySQLPersistence(partition, BOT_PROCESSES))
+    setup_dispatcher(updater.dispatcher)
+    # Периодические задачи выполняет только первый процесс, синхронизацию кэшей — все
+    schedule_jobs(updater.job_queue, periodic=partition == 0)
+
+    updater.job_queue.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True)
+    dispatcher_thread.start()
+    logger.info(f"Процесс {partition} из {BOT_PROCESSES} запущен")
+
+    try:
+        while True:
+            payload = update_source.get()
+            if payload is None:
+                break
+            try:
+                update = Update.de_json(payload, updater.bot)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Некорректное обновление: {e}")
+                continue
+            updater.dispatcher.update_queue.put(update)
+    finally:
+        updater.job_queue.stop()
+        updater.dispatcher.stop()
+        dispatcher_thread.join()
+
+
+def run_multiprocess():
+    """Запускает BOT_PROCESSES процессов бота за одним вебхуком и раздает им обновления по id пользователя"""
+    if BOT_MODE != 'webhook':
+        raise RuntimeError("Несколько процессов работают только в режиме вебхука (BOT_MODE=webhook)")
+
+    # Процессы-обработчики падают молча, поэтому сборку их Updater проверяем до запуска
+    check_startup()
+    register_webhook(Bot(token))
+    queues = [multiprocessing.Queue(maxsize=WEBHOOK_QUEUE_SIZE) for _ in range(BOT_PROCESSES)]
+    processes = [
+        multiprocessing.Process(target=run_worker_process, args=(partition, queues[partition]),
+                                name=f'bot_worker_{partition}')
+        for partition in range(BOT_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+
+    def enqueue(payload):
+        # Все обновления пользователя идут в один процесс: его диалоги и user_data живут там
+        queues[_update_user_id(payload) % BOT_PROCESSES].put_nowait(payload)
+
+    try:
+        serve_webhook(enqueue, lambda: sum(update_queue.qsize() for update_queue in queues))
+    finally:
+        for update_queue in queues:
+            update_queue.put(None)
+        for process in processes:
+            process.join()
+
+
+def setup_dispatcher(dispatcher):
+    """Регистрирует обработчики бота"""
+    # Состояния диалогов сохраняются в базе, если процессов несколько (MySQLPersistence)
+    persistent = dispatcher.persistence is not None
+    _event_context['bot'] = dispatcher.bot
 
     dispatcher.add_handler(CommandHandler("start", start))
+    dispatcher.add_handler(CommandHandler("search", search_command))
+    dispatcher.add_handler(CommandHandler("queue", queue_command))
+    dispatcher.add_handler(CommandHandler("reconcile", reconcile_command))
+    dispatcher.add_handler(CommandHandler("payouts", payouts_command))
+    dispatcher.add_handler(CommandHandler("stats", stats_command))
+    dispatcher.add_handler(CommandHandler("duplicates", duplicates_command))
+    dispatcher.add_handler(InlineQueryHandler(inline_query))
 
     # Обработчик вывода средств
     withdrawal_conv = ConversationHandler(
@@ -2209,7 +6750,9 @@ def main() -> None:
         fallbacks=[
             CallbackQueryHandler(cancel_withdrawal, pattern='^cancel_withdraw$'),
             CommandHandler('cancel', cancel_withdrawal)
-        ]
+        ],
+        name='withdrawal',
+        persistent=persistent
     )
 
     # Обработчик пополнения баланса
@@ -2228,17 +6771,55 @@ def main() -> None:
         },
         fallbacks=[
             CommandHandler('cancel', cancel_deposit)
-        ]
+        ],
+        name='deposit',
+        persistent=persistent
     )
 
     dispatcher.add_handler(withdrawal_conv)
     dispatcher.add_handler(deposit_conv)
     dispatcher.add_handler(CallbackQueryHandler(button))
     dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
+    dispatcher.add_handler(MessageHandler(Filters.document, handle_document))
     dispatcher.add_error_handler(error_handler)
 
-    updater.start_polling()
-    updater.idle()
+
+def schedule_jobs(job_queue, periodic=True):
+    """Планирует периодические задачи. periodic=False — только синхронизация кэшей между процессами"""
+    if periodic:
+        job_queue.run_repeating(expire_assignments_job, interval=DEADLINE_CHECK_INTERVAL, first=DEADLINE_CHECK_INTERVAL)
+        job_queue.run_repeating(deadline_reminders_job, interval=REMINDER_CHECK_INTERVAL,
+                                first=REMINDER_CHECK_INTERVAL)
+        job_queue.run_repeating(stale_reviews_job, interval=REVIEW_SWEEP_INTERVAL, first=REVIEW_SWEEP_INTERVAL)
+        if BOT_PROCESSES > 1:
+            job_queue.run_repeating(prune_feed_changes_job, interval=FEED_CHANGES_RETENTION,
+                                    first=FEED_CHANGES_RETENTION)
+    job_queue.run_repeating(reconcile_feed_job, interval=FEED_RECONCILE_INTERVAL, first=FEED_RECONCILE_INTERVAL)
+    if BOT_PROCESSES > 1:
+        job_queue.run_repeating(sync_caches_job, interval=CACHE_SYNC_INTERVAL, first=0)
+
+
+def main() -> None:
+    """Основная функция"""
+    if '--check' in sys.argv[1:]:
+        check_startup()
+        logger.info("Проверка запуска пройдена")
+        return
+
+    init_db()
+    if BOT_PROCESSES > 1:
+        run_multiprocess()
+        return
+
+    updater = build_updater()
+    setup_dispatcher(updater.dispatcher)
+    schedule_jobs(updater.job_queue)
+
+    if BOT_MODE == 'webhook':
+        run_webhook(updater)
+    else:
+        updater.start_polling(timeout=BOT_API_POLL_TIMEOUT)
+        updater.idle()
 
 
 if __name__ == '__main__':